@@ -42,7 +42,7 @@ def _setup_database_url_from_vcap():
 
 _setup_database_url_from_vcap()
 
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 import io
 import json
@@ -60,6 +60,8 @@ import sqlite3
 from db import get_conn, init_db
 from services.openai_service import OpenAIService
 from services.rag_service import RAGService
+from services import corpus_cache, document_catalog, scope_map_cache
+from services.embedding_migration import EmbeddingFormatMigration
 from services.spec_service import SpecService
 from services.prompt_service import PromptService
 from services.code_service import CodeService
@@ -67,10 +69,12 @@ from services.test_service import TestService
 from services.advisor_service import AdvisorService
 from services.code_repository_service import CodeRepositoryService
 from services.btp_service import BTPService, BtpODataError
+from services import http_transport
 from services import role_service
 from services import user_service
 from services.github_service import GitHubService
 from services.scope_service import ScopeService
+from services.calm_mirror_service import CalmMirrorService, to_local_naive
 from config.prompts import get_all_prompts, get_prompt, update_prompt
 from config.sap_modules import normalize_module, taxonomy_payload
 
@@ -109,6 +113,10 @@ JWT_EXPIRY_DAYS = 7
 
 # ── PostgreSQL user database (via db.py) ────────────────────────────────────
 init_db()
+# Before any request: the Document Hub reads only the catalog.
+document_catalog.ensure_built()
+# Preload the scope → module map the classifier consults on every ingest.
+scope_map_cache.refresh()
 
 # ── JWT helper ──────────────────────────────────────────────────────────────
 def create_token(user_id: str, email: str) -> str:
@@ -243,12 +251,14 @@ def get_llm_provider_for_user(user_id: Optional[str], agent_id: Optional[str] =
 # Initialize services
 openai_service = OpenAIService()
 rag_service = RAGService()
+embedding_migration = EmbeddingFormatMigration(RAGService.EMBEDDING_MODEL)
 spec_service = SpecService()
 prompt_service = PromptService()
 code_service = CodeService()
 test_service = TestService()
 advisor_service = AdvisorService()
 scope_service = ScopeService()
+calm_mirror = CalmMirrorService()
 
 @app.before_request
 def log_request_info():
@@ -290,6 +300,11 @@ def health():
         "db_url": db_url_hint,
         "document_count": doc_count,
         "db_error": db_error,
+        "embedding_cache": rag_service.embedding_cache.stats(),
+        "vector_index": rag_service.vector_index.stats(),
+        "embedding_migration": embedding_migration.stats(),
+        "http": http_transport.stats(),
+        "corpus_cache": corpus_cache.stats(),
         "env": {
             "DATABASE_URL_set": bool(os.getenv("DATABASE_URL")),
             "OPENAI_API_KEY_set": bool(os.getenv("OPENAI_API_KEY")),
@@ -494,9 +509,29 @@ def ask_yoda():
         
         if not query:
             return jsonify({"error": "Query is required"}), 400
+
+        # Optional retrieval scope. Latest versions only unless asked otherwise,
+        # matching the Document Hub default — superseded versions otherwise take
+        # top-k slots from the current ones.
+        scope = data.get('filters') or {}
+        modules = scope.get('module')
+        if modules:
+            modules = modules if isinstance(modules, list) else [modules]
+            normalized = [normalize_module(m) for m in modules]
+            unknown = [m for m, n in zip(modules, normalized) if not n]
+            if unknown:
+                return jsonify({"error": f"Unknown SAP module '{unknown[0]}'"}), 400
+            modules = normalized
+        filters = {
+            'project_id': scope.get('projectId'),
+            'sap_module': modules,
+            'doc_type': scope.get('docType'),
+            'is_latest': scope.get('isLatest', True),
+            'is_placeholder': scope.get('isPlaceholder'),
+        }
         
         # Use RAG to get relevant context and generate answer
-        result = rag_service.query(query, llm_provider=llm_provider)
+        result = rag_service.query(query, llm_provider=llm_provider, filters=filters)
         if llm_provider == 'ai_core':
             print(f"ASK_YODA_AI_CORE: query_completed answer_length={len(result.get('answer') or '')}")
         
@@ -577,6 +612,8 @@ def list_documents():
         date_to = request.args.get('date_to', '').strip()
         latest_only = request.args.get('latest_only', 'true').lower() != 'false'
         sort = request.args.get('sort', RAGService.DEFAULT_SORT).strip()
+        # next_cursor from the previous page: keyset pagination, same filters.
+        cursor = request.args.get('cursor', '').strip() or None
 
         if module and not normalize_module(module):
             return jsonify({"error": f"Unknown SAP module '{module}'"}), 400
@@ -598,8 +635,11 @@ def list_documents():
             date_to=date_to,
             latest_only=latest_only,
             sort=sort,
+            cursor=cursor,
         )
         return jsonify(result)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -1193,6 +1233,7 @@ def mcp_health():
 
 from services import source_config_service
 from services.calm_service import get_calm_service
+from services.sync_job_service import SyncJobService
 from services.markdown_utils import markdown_to_html
 from html import escape, unescape
 import re
@@ -1594,6 +1635,64 @@ def delete_user(user_id):
 # Cloud ALM Browser Endpoints
 # ============================================================================
 
+def _decorate_calm_document(doc: dict) -> dict:
+    """Tag a CALM document for the browser and sync UIs"""
+    doc['itemType'] = 'document'
+    if 'name' not in doc and 'title' in doc:
+        doc['name'] = doc['title']
+    return doc
+
+
+def _decorate_calm_test_case(tc: dict) -> dict:
+    """Shape a CALM manual test case like a document row"""
+    tc['itemType'] = 'test_case'
+    tc['name'] = tc.get('title', 'Untitled Test Case')
+    tc['id'] = tc.get('uuid', tc.get('id'))
+    tc['type'] = 'Manual Test Case'
+    tc['documentTypeCode'] = 'TEST_CASE'
+    return tc
+
+
+def _decorate_calm_requirement(req: dict) -> dict:
+    """Shape a CALM requirement task like a document row"""
+    req['itemType'] = 'requirement'
+    req['name'] = req.get('title', 'Untitled Requirement')
+    req['id'] = req.get('id')
+    req['type'] = 'Requirement'
+    req['documentTypeCode'] = 'REQUIREMENT'
+    if req.get('source'):
+        req['requirementSource'] = req.get('source')
+    if not req.get('modifiedAt'):
+        req['modifiedAt'] = req.get('lastChangedDate')
+    req['updatedOn'] = req.get('modifiedAt') or req.get('lastChangedDate')
+    return req
+
+
+def _wants_live() -> bool:
+    """?live=true skips the local CALM mirror and asks Cloud ALM directly"""
+    return request.args.get('live', 'false').lower() == 'true'
+
+
+def _wants_ndjson() -> bool:
+    """Listing routes stream NDJSON for ?format=ndjson or Accept: application/x-ndjson"""
+    return (
+        request.args.get('format', '').lower() == 'ndjson'
+        or 'application/x-ndjson' in request.headers.get('Accept', '')
+    )
+
+
+def _ndjson_response(lines) -> Response:
+    """Stream an iterable of dicts, one JSON object per line.
+
+    Items go out as CALM pages arrive, so the client can render the first rows
+    of a 5k-item project while the rest are still being fetched.
+    """
+    def generate():
+        for line in lines:
+            yield json.dumps(line, default=str) + "\n"
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
 @app.route('/api/calm/<source_id>/projects', methods=['GET'])
 def calm_list_projects(source_id):
     """List projects from Cloud ALM"""
@@ -1624,14 +1723,25 @@ def calm_list_scopes(source_id):
             return jsonify({"error": "Source not found"}), 404
         
         service = get_calm_service(source.get('config'))
-        scopes = service.list_scopes(project_id)
+        refreshed = True
+        scopes = None
+        if not _wants_live():
+            try:
+                refreshed = calm_mirror.ensure_fresh(service, source_id, project_id, 'scope')
+                scopes = calm_mirror.list_items(service, source_id, project_id, 'scope', refresh=False)
+            except Exception as e:
+                print(f"WARNING: CALM mirror unavailable for scopes, going live: {e}")
+                refreshed = True
+        if scopes is None:
+            scopes = service.list_scopes(project_id)
 
         # Cache them so the classifier's deterministic layer has something to map
         # against. Best-effort: a cache miss degrades classification, not this call.
-        try:
-            scope_service.sync_scopes(project_id, scopes)
-        except Exception as e:
-            print(f"WARNING: scope cache sync failed for project {project_id}: {e}")
+        if refreshed:
+            try:
+                scope_service.sync_scopes(project_id, scopes)
+            except Exception as e:
+                print(f"WARNING: scope cache sync failed for project {project_id}: {e}")
 
         return jsonify({"scopes": scopes})
     except Exception as e:
@@ -1677,6 +1787,28 @@ def calm_list_documents(source_id):
             return jsonify({"error": "Source not found"}), 404
         
         service = get_calm_service(source.get('config'))
+
+        if project_id and not _wants_live():
+            try:
+                result = _mirrored_calm_documents(
+                    service, source_id, project_id, doc_type, scope_id,
+                    include_test_cases, latest_only,
+                )
+            except Exception as e:
+                print(f"WARNING: CALM mirror unavailable for documents, going live: {e}")
+                result = None
+            if result is not None:
+                if _wants_ndjson():
+                    return _ndjson_response(_listing_lines(result, (
+                        ('document', 'documents'), ('testCase', 'testCases'),
+                    )))
+                return jsonify(result)
+
+        if _wants_ndjson():
+            return _ndjson_response(_stream_calm_documents(
+                service, process_id, doc_type, project_id, scope_id,
+                include_test_cases, latest_only,
+            ))
         
         # Fetch documents
         result = service.list_documents(  # Returns {documents, isDemo, error?}
@@ -1698,11 +1830,7 @@ def calm_list_documents(source_id):
                 print(f"DEBUG: Fetched {len(test_cases)} test cases")
                 # Add type indicator to test cases
                 for tc in test_cases:
-                    tc['itemType'] = 'test_case'
-                    tc['name'] = tc.get('title', 'Untitled Test Case')
-                    tc['id'] = tc.get('uuid', tc.get('id'))
-                    tc['type'] = 'Manual Test Case'
-                    tc['documentTypeCode'] = 'TEST_CASE'
+                    _decorate_calm_test_case(tc)
             except Exception as e:
                 print(f"ERROR fetching test cases: {e}")
                 import traceback
@@ -1712,9 +1840,7 @@ def calm_list_documents(source_id):
         # Add type indicator to documents
         documents = result.get('documents', [])
         for doc in documents:
-            doc['itemType'] = 'document'
-            if 'name' not in doc and 'title' in doc:
-                doc['name'] = doc['title']
+            _decorate_calm_document(doc)
         
         # Combine results
         result['testCases'] = test_cases
@@ -1728,6 +1854,104 @@ def calm_list_documents(source_id):
         return jsonify({"error": str(e)}), 500
 
 
+def _mirrored_calm_documents(service, source_id, project_id, doc_type, scope_id,
+                             include_test_cases, latest_only) -> dict:
+    """calm_list_documents' response, answered from the local CALM mirror"""
+    documents = calm_mirror.list_items(
+        service, source_id, project_id, 'document',
+        latest_only=latest_only, doc_type=doc_type,
+    )
+    for doc in documents:
+        _decorate_calm_document(doc)
+
+    test_cases = []
+    if include_test_cases:
+        try:
+            test_cases = calm_mirror.list_items(
+                service, source_id, project_id, 'test_case', scope_id=scope_id,
+            )
+            for tc in test_cases:
+                _decorate_calm_test_case(tc)
+        except Exception as e:
+            # Continue even if test cases fail
+            print(f"ERROR fetching test cases: {e}")
+
+    return {
+        'documents': documents,
+        'isDemo': False,
+        'testCases': test_cases,
+        'totalDocuments': len(documents),
+        'totalTestCases': len(test_cases),
+        'mirroredAt': calm_mirror.refreshed_at(source_id, project_id, 'document'),
+    }
+
+
+def _listing_lines(result: dict, kinds):
+    """NDJSON lines for an already-built listing: its items, then the rest as a summary.
+
+    kinds pairs each line type with the result key holding those items.
+    """
+    for line_type, key in kinds:
+        for item in result.get(key, []):
+            yield {'type': line_type, 'item': item}
+    summary = {k: v for k, v in result.items() if k not in {key for _, key in kinds}}
+    yield {'type': 'summary', **summary}
+
+
+def _stream_calm_documents(service, process_id, doc_type, project_id, scope_id,
+                           include_test_cases, latest_only):
+    """NDJSON lines for calm_list_documents: documents, then test cases, then a summary.
+
+    Each line is {"type": "document" | "testCase", "item": {...}}; the last is
+    {"type": "summary", ...} with the same totals the JSON response carries.
+    """
+    total_documents = 0
+    total_test_cases = 0
+    is_demo = False
+    error = None
+    try:
+        for doc in service.iter_documents(
+            process_id=process_id,
+            document_type=doc_type,
+            project_id=project_id,
+            latest_only=latest_only,
+        ):
+            total_documents += 1
+            yield {'type': 'document', 'item': _decorate_calm_document(doc)}
+    except Exception as e:
+        error = str(e)
+        print(f"Error streaming documents: {e}")
+        if total_documents:
+            yield {'type': 'error', 'error': error}
+            return
+        # Nothing sent yet: same demo fallback as the JSON listing
+        is_demo = True
+        for doc in service._get_demo_documents():
+            if latest_only and not doc.get('isLatest', True):
+                continue
+            total_documents += 1
+            yield {'type': 'document', 'item': _decorate_calm_document(doc)}
+
+    if include_test_cases and project_id:
+        try:
+            for tc in service.iter_manual_test_cases(project_id=project_id, scope_id=scope_id):
+                total_test_cases += 1
+                yield {'type': 'testCase', 'item': _decorate_calm_test_case(tc)}
+        except Exception as e:
+            # Continue even if test cases fail
+            print(f"ERROR streaming test cases: {e}")
+
+    summary = {
+        'type': 'summary',
+        'isDemo': is_demo,
+        'totalDocuments': total_documents,
+        'totalTestCases': total_test_cases,
+    }
+    if error:
+        summary['error'] = error
+    yield summary
+
+
 @app.route('/api/calm/<source_id>/requirements', methods=['GET'])
 def calm_list_requirements(source_id):
     """List requirements (CALMREQU tasks) from Cloud ALM"""
@@ -1741,30 +1965,48 @@ def calm_list_requirements(source_id):
             return jsonify({"error": "Source not found"}), 404
 
         service = get_calm_service(source.get('config'))
-        requirements = service.list_requirements(project_id)
+
+        requirements = None
+        if not _wants_live():
+            try:
+                requirements = calm_mirror.list_items(service, source_id, project_id, 'requirement')
+            except Exception as e:
+                print(f"WARNING: CALM mirror unavailable for requirements, going live: {e}")
+        if requirements is None:
+            if _wants_ndjson():
+                return _ndjson_response(_stream_calm_requirements(service, project_id))
+            requirements = service.list_requirements(project_id)
 
         for req in requirements:
-            req['itemType'] = 'requirement'
-            req['name'] = req.get('title', 'Untitled Requirement')
-            req['id'] = req.get('id')
-            req['type'] = 'Requirement'
-            req['documentTypeCode'] = 'REQUIREMENT'
-            if req.get('source'):
-                req['requirementSource'] = req.get('source')
-            if not req.get('modifiedAt'):
-                req['modifiedAt'] = req.get('lastChangedDate')
-            req['updatedOn'] = req.get('modifiedAt') or req.get('lastChangedDate')
+            _decorate_calm_requirement(req)
 
-        return jsonify({
+        result = {
             'requirements': requirements,
             'totalRequirements': len(requirements),
-        })
+        }
+        if _wants_ndjson():
+            return _ndjson_response(_listing_lines(result, (('requirement', 'requirements'),)))
+        return jsonify(result)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 
+def _stream_calm_requirements(service, project_id):
+    """NDJSON lines for calm_list_requirements, ending with a summary line."""
+    total = 0
+    try:
+        for req in service.iter_requirements(project_id):
+            total += 1
+            yield {'type': 'requirement', 'item': _decorate_calm_requirement(req)}
+    except Exception as e:
+        print(f"Error streaming requirements: {e}")
+        yield {'type': 'error', 'error': str(e)}
+        return
+    yield {'type': 'summary', 'totalRequirements': total}
+
+
 @app.route('/api/calm/<source_id>/documents/<document_id>/versions', methods=['GET'])
 def calm_list_document_versions(source_id, document_id):
     """List all versions of a Cloud ALM document."""
@@ -2140,32 +2382,208 @@ def btp_generate_code():
 
 @app.route('/api/sync/check', methods=['POST'])
 def check_sync_status():
-    """Check which documents are already synced"""
+    """Check which documents are already synced.
+
+    With sourceId and projectId, also reports what changed in CALM since the
+    last sync, from the local mirror: "new" items were never synced, "changed"
+    items were modified in CALM after they were synced.
+    """
     try:
         data = request.json
         document_ids = data.get('documentIds', [])
+        source_id = data.get('sourceId')
+        project_id = data.get('projectId')
         
-        if not document_ids:
+        if not document_ids and not (source_id and project_id):
             return jsonify({"error": "documentIds array is required"}), 400
         
-        # Check each document
-        sync_status = {}
-        for doc_id in document_ids:
-            is_synced = rag_service.check_document_exists(doc_id)
-            sync_status[doc_id] = is_synced
+        document_status = rag_service.get_sync_status(document_ids)
         
-        return jsonify({
-            "syncStatus": sync_status
-        })
+        response = {
+            # id -> bool, as the sync UI has always read it
+            "syncStatus": {doc_id: info['synced'] for doc_id, info in document_status.items()},
+            "documentStatus": document_status,
+        }
+        if source_id and project_id:
+            source = source_config_service.get_source(source_id)
+            if not source:
+                return jsonify({"error": "Source not found"}), 404
+            response["changes"] = _calm_changes_since_sync(
+                get_calm_service(source.get('config')), source_id, project_id
+            )
+        return jsonify(response)
     except Exception as e:
         import traceback
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
 
 
+def _calm_changes_since_sync(service, source_id: str, project_id: str) -> dict:
+    """New and changed CALM items of a project, mirror modifiedAt vs documents.synced_on."""
+    for item_type in ('document', 'test_case', 'requirement'):
+        try:
+            calm_mirror.ensure_fresh(service, source_id, project_id, item_type)
+        except Exception as e:
+            print(f"WARNING: could not refresh CALM mirror of {item_type}s: {e}")
+    mirrored = calm_mirror.modified_index(source_id, project_id)
+    status = rag_service.get_sync_status(list(mirrored))
+
+    new, changed = [], []
+    for item_id, (item_type, modified_at) in mirrored.items():
+        stored = status[item_id]
+        if not stored['synced']:
+            new.append(item_id)
+            continue
+        synced_on = to_local_naive(stored['syncedOn'])
+        modified = to_local_naive(modified_at)
+        # updatedOn is the modifiedAt we ingested. Metadata-only changes
+        # re-sync without touching synced_on, so without this check they
+        # would read as changed forever.
+        if modified and synced_on and modified > synced_on and modified_at != stored['updatedOn']:
+            changed.append(item_id)
+    return {
+        'new': new,
+        'changed': changed,
+        'unchanged': len(mirrored) - len(new) - len(changed),
+    }
+
+
+def _fetch_sync_content(calm_service_instance, sync_source_type: str, doc: dict, synced_by=None):
+    """Fetch stage of a sync: normalize one CALM item and pull its content.
+
+    Network only — runs on the sync job's fetch pool, in parallel with the
+    ingest of documents fetched earlier. Returns (normalized_doc, html_content);
+    html_content is None when the item has no retrievable content.
+    """
+    # Normalize document structure to handle both old and new API formats
+    normalized_doc = _normalize_document_structure(doc)
+    # Stamp who triggered the sync if the doc has no modifier info
+    if synced_by and not normalized_doc['metadata'].get('updatedBy'):
+        normalized_doc['metadata']['updatedBy'] = synced_by
+    doc_id = normalized_doc.get('id')
+    item_type = doc.get('itemType') or doc.get('metadata', {}).get('itemType')
+
+    # Try to fetch real content from CALM
+    html_content = None
+    try:
+        if item_type == 'requirement' or doc.get('type') == 'CALMREQU' or doc.get('documentTypeCode') == 'REQUIREMENT':
+            calm_task = calm_service_instance.get_task(doc_id)
+            description = calm_task.get('description') or ''
+            if description:
+                html_content = _normalize_document_html_for_view(description)
+            _apply_calm_task_metadata(normalized_doc, calm_task, sync_source_type)
+        elif item_type == 'test_case':
+            # Test cases live behind the Test Management API, not the
+            # document API — get_document() 404s on them, which is how
+            # they ended up stored as content-free placeholders.
+            test_case = calm_service_instance.get_manual_test_case(doc_id)
+            html_content = _render_test_case_html(test_case)
+            _apply_test_case_metadata(normalized_doc, test_case, sync_source_type)
+        else:
+            calm_doc = calm_service_instance.get_document(doc_id)
+            html_content = calm_doc.get('content') or calm_doc.get('htmlContent') or calm_doc.get('text')
+    except Exception as fetch_err:
+        print(f"Could not fetch content for item {doc_id}: {fetch_err}")
+
+    return normalized_doc, html_content
+
+
+def _ingest_synced_document(fetched, pending_classification=None) -> dict:
+    """Ingest stage of a sync: embed and store one fetched item. Returns its result.
+
+    With pending_classification (a list), the LLM classification is deferred:
+    the item to classify is appended there for a later batched call.
+    """
+    normalized_doc, html_content = fetched
+    if html_content:
+        result = rag_service.ingest_calm_document(
+            normalized_doc, html_content, defer_llm=pending_classification is not None
+        )
+        if result.get('classification') and pending_classification is not None:
+            pending_classification.append(result['classification'])
+    else:
+        result = rag_service.add_placeholder_document(normalized_doc)
+
+    return {
+        "documentId": normalized_doc.get('id'),
+        "documentName": normalized_doc.get('name'),
+        "status": result.get('status'),
+        "message": result.get('message', ''),
+        "wasExisting": result.get('was_existing', False),
+        "hasContent": bool(html_content),
+        "error": result.get('error')
+    }
+
+
+# Documents whose LLM classification a sync job holds back for one batched
+# pass. Until the pass runs they show the free layers' verdict (or none).
+SYNC_CLASSIFY_BATCH = int(os.getenv("SYNC_CLASSIFY_BATCH", "40"))
+
+
+def _make_sync_processor(job: dict):
+    """(fetch, ingest, flush) stages for one run of a sync job.
+
+    Resolved once per job run so the whole job shares one CALM client (and its
+    OAuth token) instead of authenticating per document. Classification is
+    batched across the job: ingest queues what needs the LLM, and every
+    SYNC_CLASSIFY_BATCH documents (and once at the end) flush classifies the
+    queue in as few requests as the token budget allows.
+    """
+    source = source_config_service.get_source(job['sourceId'])
+    if not source:
+        raise ValueError(f"Source {job['sourceId']} not found")
+    calm_service_instance = get_calm_service(source.get('config'))
+    sync_source_type = source.get('type') or 'CALM'
+    synced_by = job.get('syncedBy')
+
+    # Take the token once up front; otherwise the first wave of parallel
+    # fetches would each request their own.
+    try:
+        calm_service_instance._get_access_token()
+    except Exception as e:
+        print(f"Could not pre-authenticate sync job {job['id']}: {e}")
+
+    def fetch(doc):
+        return _fetch_sync_content(calm_service_instance, sync_source_type, doc, synced_by)
+
+    pending = []
+
+    def flush():
+        batch = pending[:]
+        del pending[:]
+        if not batch:
+            return
+        try:
+            classified = rag_service.classify_deferred(batch)
+            print(f"SYNC_JOBS: classified {classified}/{len(batch)} document(s) in batch")
+        except Exception as e:
+            # The documents are stored; backfill_modules.py --use-llm picks up
+            # any left unclassified.
+            print(f"SYNC_JOBS: batched classification failed for {len(batch)} document(s): {e}")
+
+    def ingest(fetched):
+        result = _ingest_synced_document(fetched, pending)
+        if len(pending) >= SYNC_CLASSIFY_BATCH:
+            flush()
+        return result
+
+    return fetch, ingest, flush
+
+
+def _on_sync_job_finished(job: dict):
+    if job.get('status') == 'completed':
+        source_config_service.update_last_sync(job['sourceId'])
+
+
+sync_job_service = SyncJobService(_make_sync_processor, on_job_finished=_on_sync_job_finished)
+
+
 @app.route('/api/sync', methods=['POST'])
 def sync_documents():
-    """Sync documents from a source to the knowledge base"""
+    """Queue a background job that syncs documents from a source to the knowledge base.
+
+    Returns 202 with the job id at once; poll GET /api/sync/jobs/<id> for progress.
+    """
     try:
         data = request.json
         source_id = data.get('sourceId')
@@ -2174,91 +2592,128 @@ def sync_documents():
         document_ids = data.get('documentIds', [])
         synced_by = data.get('syncedBy')  # optional: name/email of the user who triggered the sync
         
+        # Or a whole project, enumerated here page by page instead of being
+        # listed by the client and posted back
+        project_id = data.get('projectId')
+        
         if not source_id:
             return jsonify({"error": "sourceId is required"}), 400
             
-        if not documents and not document_ids:
+        if not documents and not document_ids and not project_id:
              return jsonify({"error": "No documents provided to sync"}), 400
         
         source = source_config_service.get_source(source_id)
         if not source:
             return jsonify({"error": "Source not found"}), 404
-        
-        results = []
-        
-        # Process full document objects
-        if documents:
-            calm_service_instance = get_calm_service(source.get('config'))
-            sync_source_type = source.get('type') or 'CALM'
-            for doc in documents:
-                try:
-                    # Normalize document structure to handle both old and new API formats
-                    normalized_doc = _normalize_document_structure(doc)
-                    # Stamp who triggered the sync if the doc has no modifier info
-                    if synced_by and not normalized_doc['metadata'].get('updatedBy'):
-                        normalized_doc['metadata']['updatedBy'] = synced_by
-                    doc_id = normalized_doc.get('id')
-                    item_type = doc.get('itemType') or doc.get('metadata', {}).get('itemType')
-
-                    # Try to fetch real content from CALM
-                    html_content = None
-                    try:
-                        if item_type == 'requirement' or doc.get('type') == 'CALMREQU' or doc.get('documentTypeCode') == 'REQUIREMENT':
-                            calm_task = calm_service_instance.get_task(doc_id)
-                            description = calm_task.get('description') or ''
-                            if description:
-                                html_content = _normalize_document_html_for_view(description)
-                            _apply_calm_task_metadata(normalized_doc, calm_task, sync_source_type)
-                        elif item_type == 'test_case':
-                            # Test cases live behind the Test Management API, not the
-                            # document API — get_document() 404s on them, which is how
-                            # they ended up stored as content-free placeholders.
-                            test_case = calm_service_instance.get_manual_test_case(doc_id)
-                            html_content = _render_test_case_html(test_case)
-                            _apply_test_case_metadata(normalized_doc, test_case, sync_source_type)
-                        else:
-                            calm_doc = calm_service_instance.get_document(doc_id)
-                            html_content = calm_doc.get('content') or calm_doc.get('htmlContent') or calm_doc.get('text')
-                    except Exception as fetch_err:
-                        print(f"Could not fetch content for item {doc_id}: {fetch_err}")
-
-                    if html_content:
-                        result = rag_service.ingest_calm_document(normalized_doc, html_content)
-                    else:
-                        result = rag_service.add_placeholder_document(normalized_doc)
-
-                    results.append({
-                        "documentId": doc_id,
-                        "documentName": normalized_doc.get('name'),
-                        "status": result.get('status'),
-                        "message": result.get('message', ''),
-                        "wasExisting": result.get('was_existing', False),
-                        "hasContent": bool(html_content),
-                        "error": result.get('error')
-                    })
-                except Exception as e:
-                    doc_id = doc.get('uuid') or doc.get('id')
-                    results.append({
-                        "documentId": doc_id,
-                        "status": "error",
-                        "error": str(e)
-                    })
-        # Legacy fallback
-        elif document_ids:
-             for doc_id in document_ids:
-                results.append({
-                    "documentId": doc_id,
-                    "status": "skipped",
-                    "message": "Metadata required for sync. Update client."
-                })
-        
-        # Update last sync time
-        source_config_service.update_last_sync(source_id)
-        
+
+        if not documents and not document_ids:
+            service = get_calm_service(source.get('config'))
+            items = _iter_calm_sync_items(
+                service,
+                source.get('type') or 'CALM',
+                project_id,
+                sync_type=data.get('syncType', 'documents'),
+                latest_only=data.get('latestOnly', True) is not False,
+            )
+            # Answers at once; the job pages through CALM in the background.
+            job = sync_job_service.create_job(source_id, items, synced_by)
+            return jsonify({
+                "message": "Listing documents for sync",
+                "jobId": job['id'],
+                "job": job
+            }), 202
+        
+        # Legacy fallback: nothing to queue without metadata
+        if not documents:
+            results = [{
+                "documentId": doc_id,
+                "status": "skipped",
+                "message": "Metadata required for sync. Update client."
+            } for doc_id in document_ids]
+            return jsonify({
+                "message": f"Synced {len(results)} documents",
+                "results": results
+            })
+
+        job = sync_job_service.create_job(source_id, documents, synced_by)
         return jsonify({
-            "message": f"Synced {len(results)} documents",
-            "results": results
-        })
+            "message": f"Queued {job['total']} documents for sync",
+            "jobId": job['id'],
+            "job": job
+        }), 202
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+def _calm_sync_payload(item: dict, source_type: str, project_name: str) -> dict:
+    """The document object the sync UI posts for one CALM listing row"""
+    modified_at = item.get('modifiedAt') or item.get('lastChangedDate')
+    return {
+        **item,
+        'id': item.get('uuid') or item.get('id'),
+        'name': item.get('title') or item.get('name'),
+        'type': item.get('documentTypeCode') or item.get('documentType') or item.get('type'),
+        'metadata': {
+            **item,
+            'modifiedAt': modified_at,
+            'updatedOn': modified_at,
+            'source': source_type,
+            'project': project_name,
+        },
+    }
+
+
+def _iter_calm_sync_items(service, source_type: str, project_id: str,
+                          sync_type: str = 'documents', latest_only: bool = True):
+    """Sync payloads for every item in a CALM project, read one page at a time.
+
+    sync_type 'requirements' yields requirement tasks; anything else yields
+    documents followed by manual test cases, as the sync UI lists them.
+    """
+    project_name = (service.get_project(project_id) or {}).get('name') or 'Unknown Project'
+    if sync_type == 'requirements':
+        for req in service.iter_requirements(project_id):
+            yield _calm_sync_payload(_decorate_calm_requirement(req), source_type, project_name)
+        return
+
+    for doc in service.iter_documents(project_id=project_id, latest_only=latest_only):
+        yield _calm_sync_payload(_decorate_calm_document(doc), source_type, project_name)
+    try:
+        for tc in service.iter_manual_test_cases(project_id=project_id):
+            yield _calm_sync_payload(_decorate_calm_test_case(tc), source_type, project_name)
+    except Exception as e:
+        # The listing carries on without test cases too
+        print(f"WARNING: could not list test cases for project {project_id}: {e}")
+
+
+@app.route('/api/sync/jobs/<job_id>', methods=['GET'])
+def get_sync_job(job_id):
+    """Progress of a sync job: counters, throughput, ETA and per-document status.
+
+    ?items=false leaves out the per-document rows, for polling.
+    """
+    try:
+        include_items = request.args.get('items', 'true').lower() != 'false'
+        job = sync_job_service.get_job(job_id, include_items=include_items)
+        if not job:
+            return jsonify({"error": "Sync job not found"}), 404
+        return jsonify(job)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": str(e)}), 500
+
+
+@app.route('/api/sync/jobs/<job_id>/cancel', methods=['POST'])
+def cancel_sync_job(job_id):
+    """Stop a sync job before its next document. Already-synced documents stay."""
+    try:
+        job = sync_job_service.cancel_job(job_id)
+        if not job:
+            return jsonify({"error": "Sync job not found"}), 404
+        return jsonify(job)
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -2822,6 +3277,18 @@ def github_push():
         return jsonify({'status': 'error', 'message': result.get('message', 'Push failed')}), 500
 
 
+# Resume sync jobs a previous run left unfinished. Started last, so a resumed
+# job never calls into a helper this module has not defined yet.
+sync_job_service.start()
+# Load the in-memory vector index in the background; Ask Yoda uses the exact
+# scan until it is ready.
+rag_service.start_vector_index()
+# Convert JSON-text embeddings to the binary format; reads handle both meanwhile.
+embedding_migration.start()
+# Hear about corpus changes made by other workers (Postgres; SQLite polls).
+corpus_cache.start_listener()
+
+
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     print(f"DEBUG: Starting Flask app on port {port}")
@@ -2,23 +2,105 @@
 Classify documents that predate the SAP module column.
 
     python backfill_modules.py --dry-run     # report what would change
-    python backfill_modules.py               # scope mapping only (free, no LLM)
-    python backfill_modules.py --use-llm     # also classify what scope mapping misses
+    python backfill_modules.py               # scope mapping + nearest neighbours (free, no LLM)
+    python backfill_modules.py --use-llm     # also classify what those two miss
+    python backfill_modules.py --no-vector   # scope mapping only
+
+    python backfill_modules.py --use-llm --workers 4 --llm-rpm 60
+    python backfill_modules.py --use-llm --resume   # carry on after a crash or Ctrl-C
 
 Safe to re-run: documents whose module a human set by hand are always skipped,
 and by default so is anything already classified (--force overrides that).
 
-Run a --dry-run first — with --use-llm this makes one LLM call per unclassified
-document, so on a large corpus it is worth knowing the count in advance.
+The nearest-neighbour layer votes with the stored embeddings of documents
+classified by scope or by hand, so it costs no API calls. Run a --dry-run
+first — with --use-llm whatever it cannot settle goes to the LLM, several
+documents per request, so on a large corpus it is worth knowing the count in
+advance.
+
+Documents are classified CHUNK_SIZE at a time, by --workers threads, and each
+chunk is written and committed on its own: no transaction stays open for the
+length of the run, and a crash loses only the chunks in flight. Written
+documents are recorded in module_backfill_checkpoints, which --resume skips;
+a run without --resume starts the checkpoints over.
 """
 
 import argparse
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
 
-from db import get_conn
+import psycopg2.extras
+
+from db import SQLiteConnectionProxy, get_conn
 from config.sap_modules import METHOD_MANUAL, UNCLASSIFIED
+from services import corpus_cache, document_catalog
 from services.module_classifier import ModuleClassifier
 
+# Documents classified, written and committed together; the LLM layer packs
+# each chunk into as few requests as its token budget allows.
+CHUNK_SIZE = 50
+
+# A human may correct a document while a long run is going; that wins.
+_UPDATE_ROW_SQL = """
+    UPDATE documents
+    SET sap_module = %s, sap_module_confidence = %s, sap_module_method = %s,
+        summary = COALESCE(%s, summary)
+    WHERE document_id = %s AND (sap_module_method IS NULL OR sap_module_method != %s)
+"""
+
+_UPDATE_VALUES_SQL = f"""
+    UPDATE documents AS d
+    SET sap_module = v.sap_module, sap_module_confidence = v.confidence,
+        sap_module_method = v.method, summary = COALESCE(v.summary, d.summary)
+    FROM (VALUES %s) AS v (sap_module, confidence, method, summary, document_id)
+    WHERE d.document_id = v.document_id
+      AND d.sap_module_method IS DISTINCT FROM '{METHOD_MANUAL}'
+"""
+
+_CHECKPOINT_SQL = """
+    INSERT INTO module_backfill_checkpoints (document_id, method, finished_at)
+    VALUES {values}
+    ON CONFLICT (document_id) DO UPDATE SET
+        method = EXCLUDED.method,
+        finished_at = EXCLUDED.finished_at
+"""
+
+
+class RateLimiter:
+    """At most per_minute calls per key, evenly spaced, across all threads."""
+
+    def __init__(self, per_minute: float):
+        self.interval = 60.0 / per_minute if per_minute and per_minute > 0 else 0.0
+        self._next = {}
+        self._lock = threading.Lock()
+
+    def wait(self, key):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(key, now))
+            self._next[key] = slot + self.interval
+        delay = slot - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+
+class RateLimitedLLM:
+    """Stands in for OpenAIService in the classifier; chat calls wait their
+    turn with the limiter, per provider."""
+
+    def __init__(self, service, limiter: RateLimiter):
+        self.service = service
+        self.limiter = limiter
+
+    def chat_completion(self, *args, **kwargs):
+        self.limiter.wait(kwargs.get('provider') or 'openai')
+        return self.service.chat_completion(*args, **kwargs)
+
 
 def fetch_candidates(conn, force: bool):
     """One row per document: the module inputs, plus text from its first chunk."""
@@ -29,7 +111,6 @@ def fetch_candidates(conn, force: bool):
         params.append(UNCLASSIFIED)
 
     # SQLite has no IS DISTINCT FROM.
-    from db import SQLiteConnectionProxy
     if isinstance(conn, SQLiteConnectionProxy):
         where = where.replace("IS DISTINCT FROM %s", "!= %s")
 
@@ -47,72 +128,186 @@ def fetch_candidates(conn, force: bool):
         return cur.fetchall()
 
 
+def load_checkpoints(conn) -> set:
+    with conn.cursor() as cur:
+        cur.execute("SELECT document_id FROM module_backfill_checkpoints")
+        return {row[0] for row in cur.fetchall()}
+
+
+def reset_checkpoints(conn):
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM module_backfill_checkpoints")
+    conn.commit()
+
+
+def write_chunk(conn, results):
+    """Write one chunk's verdicts and checkpoints, and commit them together.
+
+    results is [(document_id, module, confidence, method, summary)].
+    """
+    now = datetime.now().isoformat()
+    updates = [
+        (module, confidence, method, summary or None, doc_id)
+        for doc_id, module, confidence, method, summary in results
+    ]
+    checkpoints = [(doc_id, method, now) for doc_id, _, _, method, _ in results]
+    with conn.cursor() as cur:
+        if isinstance(conn, SQLiteConnectionProxy):
+            cur.executemany(_UPDATE_ROW_SQL, [row + (METHOD_MANUAL,) for row in updates])
+            cur.executemany(_CHECKPOINT_SQL.format(values="(%s, %s, %s)"), checkpoints)
+        else:
+            psycopg2.extras.execute_values(
+                cur, _UPDATE_VALUES_SQL, updates, template="(%s, %s::real, %s, %s, %s)"
+            )
+            psycopg2.extras.execute_values(cur, _CHECKPOINT_SQL.format(values="%s"), checkpoints)
+    document_catalog.refresh(conn, [row[0] for row in results])
+    # Tells the running app's workers their cached listings are stale.
+    corpus_cache.commit(conn)
+
+
+def _row_fields(row):
+    if isinstance(row, tuple):
+        return row
+    return row['document_id'], row['document_name'], row['scope_id'], row['content']
+
+
+def _format_seconds(seconds) -> str:
+    seconds = int(seconds)
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}h{minutes:02d}m" if hours else f"{minutes}m{seconds:02d}s"
+
+
+def build_classifier(args):
+    """(classifier, rag). rag provides document vectors; None with --no-vector."""
+    llm = None
+    if args.use_llm:
+        from services.openai_service import OpenAIService
+        llm = RateLimitedLLM(OpenAIService(), RateLimiter(args.llm_rpm))
+    if args.no_vector:
+        return ModuleClassifier(openai_service=llm), None
+    # RAGService owns the stored vectors and the neighbour search.
+    from services.rag_service import RAGService
+    rag = RAGService()
+    return ModuleClassifier(
+        openai_service=llm or rag.openai_service,
+        neighbour_search=rag.module_classifier.neighbour_search,
+    ), rag
+
+
 def main():
     parser = argparse.ArgumentParser(description="Backfill documents.sap_module")
     parser.add_argument('--dry-run', action='store_true', help="report only, write nothing")
     parser.add_argument('--use-llm', action='store_true',
-                        help="classify by content when scope mapping misses (costs one call per doc)")
+                        help="classify by content what the free layers miss (batched LLM calls)")
+    parser.add_argument('--no-vector', action='store_true',
+                        help="skip the nearest-neighbour layer")
     parser.add_argument('--force', action='store_true',
                         help="also reclassify documents that already have a module")
     parser.add_argument('--limit', type=int, default=0, help="stop after N documents")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="chunks classified in parallel (default 1)")
+    parser.add_argument('--llm-rpm', type=float, default=0,
+                        help="max LLM requests per minute per provider, across workers (0 = no cap)")
+    parser.add_argument('--provider', default='openai', help="LLM provider for --use-llm")
+    parser.add_argument('--resume', action='store_true',
+                        help="skip documents the previous run already wrote")
     args = parser.parse_args()
 
-    classifier = ModuleClassifier()
+    classifier, rag = build_classifier(args)
+
     conn = get_conn()
     try:
         rows = fetch_candidates(conn, args.force)
-        if args.limit:
-            rows = rows[:args.limit]
+        if args.resume:
+            done = load_checkpoints(conn)
+            before = len(rows)
+            rows = [row for row in rows if _row_fields(row)[0] not in done]
+            print(f"Resuming: {before - len(rows)} document(s) already done.")
+        elif not args.dry_run:
+            reset_checkpoints(conn)
+    finally:
+        conn.close()
 
-        if not rows:
-            print("Nothing to backfill.")
-            return
+    if args.limit:
+        rows = rows[:args.limit]
+    if not rows:
+        print("Nothing to backfill.")
+        return 0
 
-        print(f"{len(rows)} document(s) to classify"
-              f"{' (dry run)' if args.dry_run else ''}"
-              f"{' with LLM fallback' if args.use_llm else ' — scope mapping only'}\n")
-
-        counts = {}
-        for row in rows:
-            if isinstance(row, tuple):
-                doc_id, name, scope_id, content = row
-            else:
-                doc_id, name, scope_id, content = (
-                    row['document_id'], row['document_name'],
-                    row['scope_id'], row['content'],
-                )
-
-            module, confidence, method, summary = classifier.classify(
-                title=name or '', text=content or '', scope_id=scope_id,
-                conn=conn, use_llm=args.use_llm,
-            )
-            counts[method or 'unclassified'] = counts.get(method or 'unclassified', 0) + 1
-            print(f"  {(name or doc_id)[:52]:54} {module:14} {method or '-':10} {confidence:.2f}")
+    print(f"{len(rows)} document(s) to classify"
+          f"{' (dry run)' if args.dry_run else ''}"
+          f"{' — scope mapping' if args.no_vector else ' — scope mapping, neighbours'}"
+          f"{', LLM fallback' if args.use_llm else ''}"
+          f", {args.workers} worker(s)\n")
 
+    def run_chunk(chunk):
+        conn = get_conn()
+        try:
+            docs = []
+            for row in chunk:
+                doc_id, name, scope_id, content = _row_fields(row)
+                docs.append({
+                    'id': doc_id,
+                    'title': name or '',
+                    'text': content or '',
+                    'scope_id': scope_id,
+                    'embedding': rag.stored_document_vector(conn, doc_id) if rag else None,
+                })
+            verdicts = classifier.classify_many(
+                docs, conn=conn, llm_provider=args.provider, use_llm=args.use_llm
+            )
             if not args.dry_run:
-                with conn.cursor() as cur:
-                    cur.execute(
-                        """
-                        UPDATE documents
-                        SET sap_module = %s, sap_module_confidence = %s, sap_module_method = %s,
-                            summary = COALESCE(%s, summary)
-                        WHERE document_id = %s
-                        """,
-                        (module, confidence, method, summary or None, doc_id),
-                    )
-
-        if not args.dry_run:
-            conn.commit()
-
-        print("\nBy method: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
-        print("Dry run — nothing written." if args.dry_run else "Backfill committed.")
-    except Exception as e:
-        conn.rollback()
-        print(f"ERROR: backfill failed: {e}", file=sys.stderr)
-        raise
-    finally:
-        conn.close()
+                write_chunk(conn, [(doc['id'],) + verdicts[doc['id']] for doc in docs])
+            return docs, verdicts
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    chunks = [rows[start:start + CHUNK_SIZE] for start in range(0, len(rows), CHUNK_SIZE)]
+    counts = {}
+    processed = failed = 0
+    started = time.monotonic()
+    pool = ThreadPoolExecutor(max_workers=max(1, args.workers), thread_name_prefix="backfill")
+    futures = {pool.submit(run_chunk, chunk): chunk for chunk in chunks}
+    try:
+        for future in as_completed(futures):
+            try:
+                docs, verdicts = future.result()
+            except Exception as e:
+                failed += len(futures[future])
+                print(f"ERROR: chunk of {len(futures[future])} document(s) failed: {e}",
+                      file=sys.stderr)
+                continue
+
+            for doc in docs:
+                module, confidence, method, _ = verdicts[doc['id']]
+                counts[method or 'unclassified'] = counts.get(method or 'unclassified', 0) + 1
+                print(f"  {(doc['title'] or doc['id'])[:52]:54} {module:14} "
+                      f"{method or '-':10} {confidence:.2f}")
+
+            processed += len(docs)
+            elapsed = time.monotonic() - started
+            rate = processed / elapsed if elapsed > 0 else 0
+            remaining = len(rows) - processed - failed
+            eta = _format_seconds(remaining / rate) if rate else '?'
+            print(f"  -- {processed + failed}/{len(rows)} documents, "
+                  f"{rate * 60:.1f} docs/min, ETA {eta}")
+    except KeyboardInterrupt:
+        pool.shutdown(wait=True, cancel_futures=True)
+        print("\nInterrupted — finished chunks are committed; re-run with --resume to carry on.")
+        return 1
+    pool.shutdown()
+
+    print("\nBy method: " + ", ".join(f"{k}={v}" for k, v in sorted(counts.items())))
+    if failed:
+        print(f"{failed} document(s) failed — re-run with --resume to retry them.", file=sys.stderr)
+        return 1
+    print("Dry run — nothing written." if args.dry_run else "Backfill committed.")
+    return 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -5,6 +5,9 @@ Single source of truth for the module enum. The frontend label map and the
 LLM classifier both derive from MODULES — nothing else should hardcode a code.
 """
 
+import functools
+import re
+
 # Ordered: drives display order on the dashboard.
 MODULES = [
     ('FI', 'Financial Accounting'),
@@ -141,17 +144,30 @@ SCOPE_KEYWORD_MAP = {
 }
 
 _KEYWORDS_BY_LENGTH = sorted(SCOPE_KEYWORD_MAP, key=len, reverse=True)
+_KEYWORD_RANK = {keyword: rank for rank, keyword in enumerate(_KEYWORDS_BY_LENGTH)}
+
+# Every keyword in one pass. The lookahead matches at every position, not just
+# after the previous match, so a long keyword overlapping a shorter one is
+# still seen; at each position the alternation tries the longest first.
+_KEYWORD_PATTERN = re.compile(
+    "(?=(" + "|".join(re.escape(keyword) for keyword in _KEYWORDS_BY_LENGTH) + "))"
+)
 
 
+@functools.lru_cache(maxsize=4096)
 def module_from_scope_name(scope_name):
-    """Map a free-text CALM scope name onto a module code, or None."""
+    """Map a free-text CALM scope name onto a module code, or None.
+
+    The longest keyword found anywhere in the name wins, as if each were
+    checked in turn longest-first.
+    """
     if not scope_name:
         return None
     haystack = scope_name.strip().lower()
-    for keyword in _KEYWORDS_BY_LENGTH:
-        if keyword in haystack:
-            return SCOPE_KEYWORD_MAP[keyword]
-    return None
+    matches = [match.group(1) for match in _KEYWORD_PATTERN.finditer(haystack)]
+    if not matches:
+        return None
+    return SCOPE_KEYWORD_MAP[min(matches, key=_KEYWORD_RANK.__getitem__)]
 
 
 def taxonomy_payload():
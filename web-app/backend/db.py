@@ -1,14 +1,18 @@
 """
 Shared PostgreSQL connection module.
 
-All services import get_conn() from here.
+All services import get_conn() from here. Connections are pooled; see
+PooledConnection.
 init_db() is called once at app startup to create tables.
 """
 
 import os
 import re
+import threading
+import time
 import psycopg2
 import psycopg2.extras
+import psycopg2.pool
 import sqlite3
 from pgvector.psycopg2 import register_vector
 from dotenv import load_dotenv
@@ -59,6 +63,9 @@ class SQLiteCursorProxy:
             query = query.replace('%s', '?')
         return self.cursor.execute(query, vars or [])
 
+    def executemany(self, query, vars_list):
+        return self.cursor.executemany(query.replace('%s', '?'), vars_list)
+
     def fetchone(self):
         return self.cursor.fetchone()
 
@@ -103,26 +110,205 @@ class SQLiteConnectionProxy:
         self.close()
 
 
+# ── PostgreSQL connection pool ──────────────────────────────────────────────
+#
+# get_conn() used to open a fresh psycopg2 connection per call — a TLS handshake
+# to managed Postgres (20-50 ms) several times per request. Connections now come
+# from a pool, and PooledConnection.close() hands them back instead of closing,
+# so every existing `finally: conn.close()` keeps working unchanged.
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+# Seconds to wait for a free pooled connection before opening an unpooled one.
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# A connection idle for longer than this is pinged before it is handed out.
+DB_POOL_PING_AFTER = float(os.getenv("DB_POOL_PING_AFTER", "30"))
+# After PostgreSQL fails, use SQLite for this long before trying it again.
+DB_REPROBE_SECONDS = float(os.getenv("DB_REPROBE_SECONDS", "60"))
+
+_pool = None
+_pool_lock = threading.Lock()
+_pool_slots = threading.BoundedSemaphore(DB_POOL_MAX)
+_last_used = {}             # id(raw connection) -> time it was last returned
+_vector_registered = set()  # id(raw connection) with pgvector types registered
+_postgres_down_until = 0.0  # monotonic time before which we go straight to SQLite
+
+
+class PooledConnection:
+    """A pooled psycopg2 connection whose close() returns it to the pool.
+
+    Everything else is delegated to the underlying connection, so callers use
+    it exactly like the connection psycopg2.connect() used to hand them.
+    """
+
+    def __init__(self, raw, pooled=True):
+        self._raw = raw
+        self._pooled = pooled
+        self._released = False
+
+    @property
+    def raw(self):
+        return self._raw
+
+    @property
+    def closed(self):
+        return self._released or self._raw.closed
+
+    def close(self):
+        if self._released:
+            return
+        self._released = True
+        if self._pooled:
+            _release(self._raw)
+        else:
+            _forget(self._raw)
+            self._raw.close()
+
+    def __getattr__(self, name):
+        return getattr(self._raw, name)
+
+    def __enter__(self):
+        self._raw.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        # Same as psycopg2: end the transaction, keep the connection.
+        return self._raw.__exit__(exc_type, exc_val, exc_tb)
+
+    def __del__(self):
+        # Safety net for a caller that forgot close(): without it a leaked
+        # connection would hold a pool slot for the life of the process.
+        try:
+            self.close()
+        except Exception:
+            pass
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = psycopg2.pool.ThreadedConnectionPool(DB_POOL_MIN, DB_POOL_MAX, DATABASE_URL)
+            # psycopg2 uses minconn both for how many connections to open up
+            # front and for how many idle ones to keep; past it, putconn()
+            # closes them. Open DB_POOL_MIN eagerly, but keep up to DB_POOL_MAX
+            # once opened — otherwise under concurrency most checkouts would
+            # pay a fresh handshake again.
+            _pool.minconn = DB_POOL_MAX
+        return _pool
+
+
+def _release(raw):
+    try:
+        if _pool is not None:
+            # putconn rolls back an open transaction, and drops a broken
+            # connection instead of pooling it.
+            _pool.putconn(raw, close=bool(raw.closed))
+            if raw.closed:
+                _forget(raw)
+            else:
+                _last_used[id(raw)] = time.monotonic()
+        else:
+            raw.close()
+    finally:
+        _pool_slots.release()
+
+
+def _forget(raw):
+    # Keyed by id(), which Python reuses once the object is gone — so a closed
+    # connection must leave no trace for a new one to inherit.
+    _last_used.pop(id(raw), None)
+    _vector_registered.discard(id(raw))
+
+
+def _discard(raw):
+    _forget(raw)
+    try:
+        _pool.putconn(raw, close=True)
+    except Exception:
+        pass
+
+
+def _alive(raw) -> bool:
+    """Cheap liveness check: only ping connections that sat idle a while."""
+    if raw.closed:
+        return False
+    idle_since = _last_used.get(id(raw))
+    if idle_since is None or time.monotonic() - idle_since < DB_POOL_PING_AFTER:
+        return True
+    try:
+        with raw.cursor() as cur:
+            cur.execute("SELECT 1")
+        raw.rollback()
+        return True
+    except Exception:
+        return False
+
+
+def _register_vector_once(conn):
+    """register_vector() on a connection the first time it is handed out."""
+    raw = conn.raw if isinstance(conn, PooledConnection) else conn
+    if id(raw) in _vector_registered:
+        return
+    register_vector(raw)
+    _vector_registered.add(id(raw))
+
+
+def _checkout_postgres():
+    """A live pooled connection, or an unpooled one if the pool stays full."""
+    if not _pool_slots.acquire(timeout=DB_POOL_TIMEOUT):
+        print(f"WARNING: DB pool exhausted ({DB_POOL_MAX} in use); opening an unpooled connection")
+        return PooledConnection(psycopg2.connect(DATABASE_URL), pooled=False)
+    try:
+        pool = _get_pool()
+        # Bounded retries: each dead connection is dropped and replaced.
+        for _ in range(DB_POOL_MAX + 1):
+            raw = pool.getconn()
+            if _alive(raw):
+                return PooledConnection(raw)
+            _discard(raw)
+        raise psycopg2.OperationalError("no live PostgreSQL connection available")
+    except Exception:
+        _pool_slots.release()
+        raise
+
+
+def _sqlite_conn():
+    sqlite_path = os.path.join(os.path.dirname(__file__), "users.db")
+    conn = sqlite3.connect(sqlite_path)
+    # SQLite Row factory to mimic RealDictCursor behavior
+    conn.row_factory = sqlite3.Row
+    return SQLiteConnectionProxy(conn)
+
+
 def get_conn(register_vec=True):
-    """Return a new connection. Falls back to SQLite if PostgreSQL fails."""
+    """Return a connection. Falls back to SQLite if PostgreSQL fails.
+
+    PostgreSQL connections are pooled; close() returns them. After a failed
+    connect the fallback decision is cached for DB_REPROBE_SECONDS, so a down
+    database costs one connect timeout per interval rather than one per call.
+    """
+    global _postgres_down_until
+    if time.monotonic() < _postgres_down_until:
+        return _sqlite_conn()
     try:
-        conn = psycopg2.connect(DATABASE_URL)
-        # Register pgvector types on this connection (skip during init_db)
-        if register_vec and pgvector_available():
-            try:
-                register_vector(conn)
-            except Exception as e:
-                print(f"WARNING: Could not register pgvector: {e}")
-        return conn
+        conn = _checkout_postgres()
     except Exception as e:
+        _postgres_down_until = time.monotonic() + DB_REPROBE_SECONDS
         print(f"WARNING: PostgreSQL connection failed ({e}).")
         print(f"WARNING: DATABASE_URL={DATABASE_URL!r}")
-        print("WARNING: Falling back to SQLite — data will NOT persist across restarts. Set DATABASE_URL env var to fix this.")
-        sqlite_path = os.path.join(os.path.dirname(__file__), "users.db")
-        conn = sqlite3.connect(sqlite_path)
-        # SQLite Row factory to mimic RealDictCursor behavior
-        conn.row_factory = sqlite3.Row
-        return SQLiteConnectionProxy(conn)
+        print(
+            "WARNING: Falling back to SQLite — data will NOT persist across restarts. "
+            f"Set DATABASE_URL env var to fix this. Retrying PostgreSQL in {DB_REPROBE_SECONDS:.0f}s."
+        )
+        return _sqlite_conn()
+
+    # Register pgvector types on this connection (skip during init_db)
+    if register_vec and pgvector_available():
+        try:
+            _register_vector_once(conn)
+        except Exception as e:
+            print(f"WARNING: Could not register pgvector: {e}")
+    return conn
 
 def init_db():
     """
@@ -197,7 +383,7 @@ def init_db():
             
             if PGVECTOR_AVAILABLE:
                 try:
-                    register_vector(conn)
+                    _register_vector_once(conn)
                 except Exception as e:
                     print(f"WARNING: Could not register pgvector types: {e}")
 
@@ -231,18 +417,77 @@ def init_db():
              "ALTER TABLE documents ADD COLUMN IF NOT EXISTS summary TEXT"),
             ("ALTER TABLE documents ADD COLUMN embedding_model TEXT",
              "ALTER TABLE documents ADD COLUMN IF NOT EXISTS embedding_model TEXT"),
+            ("ALTER TABLE documents ADD COLUMN content_hash TEXT",
+             "ALTER TABLE documents ADD COLUMN IF NOT EXISTS content_hash TEXT"),
             # Must follow the ADD COLUMNs above: on an existing database the
             # columns do not exist until those have run.
+            # Per-document reads (incremental re-ingest, versions, meta) filter
+            # on document_id; without this each one scans the chunk table.
+            ("CREATE INDEX IF NOT EXISTS documents_document_id_idx ON documents(document_id)",
+             "CREATE INDEX IF NOT EXISTS documents_document_id_idx ON documents(document_id)"),
+            # Ask Yoda retrieval filters (RAGService.query) narrow on these.
+            ("CREATE INDEX IF NOT EXISTS documents_project_id_idx ON documents(project_id)",
+             "CREATE INDEX IF NOT EXISTS documents_project_id_idx ON documents(project_id)"),
+            ("CREATE INDEX IF NOT EXISTS documents_doc_type_idx ON documents(doc_type)",
+             "CREATE INDEX IF NOT EXISTS documents_doc_type_idx ON documents(doc_type)"),
             ("CREATE INDEX IF NOT EXISTS documents_sap_module_idx ON documents(sap_module)",
              "CREATE INDEX IF NOT EXISTS documents_sap_module_idx ON documents(sap_module)"),
             ("CREATE INDEX IF NOT EXISTS documents_project_idx ON documents(project)",
              "CREATE INDEX IF NOT EXISTS documents_project_idx ON documents(project)"),
             ("CREATE INDEX IF NOT EXISTS documents_synced_on_idx ON documents(synced_on)",
              "CREATE INDEX IF NOT EXISTS documents_synced_on_idx ON documents(synced_on DESC)"),
+            # Scope module corrections propagate to documents by scope
+            # (ScopeService._propagate_scope_modules).
+            ("CREATE INDEX IF NOT EXISTS documents_scope_id_idx ON documents(scope_id)",
+             "CREATE INDEX IF NOT EXISTS documents_scope_id_idx ON documents(scope_id)"),
+            # Document Hub keyset pagination walks these in RAGService.SORT_OPTIONS
+            # order. SQLite already sorts NULLs last in a DESC index, and
+            # rejects NULLS LAST in one.
+            ("CREATE INDEX IF NOT EXISTS document_catalog_sort_synced_idx "
+             "ON document_catalog(synced_on DESC, updated_on DESC, document_id)",
+             "CREATE INDEX IF NOT EXISTS document_catalog_sort_synced_idx "
+             "ON document_catalog(synced_on DESC NULLS LAST, updated_on DESC NULLS LAST, document_id)"),
+            ("CREATE INDEX IF NOT EXISTS document_catalog_sort_updated_idx "
+             "ON document_catalog(updated_on DESC, document_id)",
+             "CREATE INDEX IF NOT EXISTS document_catalog_sort_updated_idx "
+             "ON document_catalog(updated_on DESC NULLS LAST, document_id)"),
+            ("CREATE INDEX IF NOT EXISTS document_catalog_sort_name_idx "
+             "ON document_catalog(document_name, document_id)",
+             "CREATE INDEX IF NOT EXISTS document_catalog_sort_name_idx "
+             "ON document_catalog(document_name NULLS LAST, document_id)"),
+            # Document Hub name search (document_catalog.search_clause). On
+            # Postgres, trigram GIN indexes serve ILIKE '%term%'; they fail
+            # harmlessly where pg_trgm is not installed and search scans instead.
+            (None,
+             "CREATE INDEX IF NOT EXISTS document_catalog_name_trgm_idx "
+             "ON document_catalog USING gin (document_name gin_trgm_ops)"),
+            (None,
+             "CREATE INDEX IF NOT EXISTS document_catalog_id_trgm_idx "
+             "ON document_catalog USING gin (document_id gin_trgm_ops)"),
+            # SQLite: an FTS5 trigram table over the same two columns, sharing
+            # the catalog's rowid and kept in step by triggers.
+            ("CREATE VIRTUAL TABLE IF NOT EXISTS document_catalog_fts "
+             "USING fts5(document_id, document_name, tokenize='trigram')",
+             None),
+            ("CREATE TRIGGER IF NOT EXISTS document_catalog_fts_insert AFTER INSERT ON document_catalog BEGIN "
+             "INSERT INTO document_catalog_fts (rowid, document_id, document_name) "
+             "VALUES (new.rowid, new.document_id, new.document_name); END",
+             None),
+            ("CREATE TRIGGER IF NOT EXISTS document_catalog_fts_delete AFTER DELETE ON document_catalog BEGIN "
+             "DELETE FROM document_catalog_fts WHERE rowid = old.rowid; END",
+             None),
+            ("CREATE TRIGGER IF NOT EXISTS document_catalog_fts_update AFTER UPDATE ON document_catalog BEGIN "
+             "DELETE FROM document_catalog_fts WHERE rowid = old.rowid; "
+             "INSERT INTO document_catalog_fts (rowid, document_id, document_name) "
+             "VALUES (new.rowid, new.document_id, new.document_name); END",
+             None),
         ]:
+            statement = ddl[0] if is_sqlite else ddl[1]
+            if not statement:
+                continue
             try:
                 cur = conn.cursor()
-                cur.execute(ddl[0] if is_sqlite else ddl[1])
+                cur.execute(statement)
                 conn.commit()
             except Exception:
                 try:
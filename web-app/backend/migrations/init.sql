@@ -1,5 +1,7 @@
 -- Enable pgvector extension
 CREATE EXTENSION IF NOT EXISTS vector;
+-- Trigram indexes for Document Hub name search (optional: see db.py)
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
 -- ── Users table (replaces SQLite users.db) ──────────────────────────────────
 CREATE TABLE IF NOT EXISTS users (
@@ -53,7 +55,11 @@ CREATE TABLE IF NOT EXISTS documents (
     -- can skip vectors from a different model instead of silently comparing
     -- across incompatible spaces, and a migration can find exactly what to
     -- re-embed. NULL is read as the current corpus model (historical rows).
-    embedding_model TEXT
+    embedding_model TEXT,
+    -- sha256 of the chunk's whitespace-normalized content. Incremental re-ingest
+    -- compares against it to rewrite only the chunks that actually changed.
+    -- NULL on historical rows; those are hashed from content on demand.
+    content_hash    TEXT
 );
 
 -- Cosine similarity index for fast nearest-neighbour search
@@ -68,6 +74,93 @@ CREATE INDEX IF NOT EXISTS documents_embedding_idx
 -- so those columns only appear after the ALTER TABLE backfill that runs later —
 -- indexing them at this point would fail and abort startup.
 
+-- ── Document catalog ────────────────────────────────────────────────────────
+-- One row per logical document, derived from its chunks above and kept in step
+-- with them inside the same transaction (services/document_catalog.py). The
+-- Document Hub listing, stats and version lookups read this instead of
+-- collapsing the chunk table with DISTINCT ON / COUNT(DISTINCT) on every call.
+CREATE TABLE IF NOT EXISTS document_catalog (
+    document_id     TEXT PRIMARY KEY,
+    document_name   TEXT,
+    source          TEXT,
+    doc_type        TEXT,
+    project         TEXT,
+    updated_by      TEXT,
+    updated_on      TEXT,
+    web_url         TEXT,
+    is_placeholder  BOOLEAN,
+    uuid            TEXT,
+    display_id      TEXT,
+    project_id      TEXT,
+    scope_id        TEXT,
+    version         INTEGER,
+    is_latest       BOOLEAN,
+    calm_display_id TEXT,
+    sap_module      TEXT,
+    sap_module_confidence REAL,
+    sap_module_method     TEXT,
+    summary         TEXT,
+    html_content    TEXT,                  -- the first chunk's HTML, if any
+    chunk_count     INTEGER,
+    content_length  INTEGER,               -- total plain-text length of all chunks
+    synced_on       TIMESTAMP              -- newest chunk's synced_on
+);
+
+-- The sort and search indexes differ per backend and live in db.py.
+CREATE INDEX IF NOT EXISTS document_catalog_project_idx ON document_catalog(project, sap_module);
+CREATE INDEX IF NOT EXISTS document_catalog_project_id_idx ON document_catalog(project_id);
+CREATE INDEX IF NOT EXISTS document_catalog_display_id_idx ON document_catalog(calm_display_id, project_id);
+
+-- ── Embedding cache ─────────────────────────────────────────────────────────
+-- One vector per (normalized chunk text, model), so re-syncing a document whose
+-- text has not changed reuses its vectors instead of paying to re-embed them.
+-- Stored as serialized bytes, never vector(): nothing searches this table, and
+-- it has to work on hosts without pgvector. See services/embedding_cache.py.
+CREATE TABLE IF NOT EXISTS embedding_cache (
+    content_hash    TEXT NOT NULL,         -- sha256 of whitespace-normalized text
+    model           TEXT NOT NULL,
+    embedding       BYTEA,
+    created_at      TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    last_used_at    TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (content_hash, model)
+);
+
+CREATE INDEX IF NOT EXISTS embedding_cache_last_used_idx ON embedding_cache(last_used_at);
+
+-- ── Background data migrations ──────────────────────────────────────────────
+-- Progress of long-running rewrites that run online, in batches, while the app
+-- serves traffic. resume_key is the last key processed (JSON), so a restart
+-- carries on from there instead of starting over.
+CREATE TABLE IF NOT EXISTS data_migrations (
+    name        TEXT PRIMARY KEY,
+    resume_key  TEXT,
+    processed   INTEGER DEFAULT 0,
+    rewritten   INTEGER DEFAULT 0,
+    done        BOOLEAN DEFAULT FALSE,
+    updated_at  TEXT
+);
+
+-- ── Module backfill checkpoints ─────────────────────────────────────────────
+-- Documents the current backfill_modules.py run has written, so --resume can
+-- skip them after a crash or a deliberate stop. A run without --resume clears it.
+CREATE TABLE IF NOT EXISTS module_backfill_checkpoints (
+    document_id TEXT PRIMARY KEY,
+    method      TEXT,
+    finished_at TEXT
+);
+
+-- ── Corpus generation ───────────────────────────────────────────────────────
+-- A single counter bumped in the same transaction as every change to documents
+-- or calm_scopes. Each worker's read caches are valid for one generation; see
+-- services/corpus_cache.py for how workers learn of a new one.
+CREATE TABLE IF NOT EXISTS corpus_generation (
+    id          INTEGER PRIMARY KEY,
+    generation  BIGINT NOT NULL DEFAULT 0,
+    updated_at  TEXT
+);
+
+INSERT INTO corpus_generation (id, generation) VALUES (1, 0) ON CONFLICT (id) DO NOTHING;
+
 -- ── CALM scopes cache ───────────────────────────────────────────────────────
 -- documents.scope_id carries the CALM scope but not its name, so there is
 -- nothing to map against without this. Populated from CalmService.list_scopes;
@@ -82,6 +175,83 @@ CREATE TABLE IF NOT EXISTS calm_scopes (
 
 CREATE INDEX IF NOT EXISTS calm_scopes_project_id_idx ON calm_scopes(project_id);
 
+-- ── Sync jobs ───────────────────────────────────────────────────────────────
+-- POST /api/sync queues a job and returns at once; a worker pool works through
+-- its items in the background (services/sync_job_service.py). Both tables live
+-- in the database so a restart resumes a half-finished job instead of losing
+-- it. Timestamps are ISO strings so they compare the same on both backends.
+CREATE TABLE IF NOT EXISTS sync_jobs (
+    id               TEXT PRIMARY KEY,
+    source_id        TEXT NOT NULL,
+    status           TEXT NOT NULL DEFAULT 'queued',  -- enumerating | queued | running | completed | failed | cancelled
+    synced_by        TEXT,
+    total            INTEGER DEFAULT 0,
+    processed        INTEGER DEFAULT 0,
+    succeeded        INTEGER DEFAULT 0,
+    failed           INTEGER DEFAULT 0,
+    cancel_requested BOOLEAN DEFAULT FALSE,
+    error            TEXT,
+    owner            TEXT,                            -- worker process holding the job
+    created_at       TEXT,
+    started_at       TEXT,
+    heartbeat_at     TEXT,
+    finished_at      TEXT
+);
+
+CREATE INDEX IF NOT EXISTS sync_jobs_status_idx ON sync_jobs(status);
+
+-- One row per document in a job. payload is the document object exactly as the
+-- client posted it, so a resumed job replays the same input.
+CREATE TABLE IF NOT EXISTS sync_job_items (
+    job_id        TEXT NOT NULL,
+    position      INTEGER NOT NULL,
+    document_id   TEXT,
+    document_name TEXT,
+    payload       TEXT,
+    status        TEXT NOT NULL DEFAULT 'pending',    -- pending | running | success | error | cancelled
+    result        TEXT,
+    started_at    TEXT,
+    finished_at   TEXT,
+    PRIMARY KEY (job_id, position)
+);
+
+-- ── CALM metadata mirror ────────────────────────────────────────────────────
+-- Local copy of the CALM listings (documents, test cases, requirements,
+-- scopes) per source and project, so the browser and sync UIs read a table
+-- instead of re-downloading the full list from CALM on every call. Kept fresh
+-- by services/calm_mirror_service.py; payload is the item exactly as CALM
+-- returned it. modified_at is CALM's modifiedAt, as the ISO string CALM sent.
+CREATE TABLE IF NOT EXISTS calm_items (
+    source_id    TEXT NOT NULL,
+    item_type    TEXT NOT NULL,          -- document | test_case | requirement | scope
+    item_id      TEXT NOT NULL,
+    project_id   TEXT NOT NULL,
+    scope_id     TEXT,
+    title        TEXT,
+    doc_type     TEXT,
+    display_id   TEXT,
+    version      INTEGER,
+    is_latest    BOOLEAN,
+    modified_at  TEXT,
+    payload      TEXT,
+    mirrored_at  TEXT,                   -- refresh that last wrote the row
+    PRIMARY KEY (source_id, item_type, item_id)
+);
+
+CREATE INDEX IF NOT EXISTS calm_items_project_idx ON calm_items(source_id, project_id, item_type);
+
+-- One row per mirrored listing. watermark is the newest modified_at seen, the
+-- lower bound of the next delta refresh.
+CREATE TABLE IF NOT EXISTS calm_mirror_state (
+    source_id          TEXT NOT NULL,
+    project_id         TEXT NOT NULL,
+    item_type          TEXT NOT NULL,
+    watermark          TEXT,
+    refreshed_at       TEXT,
+    full_refreshed_at  TEXT,
+    PRIMARY KEY (source_id, project_id, item_type)
+);
+
 -- ── Code Snippets table (user's saved code repository) ────────────────────────
 CREATE TABLE IF NOT EXISTS code_snippets (
     id              TEXT PRIMARY KEY,
@@ -19,6 +19,8 @@ down all RAG):
                                      and silently breaks retrieval, so the
                                      RAGService fallback refuses to use AI Core
                                      embeddings unless this equals its own model.
+  AI_CORE_EMBEDDING_BATCH_SIZE     — inputs per embeddings request (default 16,
+                                     the Azure OpenAI cap for older api-versions)
 """
 
 import base64
@@ -26,9 +28,10 @@ import os
 import time
 from typing import Any, Dict, List, Optional
 
-import requests
 from dotenv import load_dotenv
 
+from services import http_transport
+
 load_dotenv()
 
 
@@ -59,6 +62,10 @@ class AICoreService:
         self.embedding_api_version = os.getenv(
             "AI_CORE_EMBEDDING_API_VERSION", "2023-05-15"
         ).strip() or "2023-05-15"
+        try:
+            self.embedding_batch_size = max(1, int(os.getenv("AI_CORE_EMBEDDING_BATCH_SIZE", "16")))
+        except ValueError:
+            self.embedding_batch_size = 16
 
         self._access_token: Optional[str] = None
         self._token_expires_at: float = 0
@@ -108,7 +115,7 @@ class AICoreService:
         token_url = f"{self.auth_url}/oauth/token"
         self._log(f"Requesting OAuth token from {token_url}")
 
-        response = requests.post(
+        response = http_transport.post(
             token_url,
             headers={
                 "Authorization": f"Basic {credentials}",
@@ -151,7 +158,7 @@ class AICoreService:
 
         url = f"{self.api_url}/v2/lm/deployments"
         self._log(f"Listing deployments GET {url}")
-        response = requests.get(url, headers=self._api_headers(token), timeout=60)
+        response = http_transport.get(url, headers=self._api_headers(token), timeout=60)
         if response.status_code != 200:
             self._log(f"List deployments failed status={response.status_code} body={response.text[:500]}")
             raise RuntimeError(
@@ -280,7 +287,7 @@ class AICoreService:
             f"POST completion deployment={deployment_id} model={self.model_name} "
             f"messages={len(messages)} max_tokens={max_tokens}"
         )
-        response = requests.post(
+        response = http_transport.post(
             endpoint,
             headers=self._api_headers(token),
             json=body,
@@ -309,11 +316,21 @@ class AICoreService:
         confirming that model matches the corpus before mixing these vectors with
         stored ones.
         """
+        return self.create_embeddings([text])[0]
+
+    def create_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Embed many strings, embedding_batch_size inputs per request.
+
+        Returns one vector per input, in input order. The same model caveat as
+        create_embedding applies.
+        """
         if not self.is_embeddings_configured():
             raise RuntimeError(
                 "AI Core embeddings not configured. Set AI_CORE_EMBEDDING_DEPLOYMENT_ID "
                 "and AI_CORE_EMBEDDING_MODEL."
             )
+        if not texts:
+            return []
         token = self._get_access_token()
         # Azure OpenAI (which AI Core proxies) requires api-version on the query
         # string; the deployment already pins the model, so the body carries only
@@ -322,25 +339,32 @@ class AICoreService:
             f"{self.api_url}/v2/inference/deployments/{self.embedding_deployment_id}"
             f"/embeddings?api-version={self.embedding_api_version}"
         )
-        response = requests.post(
-            endpoint,
-            headers=self._api_headers(token),
-            json={"input": [text]},
-            timeout=60,
-        )
-        if response.status_code != 200:
-            self._log(f"Embedding failed status={response.status_code} body={response.text[:400]}")
-            raise RuntimeError(
-                f"SAP AI Core embedding failed ({response.status_code}): {response.text[:300]}"
-            )
-        payload = response.json()
-        # OpenAI-compatible shape: {"data": [{"embedding": [...]}]}
-        data = payload.get("data") or []
-        if not data or "embedding" not in data[0]:
-            raise RuntimeError(
-                f"SAP AI Core embedding response had no vector. keys={list(payload.keys())}"
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.embedding_batch_size):
+            batch = list(texts[start:start + self.embedding_batch_size])
+            response = http_transport.post(
+                endpoint,
+                headers=self._api_headers(token),
+                json={"input": batch},
+                timeout=60,
             )
-        return list(data[0]["embedding"])
+            if response.status_code != 200:
+                self._log(f"Embedding failed status={response.status_code} body={response.text[:400]}")
+                raise RuntimeError(
+                    f"SAP AI Core embedding failed ({response.status_code}): {response.text[:300]}"
+                )
+            payload = response.json()
+            # OpenAI-compatible shape: {"data": [{"index": 0, "embedding": [...]}, ...]}
+            data = payload.get("data") or []
+            if len(data) != len(batch) or any("embedding" not in item for item in data):
+                raise RuntimeError(
+                    f"SAP AI Core embedding response had {len(data)} vector(s) for "
+                    f"{len(batch)} input(s). keys={list(payload.keys())}"
+                )
+            # The API does not promise response order; index does.
+            data = sorted(data, key=lambda item: item.get("index", 0))
+            vectors.extend(list(item["embedding"]) for item in data)
+        return vectors
 
     def verify_connection(self) -> Dict[str, Any]:
         """Lightweight connectivity check for diagnostics."""
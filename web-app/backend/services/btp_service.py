@@ -3,10 +3,11 @@ BTP Service
 Handles interactions with SAP BTP OData services
 """
 
-import requests
 import json
 from typing import Dict, Any, Optional
 
+from services import http_transport
+
 
 class BtpODataError(Exception):
     def __init__(self, status_code: int, message: str, raw_body: Any = None):
@@ -46,7 +47,7 @@ class BTPService:
                 'client_secret': self.client_secret
             }
             
-            response = requests.post(
+            response = http_transport.post(
                 self.token_url,
                 auth=auth, # Basic Auth header
                 data=data, # Also in body
@@ -72,7 +73,7 @@ class BTPService:
                 'Authorization': f'Bearer {token}',
                 'Accept': 'application/json'
             }
-            response = requests.get(
+            response = http_transport.get(
                 self.api_endpoint,
                 headers=headers,
                 timeout=10
@@ -155,7 +156,7 @@ class BTPService:
                 'Accept': 'application/json'
             }
             
-            response = requests.get(
+            response = http_transport.get(
                 full_url,
                 headers=headers,
                 timeout=60
@@ -235,7 +236,7 @@ class BTPService:
                     
                     try:
                         print(f"[BTP] Trying content fetch: {url}")
-                        response = requests.get(
+                        response = http_transport.get(
                             url, 
                             headers={**headers, 'Accept': 'application/json;odata.metadata=minimal'}, 
                             timeout=12
@@ -283,7 +284,7 @@ class BTPService:
             try:
                 print(f"[BTP] Last resort: filtering sourcecodeSet for Object='{object_key}'")
                 fallback_url = base_url + f"/sourcecodeSet?$filter=Object eq '{object_key}'"
-                resp = requests.get(fallback_url, headers=headers, timeout=15)
+                resp = http_transport.get(fallback_url, headers=headers, timeout=15)
                 if resp.status_code == 200:
                     data = resp.json()
                     items = data.get('value', data.get('d', {}).get('results', []))
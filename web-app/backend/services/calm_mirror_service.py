@@ -0,0 +1,349 @@
+"""
+Local mirror of CALM listing metadata.
+
+The Cloud ALM browser and the sync UI list a project's documents, test cases,
+requirements and scopes on every visit, and each of those used to be a
+multi-second round trip that re-downloaded the whole list. This keeps a copy
+of every item's metadata in calm_items, per source and project, and serves the
+listings from it.
+
+Freshness:
+  - A listing older than MAX_AGE_SECONDS is refreshed before it is served.
+  - Documents refresh incrementally: only items whose modifiedAt is at or
+    after the newest one already mirrored are fetched.
+  - A delta cannot see deletions, so every FULL_REFRESH_SECONDS the listing
+    is re-read in full and rows the full read did not touch are dropped.
+    Test cases, requirements and scopes have no usable modifiedAt filter and
+    are always read in full.
+  - If CALM is unreachable, the last mirrored copy is served rather than
+    nothing; only a listing that was never mirrored fails.
+
+Callers that need CALM's current answer pass live=true to the listing routes,
+which bypasses this entirely.
+"""
+
+import json
+import os
+import threading
+from datetime import datetime
+
+import psycopg2.extras
+
+from db import SQLiteConnectionProxy, get_conn
+
+ITEM_DOCUMENT = 'document'
+ITEM_TEST_CASE = 'test_case'
+ITEM_REQUIREMENT = 'requirement'
+ITEM_SCOPE = 'scope'
+
+ITEM_COLUMNS = (
+    'source_id', 'item_type', 'item_id', 'project_id', 'scope_id', 'title',
+    'doc_type', 'display_id', 'version', 'is_latest', 'modified_at', 'payload',
+    'mirrored_at',
+)
+
+_UPSERT_TEMPLATE = """
+    INSERT INTO calm_items ({columns})
+    VALUES {{values}}
+    ON CONFLICT (source_id, item_type, item_id) DO UPDATE SET
+        {updates}
+""".format(
+    columns=", ".join(ITEM_COLUMNS),
+    updates=",\n        ".join(
+        f"{c} = EXCLUDED.{c}" for c in ITEM_COLUMNS[3:]
+    ),
+)
+_UPSERT_ROW_SQL = _UPSERT_TEMPLATE.format(values="(" + ", ".join(["%s"] * len(ITEM_COLUMNS)) + ")")
+_UPSERT_VALUES_SQL = _UPSERT_TEMPLATE.format(values="%s")
+
+
+class CalmMirrorService:
+    """Keeps calm_items in step with CALM and answers listings from it."""
+
+    MAX_AGE_SECONDS = int(os.getenv("CALM_MIRROR_MAX_AGE_SECONDS", "120"))
+    FULL_REFRESH_SECONDS = int(os.getenv("CALM_MIRROR_FULL_REFRESH_SECONDS", str(6 * 3600)))
+    # Item rows per upsert statement.
+    WRITE_BATCH = 500
+
+    def __init__(self):
+        # One refresh per listing at a time; concurrent callers wait and then
+        # read what the first one wrote.
+        self._locks = {}
+        self._locks_lock = threading.Lock()
+
+    # ── Reads ─────────────────────────────────────────────────────────────────
+
+    def list_items(self, service, source_id: str, project_id: str, item_type: str,
+                   latest_only: bool = False, doc_type=None, scope_id=None,
+                   refresh: bool = True) -> list:
+        """Mirrored items for a project, refreshed first if stale (unless refresh=False).
+
+        Returns the CALM payloads, with isLatest taken from the mirror (which
+        notices superseded versions CALM never re-sends).
+        """
+        if refresh:
+            self.ensure_fresh(service, source_id, project_id, item_type)
+
+        clauses = ["source_id = %s", "project_id = %s", "item_type = %s"]
+        params = [str(source_id), str(project_id), item_type]
+        if latest_only:
+            clauses.append("(is_latest IS NULL OR is_latest = %s)")
+            params.append(True)
+        if doc_type:
+            clauses.append("doc_type = %s")
+            params.append(doc_type)
+        if scope_id:
+            clauses.append("scope_id = %s")
+            params.append(str(scope_id))
+        order = "modified_at DESC" if item_type == ITEM_DOCUMENT else "title"
+
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    f"SELECT payload, is_latest FROM calm_items WHERE {' AND '.join(clauses)} "
+                    f"ORDER BY {order}",
+                    params,
+                )
+                items = []
+                for row in cur.fetchall():
+                    item = json.loads(row[0]) if row[0] else {}
+                    if row[1] is not None and 'isLatest' in item:
+                        item['isLatest'] = bool(row[1])
+                    items.append(item)
+                return items
+        finally:
+            conn.close()
+
+    def modified_index(self, source_id: str, project_id: str) -> dict:
+        """item_id -> (item_type, modified_at) for every mirrored item in a project."""
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT item_id, item_type, modified_at FROM calm_items
+                    WHERE source_id = %s AND project_id = %s AND item_type != %s
+                      AND (is_latest IS NULL OR is_latest = %s)
+                    """,
+                    (str(source_id), str(project_id), ITEM_SCOPE, True),
+                )
+                return {row[0]: (row[1], row[2]) for row in cur.fetchall()}
+        finally:
+            conn.close()
+
+    def refreshed_at(self, source_id: str, project_id: str, item_type: str):
+        state = self._load_state(source_id, project_id, item_type)
+        return state['refreshed_at'] if state else None
+
+    # ── Refresh ───────────────────────────────────────────────────────────────
+
+    def ensure_fresh(self, service, source_id: str, project_id: str, item_type: str) -> bool:
+        """Refresh the listing if it is older than MAX_AGE_SECONDS. True if it refreshed."""
+        with self._lock_for(source_id, project_id, item_type):
+            state = self._load_state(source_id, project_id, item_type)
+            now = datetime.now()
+            if state and state['refreshed_at'] and \
+                    (now - datetime.fromisoformat(state['refreshed_at'])).total_seconds() < self.MAX_AGE_SECONDS:
+                return False
+
+            full = (
+                not state
+                or item_type != ITEM_DOCUMENT
+                or not state['watermark']
+                or not state['full_refreshed_at']
+                or (now - datetime.fromisoformat(state['full_refreshed_at'])).total_seconds() >= self.FULL_REFRESH_SECONDS
+            )
+            try:
+                self.refresh(service, source_id, project_id, item_type, full=full, state=state)
+            except Exception as e:
+                if not state:
+                    raise
+                print(f"CALM_MIRROR: refresh of {item_type}s for project {project_id} failed, "
+                      f"serving the copy from {state['refreshed_at']}: {e}")
+                return False
+            return True
+
+    def refresh(self, service, source_id: str, project_id: str, item_type: str,
+                full: bool = True, state=None):
+        """Pull a listing from CALM into calm_items."""
+        stamp = datetime.now().isoformat()
+        since = None if full else (state or {}).get('watermark')
+        # Read the whole listing before taking a connection: paging CALM inside
+        # the transaction would hold it open (and SQLite's write lock) for as
+        # long as CALM takes. The rows are small, and one transaction keeps a
+        # failed read from deleting anything.
+        rows = [
+            self._item_row(source_id, project_id, item_type, item, stamp)
+            for item in self._fetch(service, project_id, item_type, since)
+        ]
+        count = len(rows)
+
+        conn = get_conn()
+        try:
+            for start in range(0, count, self.WRITE_BATCH):
+                self._write(conn, rows[start:start + self.WRITE_BATCH])
+
+            with conn.cursor() as cur:
+                if full:
+                    # Anything the full read did not touch is gone from CALM
+                    cur.execute(
+                        """
+                        DELETE FROM calm_items
+                        WHERE source_id = %s AND project_id = %s AND item_type = %s
+                          AND mirrored_at < %s
+                        """,
+                        (str(source_id), str(project_id), item_type, stamp),
+                    )
+                if item_type == ITEM_DOCUMENT:
+                    self._retire_superseded_versions(cur, source_id, project_id)
+                cur.execute(
+                    """
+                    SELECT MAX(modified_at) FROM calm_items
+                    WHERE source_id = %s AND project_id = %s AND item_type = %s
+                    """,
+                    (str(source_id), str(project_id), item_type),
+                )
+                row = cur.fetchone()
+                watermark = row[0] if row else None
+                cur.execute(
+                    """
+                    INSERT INTO calm_mirror_state
+                        (source_id, project_id, item_type, watermark, refreshed_at, full_refreshed_at)
+                    VALUES (%s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (source_id, project_id, item_type) DO UPDATE SET
+                        watermark = EXCLUDED.watermark,
+                        refreshed_at = EXCLUDED.refreshed_at,
+                        full_refreshed_at = COALESCE(EXCLUDED.full_refreshed_at,
+                                                     calm_mirror_state.full_refreshed_at)
+                    """,
+                    (str(source_id), str(project_id), item_type, watermark, stamp,
+                     stamp if full else None),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        print(f"CALM_MIRROR: {'full' if full else 'delta'} refresh of {item_type}s "
+              f"for project {project_id}: {count} item(s)")
+        return count
+
+    @staticmethod
+    def _fetch(service, project_id: str, item_type: str, since):
+        if item_type == ITEM_DOCUMENT:
+            # Every version: the mirror answers latest-only listings itself
+            return service.iter_documents(project_id=project_id, latest_only=False,
+                                          modified_since=since)
+        if item_type == ITEM_TEST_CASE:
+            return service.iter_manual_test_cases(project_id=project_id)
+        if item_type == ITEM_REQUIREMENT:
+            return service.iter_requirements(project_id)
+        if item_type == ITEM_SCOPE:
+            return service.iter_scopes(project_id)
+        raise ValueError(f"Unknown CALM item type: {item_type}")
+
+    @staticmethod
+    def _item_row(source_id, project_id, item_type, item: dict, stamp: str) -> tuple:
+        item_id = item.get('uuid') or item.get('id')
+        version = item.get('version')
+        try:
+            version = int(version) if version is not None else None
+        except (TypeError, ValueError):
+            version = None
+        is_latest = item.get('isLatest')
+        return (
+            str(source_id),
+            item_type,
+            str(item_id),
+            str(project_id),
+            str(item['scopeId']) if item.get('scopeId') else None,
+            item.get('title') or item.get('name'),
+            item.get('documentTypeCode'),
+            item.get('displayId'),
+            version,
+            bool(is_latest) if is_latest is not None else None,
+            item.get('modifiedAt') or item.get('lastChangedDate'),
+            json.dumps(item),
+            stamp,
+        )
+
+    def _write(self, conn, rows):
+        # A statement may not upsert the same key twice, so the last row wins.
+        rows = list({(row[1], row[2]): row for row in rows}.values())
+        with conn.cursor() as cur:
+            if isinstance(conn, SQLiteConnectionProxy):
+                cur.executemany(_UPSERT_ROW_SQL, rows)
+            else:
+                psycopg2.extras.execute_values(cur, _UPSERT_VALUES_SQL, rows,
+                                               page_size=self.WRITE_BATCH)
+
+    @staticmethod
+    def _retire_superseded_versions(cur, source_id, project_id):
+        # A new version arrives with a fresh modifiedAt, but the version it
+        # replaces is not necessarily modified — a delta never re-sends it, so
+        # its isLatest would stay true here forever. Clear it ourselves.
+        cur.execute(
+            """
+            UPDATE calm_items SET is_latest = %s
+            WHERE source_id = %s AND project_id = %s AND item_type = %s
+              AND is_latest = %s AND display_id IS NOT NULL
+              AND EXISTS (
+                  SELECT 1 FROM calm_items newer
+                  WHERE newer.source_id = calm_items.source_id
+                    AND newer.project_id = calm_items.project_id
+                    AND newer.item_type = calm_items.item_type
+                    AND newer.display_id = calm_items.display_id
+                    AND newer.version > calm_items.version
+              )
+            """,
+            (False, str(source_id), str(project_id), ITEM_DOCUMENT, True),
+        )
+
+    # ── State ─────────────────────────────────────────────────────────────────
+
+    def _lock_for(self, source_id, project_id, item_type) -> threading.Lock:
+        key = (str(source_id), str(project_id), item_type)
+        with self._locks_lock:
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def _load_state(source_id, project_id, item_type):
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT watermark, refreshed_at, full_refreshed_at FROM calm_mirror_state
+                    WHERE source_id = %s AND project_id = %s AND item_type = %s
+                    """,
+                    (str(source_id), str(project_id), item_type),
+                )
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return None
+        return {'watermark': row[0], 'refreshed_at': row[1], 'full_refreshed_at': row[2]}
+
+
+def to_local_naive(value):
+    """CALM timestamps ('2026-01-20T10:15:00.000Z') as naive local time, the way
+    documents.synced_on is stored. None if unparseable."""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
@@ -3,15 +3,22 @@ Cloud ALM Service
 Handles integration with SAP Cloud ALM APIs for document management
 """
 
+import hashlib
 import os
+import threading
 import requests
-from typing import List, Dict, Optional
+from typing import Dict, Iterator, List, Optional
 from datetime import datetime, timedelta
 import json
 import urllib.parse
 
+from services import http_transport
+
 class CALMService:
     """Service for interacting with SAP Cloud ALM APIs"""
+
+    # Items requested per page by the iter_* listing generators
+    PAGE_SIZE = int(os.getenv("CALM_PAGE_SIZE", "500"))
     
     def __init__(self, config: Optional[Dict] = None, use_env_fallback: bool = True):
         """
@@ -21,26 +28,17 @@ class CALMService:
             config: Optional configuration dict. If not provided or keys missing, uses environment variables.
             use_env_fallback: If True, falls back to environment variables. If False, only uses provided config.
         """
-        config = config or {}
-        
-        # Helper to get value from config, then env var (if allowed), then default
-        def get_conf(key, env_var, default=''):
-            val = config.get(key)
-            if val and str(val).strip(): # If value exists and is not empty/whitespace
-                return val
-            if use_env_fallback:
-                return os.getenv(env_var, default)
-            return default
-
-        self.api_endpoint = get_conf('apiEndpoint', 'CALM_API_ENDPOINT')
-        self.token_url = get_conf('tokenUrl', 'CALM_TOKEN_URL')
-        self.client_id = get_conf('clientId', 'CALM_CLIENT_ID')
-        self.client_secret = get_conf('clientSecret', 'CALM_CLIENT_SECRET')
+        (self.api_endpoint, self.token_url,
+         self.client_id, self.client_secret) = _resolve_credentials(config, use_env_fallback)
         
         print(f"DEBUG CALMService initialized with api_endpoint: {self.api_endpoint}")
         
         self._access_token = None
         self._token_expiry = None
+        # One refresh at a time: concurrent sync fetches that find the token
+        # expired wait for the first caller's refresh instead of each posting
+        # their own client-credentials request.
+        self._token_lock = threading.Lock()
         self._using_demo_data = False
         self._last_error = None
     
@@ -52,15 +50,32 @@ class CALMService:
             Access token string
         """
         # Check if we have a valid cached token
-        if self._access_token and self._token_expiry and datetime.now() < self._token_expiry:
+        if self._token_valid():
             return self._access_token
         
         if not self.token_url or not self.client_id or not self.client_secret:
             raise ValueError("CALM credentials not configured")
         
+        with self._token_lock:
+            # Another thread may have refreshed while we waited for the lock
+            if self._token_valid():
+                return self._access_token
+            return self._fetch_access_token()
+
+    def _token_valid(self) -> bool:
+        return bool(self._access_token and self._token_expiry and datetime.now() < self._token_expiry)
+
+    def invalidate_token(self):
+        """Drop the cached token so the next request fetches a new one"""
+        with self._token_lock:
+            self._access_token = None
+            self._token_expiry = None
+
+    def _fetch_access_token(self) -> str:
+        """Client-credentials round trip. Caller holds _token_lock."""
         try:
             # Use basic auth for client credentials if needed, or form data
-            response = requests.post(
+            response = http_transport.post(
                 self.token_url,
                 data={
                     'grant_type': 'client_credentials',
@@ -75,10 +90,12 @@ class CALMService:
             response.raise_for_status()
             
             token_data = response.json()
-            self._access_token = token_data.get('access_token')
             
-            # Calculate token expiry (with 5 minute buffer)
+            # Calculate token expiry (with 5 minute buffer). The token goes in
+            # first: _token_valid() reads both without the lock, and a fresh
+            # expiry next to the old token would pass a stale one as valid.
             expires_in = token_data.get('expires_in', 3600)
+            self._access_token = token_data.get('access_token')
             self._token_expiry = datetime.now() + timedelta(seconds=expires_in - 300)
             
             return self._access_token
@@ -120,7 +137,7 @@ class CALMService:
         # Some APIs might be on different subdomains, but assuming api_endpoint is the API gateway
         url = f"{self.api_endpoint}{endpoint}"
         
-        response = requests.request(
+        response = http_transport.request(
             method,
             url,
             headers=headers,
@@ -131,6 +148,85 @@ class CALMService:
         
         return response.json() if response.content else {}
     
+    def _iter_pages(
+        self,
+        url: str,
+        list_key: str = 'value',
+        page_size: Optional[int] = None,
+        paged: bool = True,
+    ) -> Iterator[Dict]:
+        """
+        Yield the items of a list endpoint one page at a time
+        
+        Follows @odata.nextLink when the server sends one. Otherwise, for
+        endpoints that take OData paging (paged=True), requests $top/$skip
+        pages until an empty or repeated page comes back. A short page ends
+        the listing only once a full page has shown the server honours $top;
+        a server capping pages below page_size sends nothing but short ones.
+        Only one page is held in memory.
+        
+        Args:
+            url: List URL, with any $filter/$orderby already applied
+            list_key: Response key holding the items when it is not 'value'
+            page_size: Items per page (defaults to PAGE_SIZE)
+            paged: Whether the endpoint understands $top/$skip
+        """
+        page_size = page_size or self.PAGE_SIZE
+        skip = 0
+        next_url = self._page_url(url, page_size, skip) if paged else url
+        previous_first = None
+        honours_top = False
+
+        while next_url:
+            token = self._get_access_token()
+            response = http_transport.get(
+                next_url,
+                headers={
+                    'Authorization': f'Bearer {token}',
+                    'Content-Type': 'application/json',
+                },
+                timeout=60,
+            )
+            response.raise_for_status()
+            data = response.json()
+
+            if isinstance(data, list):
+                items, next_link = data, None
+            else:
+                items = data.get('value', data.get(list_key, []))
+                next_link = data.get('@odata.nextLink') or data.get('odata.nextLink')
+            if not items:
+                return
+
+            # A server that ignores $skip hands back the same first page forever
+            first = json.dumps(items[0], sort_keys=True, default=str)
+            if first == previous_first:
+                return
+            previous_first = first
+
+            yield from items
+
+            if next_link:
+                next_url = urllib.parse.urljoin(next_url, next_link)
+            elif not paged or len(items) > page_size:
+                # More than we asked for: the server ignored $top and sent everything
+                return
+            elif len(items) < page_size and honours_top:
+                # Short page from a server that fills pages: the last one
+                return
+            else:
+                honours_top = honours_top or len(items) == page_size
+                skip += len(items)
+                next_url = self._page_url(url, page_size, skip)
+
+    @staticmethod
+    def _page_url(url: str, top: int, skip: int) -> str:
+        separator = '&' if '?' in url else '?'
+        page_url = f"{url}{separator}$top={top}"
+        if skip:
+            page_url += f"&$skip={skip}"
+        return page_url
+
     def test_connection(self) -> bool:
         """
         Test connection to CALM API
@@ -236,7 +332,7 @@ class CALMService:
                 'Authorization': f'Bearer {token}',
                 'Content-Type': 'application/json'
             }
-            response = requests.get(url, headers=headers, timeout=60)
+            response = http_transport.get(url, headers=headers, timeout=60)
             response.raise_for_status()
             data = response.json()
             return data.get('value', data.get('scopes', []))
@@ -244,6 +340,20 @@ class CALMService:
             print(f"Error listing scopes: {e}")
             return self._get_demo_scopes(project_id)
     
+    def iter_scopes(self, project_id: str) -> Iterator[Dict]:
+        """
+        Iterate scopes for a project. Unlike list_scopes, errors are raised
+        rather than answered with demo scopes.
+        
+        Args:
+            project_id: Parent project ID
+            
+        Yields:
+            Scope objects
+        """
+        url = f"{self.api_endpoint}/api/calm-processmanagement/v1/scopes?$filter=projectId eq '{project_id}'"
+        return self._iter_pages(url, list_key='scopes', paged=False)
+    
     # =========================================================================
     # Solution Process API
     # =========================================================================
@@ -265,7 +375,7 @@ class CALMService:
                 'Authorization': f'Bearer {token}',
                 'Content-Type': 'application/json'
             }
-            response = requests.get(url, headers=headers, timeout=60)
+            response = http_transport.get(url, headers=headers, timeout=60)
             response.raise_for_status()
             data = response.json()
             return data.get('value', data.get('processes', []))
@@ -277,6 +387,49 @@ class CALMService:
     # Document API
     # =========================================================================
     
+    def iter_documents(
+        self,
+        process_id: Optional[str] = None,
+        document_type: Optional[str] = None,
+        project_id: Optional[str] = None,
+        latest_only: bool = True,
+        page_size: Optional[int] = None,
+        modified_since: Optional[str] = None,
+    ) -> Iterator[Dict]:
+        """
+        Iterate documents page by page, newest first, using OData query syntax
+        
+        Args:
+            process_id: Filter by solution process ID
+            document_type: Filter by document type
+            project_id: Filter by project ID
+            latest_only: When True, yield only the latest version of each document
+            page_size: Documents per request (defaults to PAGE_SIZE)
+            modified_since: ISO timestamp; only documents modified at or after it
+            
+        Yields:
+            Document objects. Errors are raised, not replaced with demo data.
+        """
+        filter_parts = []
+        if project_id:
+            filter_parts.append(f"projectId eq {project_id}")
+        if latest_only:
+            filter_parts.append("isLatest eq true")
+        if document_type:
+            filter_parts.append(f"documentTypeCode eq '{document_type}'")
+        if modified_since:
+            # DateTimeOffset literal: unquoted in OData v4
+            filter_parts.append(f"modifiedAt ge {modified_since}")
+
+        query_parts = []
+        if filter_parts:
+            encoded_filter = urllib.parse.quote(" and ".join(filter_parts))
+            query_parts.append(f"$filter={encoded_filter}")
+        query_parts.append("$orderby=modifiedAt desc")
+
+        url = f"{self.api_endpoint}/api/calm-documents/v1/Documents?" + "&".join(query_parts)
+        return self._iter_pages(url, list_key='documents', page_size=page_size)
+
     def list_documents(
         self, 
         process_id: Optional[str] = None,
@@ -298,33 +451,12 @@ class CALMService:
         """
         try:
             self._using_demo_data = False
-            filter_parts = []
-            if project_id:
-                filter_parts.append(f"projectId eq {project_id}")
-            if latest_only:
-                filter_parts.append("isLatest eq true")
-            if document_type:
-                filter_parts.append(f"documentTypeCode eq '{document_type}'")
-
-            query_parts = []
-            if filter_parts:
-                encoded_filter = urllib.parse.quote(" and ".join(filter_parts))
-                query_parts.append(f"$filter={encoded_filter}")
-            query_parts.append("$orderby=modifiedAt desc")
-
-            url = f"{self.api_endpoint}/api/calm-documents/v1/Documents"
-            if query_parts:
-                url += "?" + "&".join(query_parts)
-
-            token = self._get_access_token()
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json',
-            }
-            response = requests.get(url, headers=headers, timeout=60)
-            response.raise_for_status()
-            data = response.json()
-            documents = data.get('value', data.get('documents', []))
+            documents = list(self.iter_documents(
+                process_id=process_id,
+                document_type=document_type,
+                project_id=project_id,
+                latest_only=latest_only,
+            ))
             return {'documents': documents, 'isDemo': False}
         except Exception as e:
             self._using_demo_data = True
@@ -368,7 +500,7 @@ class CALMService:
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
         }
-        response = requests.get(url, headers=headers, timeout=60)
+        response = http_transport.get(url, headers=headers, timeout=60)
         response.raise_for_status()
         versions = response.json().get('value', [])
         return versions if versions else [doc]
@@ -390,7 +522,7 @@ class CALMService:
                 'Authorization': f'Bearer {token}',
                 'Content-Type': 'application/json'
             }
-            response = requests.get(url, headers=headers, timeout=60)
+            response = http_transport.get(url, headers=headers, timeout=60)
             response.raise_for_status()
             return response.json()
         except Exception as e:
@@ -410,7 +542,7 @@ class CALMService:
         try:
             token = self._get_access_token()
             
-            response = requests.get(
+            response = http_transport.get(
                 f"{self.api_endpoint}/api/calm-documents/v1/Documents/{document_id}/content",
                 headers={'Authorization': f'Bearer {token}'},
                 timeout=120
@@ -463,7 +595,7 @@ class CALMService:
             print(f"DEBUG push_document url: {url}")
             print(f"DEBUG push_document token (first 20 chars): {token[:20]}...")
             print(f"DEBUG push_document payload (excluding content): { {k: v for k, v in payload.items() if k != 'content'} }")
-            response = requests.post(
+            response = http_transport.post(
                 url,
                 headers={
                     'Authorization': f'Bearer {token}',
@@ -485,6 +617,35 @@ class CALMService:
     # Manual Test Case API
     # =========================================================================
     
+    def iter_manual_test_cases(
+        self,
+        project_id: str,
+        scope_id: Optional[str] = None,
+        page_size: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        Iterate Manual Test Cases from Cloud ALM page by page
+        
+        Args:
+            project_id: Project ID (UUID) - required
+            scope_id: Scope ID (UUID) - optional filter
+            page_size: Test cases per request (defaults to PAGE_SIZE)
+            
+        Yields:
+            Test case objects
+        """
+        # Build filter query - projectId and scopeId are GUIDs, not strings, so no quotes
+        filter_parts = [f"projectId eq {project_id}"]
+        if scope_id:
+            filter_parts.append(f"scopeId eq {scope_id}")
+        
+        filter_query = ' and '.join(filter_parts)
+        encoded_filter = urllib.parse.quote(filter_query)
+        
+        url = f"{self.api_endpoint}/api/calm-testmanagement/v1/ManualTestCases?$filter={encoded_filter}"
+        print(f"DEBUG iter_manual_test_cases url: {url}")
+        return self._iter_pages(url, page_size=page_size)
+
     def list_manual_test_cases(
         self,
         project_id: str,
@@ -501,36 +662,7 @@ class CALMService:
             List of test case objects
         """
         try:
-            token = self._get_access_token()
-            
-            # Build filter query - projectId and scopeId are GUIDs, not strings, so no quotes
-            filter_parts = [f"projectId eq {project_id}"]
-            if scope_id:
-                filter_parts.append(f"scopeId eq {scope_id}")
-            
-            filter_query = ' and '.join(filter_parts)
-            encoded_filter = urllib.parse.quote(filter_query)
-            
-            url = f"{self.api_endpoint}/api/calm-testmanagement/v1/ManualTestCases?$filter={encoded_filter}"
-            print(f"DEBUG list_manual_test_cases url: {url}")
-            print(f"DEBUG list_manual_test_cases filter: {filter_query}")
-            print(f"DEBUG list_manual_test_cases api_endpoint: {self.api_endpoint}")
-            
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=60)
-            
-            print(f"DEBUG list_manual_test_cases response status: {response.status_code}")
-            print(f"DEBUG list_manual_test_cases response body (first 500 chars): {response.text[:500]}")
-            
-            response.raise_for_status()
-            
-            data = response.json()
-            test_cases = data.get('value', [])
-            
+            test_cases = list(self.iter_manual_test_cases(project_id, scope_id))
             print(f"DEBUG list_manual_test_cases found {len(test_cases)} test cases")
             return test_cases
             
@@ -566,7 +698,7 @@ class CALMService:
                 'Content-Type': 'application/json'
             }
             
-            response = requests.get(url, headers=headers, timeout=60)
+            response = http_transport.get(url, headers=headers, timeout=60)
             
             print(f"DEBUG get_manual_test_case response status: {response.status_code}")
             print(f"DEBUG get_manual_test_case response body (first 1000 chars): {response.text[:1000]}")
@@ -626,7 +758,7 @@ class CALMService:
             print(f"DEBUG create_manual_test_case url: {url}")
             print(f"DEBUG create_manual_test_case payload: {json.dumps(payload, indent=2)}")
             
-            response = requests.post(
+            response = http_transport.post(
                 url,
                 headers={
                     'Authorization': f'Bearer {token}',
@@ -652,6 +784,32 @@ class CALMService:
     # Tasks API (Requirements, User Stories, etc.)
     # =========================================================================
 
+    def iter_tasks(
+        self,
+        project_id: str,
+        task_type: Optional[str] = None,
+    ) -> Iterator[Dict]:
+        """
+        Iterate tasks from Cloud ALM via the calm-tasks API.
+
+        calm-tasks is not an OData service, so no $top/$skip is sent; a
+        nextLink in the response is still followed.
+
+        Args:
+            project_id: Project ID (UUID) - required
+            task_type: Optional filter, e.g. CALMREQU for requirements
+
+        Yields:
+            Task objects
+        """
+        query_parts = [f"projectId={project_id}"]
+        if task_type:
+            query_parts.append(f"type={task_type}")
+
+        url = f"{self.api_endpoint}/api/calm-tasks/v1/tasks?{'&'.join(query_parts)}"
+        print(f"DEBUG iter_tasks url: {url}")
+        return self._iter_pages(url, list_key='tasks', paged=False)
+
     def list_tasks(
         self,
         project_id: str,
@@ -668,30 +826,7 @@ class CALMService:
             List of task objects
         """
         try:
-            token = self._get_access_token()
-
-            query_parts = [f"projectId={project_id}"]
-            if task_type:
-                query_parts.append(f"type={task_type}")
-
-            url = f"{self.api_endpoint}/api/calm-tasks/v1/tasks?{'&'.join(query_parts)}"
-            print(f"DEBUG list_tasks url: {url}")
-
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json',
-            }
-
-            response = requests.get(url, headers=headers, timeout=60)
-            print(f"DEBUG list_tasks response status: {response.status_code}")
-            print(f"DEBUG list_tasks response body (first 500 chars): {response.text[:500]}")
-
-            response.raise_for_status()
-
-            data = response.json()
-            if isinstance(data, list):
-                return data
-            return data.get('value', data.get('tasks', []))
+            return list(self.iter_tasks(project_id, task_type))
 
         except Exception as e:
             print(f"Error listing tasks: {e}")
@@ -700,6 +835,10 @@ class CALMService:
                 print(f"Response body: {e.response.text}")
             raise
 
+    def iter_requirements(self, project_id: str) -> Iterator[Dict]:
+        """Iterate requirements (CALMREQU tasks) for a project."""
+        return self.iter_tasks(project_id, task_type='CALMREQU')
+
     def list_requirements(self, project_id: str) -> List[Dict]:
         """List requirements (CALMREQU tasks) for a project."""
         return self.list_tasks(project_id, task_type='CALMREQU')
@@ -724,7 +863,7 @@ class CALMService:
                 'Content-Type': 'application/json',
             }
 
-            response = requests.get(url, headers=headers, timeout=60)
+            response = http_transport.get(url, headers=headers, timeout=60)
             print(f"DEBUG get_task response status: {response.status_code}")
             print(f"DEBUG get_task response body (first 1000 chars): {response.text[:1000]}")
 
@@ -896,25 +1035,76 @@ class CALMService:
         ]
 
 
-# Singleton instance with default config
-_default_service = None
+def _resolve_credentials(config: Optional[Dict], use_env_fallback: bool = True):
+    """
+    Resolve (api_endpoint, token_url, client_id, client_secret) from a source
+    config, falling back to environment variables for missing keys
+    """
+    config = config or {}
+    
+    # Helper to get value from config, then env var (if allowed), then default
+    def get_conf(key, env_var, default=''):
+        val = config.get(key)
+        if val and str(val).strip(): # If value exists and is not empty/whitespace
+            return val
+        if use_env_fallback:
+            return os.getenv(env_var, default)
+        return default
+
+    return (
+        get_conf('apiEndpoint', 'CALM_API_ENDPOINT'),
+        get_conf('tokenUrl', 'CALM_TOKEN_URL'),
+        get_conf('clientId', 'CALM_CLIENT_ID'),
+        get_conf('clientSecret', 'CALM_CLIENT_SECRET'),
+    )
+
+
+def _registry_key(config: Optional[Dict]) -> tuple:
+    api_endpoint, token_url, client_id, client_secret = _resolve_credentials(config)
+    # Hash the secret so the key never holds it in the clear
+    secret_hash = hashlib.sha256(str(client_secret).encode('utf-8')).hexdigest()
+    return (api_endpoint, token_url, client_id, secret_hash)
+
+
+# One service per set of credentials, shared by every request in the process.
+# Routes used to build a new CALMService per call, so its token cache never got
+# a second use and every listing paid for a fresh OAuth round trip.
+_services: Dict[tuple, CALMService] = {}
+_services_lock = threading.Lock()
 
 def get_calm_service(config: Optional[Dict] = None) -> CALMService:
     """
-    Get CALM service instance
+    Get the shared CALM service instance for a configuration
     
     Args:
-        config: Optional configuration dict
+        config: Optional configuration dict (environment variables fill missing keys)
         
     Returns:
         CALMService instance
     """
-    global _default_service
-    
-    if config:
-        return CALMService(config)
-    
-    if _default_service is None:
-        _default_service = CALMService()
+    key = _registry_key(config)
+    with _services_lock:
+        service = _services.get(key)
+        if service is None:
+            service = CALMService(config)
+            _services[key] = service
+        return service
+
+
+def invalidate_calm_service(config: Optional[Dict] = None) -> bool:
+    """
+    Forget the shared instance for a configuration, e.g. after its credentials
+    changed, so its cached token and connections are not reused
     
-    return _default_service
+    Args:
+        config: The configuration the instance was created with
+        
+    Returns:
+        True if an instance was removed
+    """
+    with _services_lock:
+        service = _services.pop(_registry_key(config), None)
+    if service is None:
+        return False
+    service.invalidate_token()
+    return True
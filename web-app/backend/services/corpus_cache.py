@@ -0,0 +1,299 @@
+"""
+Corpus generation counter and the read caches that depend on it.
+
+Document listings, dashboard stats, the synced-project list and the scope list
+only change when something writes documents or calm_scopes, and they are read
+far more often than that. What made caching them unsafe was invalidation: with
+several gunicorn workers, a write handled by one worker has to reach the
+caches of all the others.
+
+corpus_generation is a single-row table holding a counter. Every mutating
+RAGService / ScopeService call (and backfill_modules.py) commits through
+commit(), which increments the counter inside the writer's own transaction —
+so the bump is durable exactly when the change is. Workers learn the new
+value by:
+
+  - Postgres: LISTEN corpus_changed on a dedicated connection. commit()
+    issues pg_notify in the same transaction, which Postgres delivers only if
+    it commits. The listener also re-reads the row every LISTEN_RECHECK_SECONDS
+    in case a notification was lost across a reconnect.
+  - SQLite, or while the listener is down: re-reading the row at most every
+    POLL_SECONDS, on the first cached read after that interval.
+
+The writer's own process advances at once, without waiting for either.
+
+Reads opt in with the decorator:
+
+    @corpus_cached()
+    def list_scopes(self, project_id=''):
+        ...
+
+Results are cached per argument tuple and tagged with the generation they were
+computed under; an entry from an older generation is never served. A function
+that caught an error and is returning a fallback value calls uncacheable() so
+the fallback is not kept.
+"""
+
+import copy
+import functools
+import os
+import select
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+
+import psycopg2
+import psycopg2.extensions
+
+from db import DATABASE_URL, SQLiteConnectionProxy, get_conn
+
+CHANNEL = 'corpus_changed'
+POLL_SECONDS = float(os.getenv("CORPUS_POLL_SECONDS", "2"))
+LISTEN_RECHECK_SECONDS = float(os.getenv("CORPUS_LISTEN_RECHECK_SECONDS", "30"))
+LISTEN_RETRY_SECONDS = float(os.getenv("CORPUS_LISTEN_RETRY_SECONDS", "10"))
+DEFAULT_MAXSIZE = int(os.getenv("CORPUS_CACHE_MAXSIZE", "256"))
+
+_lock = threading.Lock()
+_generation = 0
+_last_poll = 0.0
+_listening = False
+_listener = None
+_caches = []           # every _Cache created by corpus_cached
+_local = threading.local()
+
+
+# ── Generation ──────────────────────────────────────────────────────────────
+
+def bump(conn) -> int:
+    """Increment the generation inside conn's open transaction; return it.
+
+    Callers normally want commit(), which also commits and advances this
+    process. Call this directly only when the commit happens elsewhere.
+    """
+    is_sqlite = isinstance(conn, SQLiteConnectionProxy)
+    with conn.cursor() as cur:
+        cur.execute(
+            "UPDATE corpus_generation SET generation = generation + 1, updated_at = %s WHERE id = 1",
+            (datetime.now().isoformat(),),
+        )
+        cur.execute("SELECT generation FROM corpus_generation WHERE id = 1")
+        row = cur.fetchone()
+        generation = int(row[0]) if row else 0
+        if not is_sqlite:
+            # Transactional: delivered to the listeners only if this commits.
+            cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, str(generation)))
+    return generation
+
+
+def commit(conn):
+    """Commit a change to the corpus and invalidate the cached reads.
+
+    The counter is bumped before the commit, so it lands with the change, but
+    this process only advances after it: a read recomputed in between would
+    otherwise cache the old corpus under the new generation.
+    """
+    generation = bump(conn)
+    conn.commit()
+    _advance(generation)
+
+
+def _advance(generation: int):
+    global _generation
+    with _lock:
+        if generation <= _generation:
+            return
+        _generation = generation
+    # Entries are checked against the generation anyway; dropping them here
+    # just frees the memory sooner.
+    for cache in list(_caches):
+        cache.clear()
+
+
+def _read_generation(conn) -> int:
+    with conn.cursor() as cur:
+        cur.execute("SELECT generation FROM corpus_generation WHERE id = 1")
+        row = cur.fetchone()
+    return int(row[0]) if row else 0
+
+
+def _poll():
+    global _last_poll
+    with _lock:
+        _last_poll = time.monotonic()
+    conn = None
+    try:
+        conn = get_conn()
+        _advance(_read_generation(conn))
+    except Exception as e:
+        print(f"WARNING: could not read corpus generation: {e}")
+    finally:
+        if conn is not None:
+            conn.close()
+
+
+def current_generation() -> int:
+    """This process's view of the generation, polled when no listener runs."""
+    with _lock:
+        due = not _listening and time.monotonic() - _last_poll >= POLL_SECONDS
+    if due:
+        _poll()
+    with _lock:
+        return _generation
+
+
+# ── Postgres listener ───────────────────────────────────────────────────────
+
+def start_listener():
+    """Listen for corpus changes on Postgres. No-op on SQLite or if running."""
+    global _listener
+    conn = get_conn()
+    try:
+        if isinstance(conn, SQLiteConnectionProxy):
+            return
+    finally:
+        conn.close()
+    with _lock:
+        if _listener is not None:
+            return
+        _listener = threading.Thread(target=_listen_loop, name="corpus-listener", daemon=True)
+    _listener.start()
+
+
+def _set_listening(value: bool):
+    global _listening
+    with _lock:
+        _listening = value
+
+
+def _listen_loop():
+    while True:
+        conn = None
+        try:
+            # Its own connection, outside the pool: it sits in LISTEN forever.
+            conn = psycopg2.connect(DATABASE_URL)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cur:
+                cur.execute(f"LISTEN {CHANNEL}")
+            # Anything committed before LISTEN took effect sent no notification.
+            _advance(_read_generation(conn))
+            _set_listening(True)
+            while True:
+                if select.select([conn], [], [], LISTEN_RECHECK_SECONDS) == ([], [], []):
+                    _advance(_read_generation(conn))
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    notify = conn.notifies.pop(0)
+                    try:
+                        _advance(int(notify.payload))
+                    except ValueError:
+                        _advance(_read_generation(conn))
+        except Exception as e:
+            _set_listening(False)
+            print(f"WARNING: corpus listener stopped, polling until it reconnects: {e}")
+            time.sleep(LISTEN_RETRY_SECONDS)
+        finally:
+            if conn is not None:
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+
+# ── Caching ─────────────────────────────────────────────────────────────────
+
+def uncacheable():
+    """Mark the result of the cached call in progress as not to be kept."""
+    _local.uncacheable = True
+
+
+class _Cache:
+    def __init__(self, name: str, maxsize: int):
+        self.name = name
+        self.maxsize = maxsize
+        self.entries = OrderedDict()   # key -> (generation, value)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, generation):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return False, None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return True, entry[1]
+
+    def put(self, key, generation, value):
+        with self.lock:
+            self.entries[key] = (generation, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.maxsize:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+def corpus_cached(maxsize: int = DEFAULT_MAXSIZE):
+    """Cache a read until the corpus next changes.
+
+    Arguments must be hashable; a call with one that is not goes straight
+    through. Values are deep-copied in and out, so a caller that mutates the
+    result cannot corrupt the cache.
+    """
+    def decorate(func):
+        cache = _Cache(func.__qualname__, maxsize)
+        _caches.append(cache)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return func(*args, **kwargs)
+
+            generation = current_generation()
+            found, value = cache.get(key, generation)
+            if found:
+                return copy.deepcopy(value)
+
+            outer = getattr(_local, 'uncacheable', False)
+            _local.uncacheable = False
+            try:
+                value = func(*args, **kwargs)
+            finally:
+                keep = not _local.uncacheable
+                # A fallback inside makes an enclosing cached call a fallback too.
+                _local.uncacheable = outer or not keep
+            # Computed across a change: it may already be stale.
+            if keep and current_generation() == generation:
+                cache.put(key, generation, copy.deepcopy(value))
+            return value
+
+        wrapper.cache = cache
+        return wrapper
+    return decorate
+
+
+def stats() -> dict:
+    """Generation, invalidation mode and per-cache counters, for /api/health."""
+    with _lock:
+        result = {
+            'generation': _generation,
+            'mode': 'listen' if _listening else 'poll',
+            'caches': {},
+        }
+    for cache in _caches:
+        with cache.lock:
+            result['caches'][cache.name] = {
+                'entries': len(cache.entries),
+                'hits': cache.hits,
+                'misses': cache.misses,
+            }
+    return result
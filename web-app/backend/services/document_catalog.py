@@ -0,0 +1,182 @@
+"""
+One row per logical document, derived from the per-chunk documents table.
+
+The Document Hub listing, dashboard stats, synced-project list, document meta
+and version list all want per-document facts, and used to get them from the
+chunk table with DISTINCT ON, COUNT(DISTINCT document_id) and a correlated
+chunk-count subquery — so their cost grew with the number of chunks, not the
+number of documents. document_catalog holds those facts once per document.
+
+The chunk table stays the source of truth. Every path that writes or deletes
+chunks calls refresh() with the affected document ids on its own connection,
+before it commits, so the catalog changes in the same transaction as the
+chunks it describes. refresh() recomputes the rows from the chunks rather than
+patching them, so it is correct whatever the caller changed.
+
+ensure_built() fills the table once for a database that predates it; the
+data_migrations row records that it has run.
+
+Name search: Postgres indexes document_name and document_id with pg_trgm, so
+the ILIKE '%term%' in search_clause() is an index lookup. SQLite has no
+trigram index, so it gets document_catalog_fts, an FTS5 table with the trigram
+tokenizer kept in step with the catalog by triggers (see db.py).
+"""
+
+from datetime import datetime
+
+from db import SQLiteConnectionProxy, get_conn
+
+# Document-level fields, copied from the document's first chunk. Every chunk
+# carries the same values (see DOCUMENT_COLUMNS in services/rag_service.py).
+COPIED_COLUMNS = (
+    'document_name', 'source', 'doc_type', 'project', 'updated_by', 'updated_on',
+    'web_url', 'is_placeholder', 'uuid', 'display_id', 'project_id', 'scope_id',
+    'version', 'is_latest', 'calm_display_id',
+    'sap_module', 'sap_module_confidence', 'sap_module_method', 'summary',
+)
+
+# Aggregated over all of the document's chunks.
+AGGREGATE_COLUMNS = ('html_content', 'chunk_count', 'content_length', 'synced_on')
+
+CATALOG_COLUMNS = ('document_id',) + COPIED_COLUMNS + AGGREGATE_COLUMNS
+
+# ids per statement on SQLite, which has no array parameters
+SQLITE_BATCH = 500
+
+MIGRATION_NAME = 'document_catalog:build'
+
+# The trigram tokenizer needs at least three characters to match anything.
+FTS_MIN_CHARS = 3
+
+_REFRESH_SQL = """
+    INSERT INTO document_catalog ({columns})
+    SELECT d.document_id, {copied},
+           agg.html_content, agg.chunk_count, agg.content_length, agg.synced_on
+    FROM (
+        SELECT document_id,
+               MIN(id) AS first_id,
+               COUNT(*) AS chunk_count,
+               SUM(length(content)) AS content_length,
+               MAX(synced_on) AS synced_on,
+               -- Only the first chunk carries HTML; the rest hold ''.
+               MAX(html_content) AS html_content
+        FROM documents
+        WHERE {match}
+        GROUP BY document_id
+    ) agg
+    JOIN documents d ON d.id = agg.first_id
+""".replace('{columns}', ", ".join(CATALOG_COLUMNS)).replace(
+    '{copied}', ", ".join(f"d.{column}" for column in COPIED_COLUMNS)
+)
+
+
+def _is_sqlite(conn) -> bool:
+    return isinstance(conn, SQLiteConnectionProxy)
+
+
+def refresh(conn, document_ids):
+    """Recompute the catalog rows for document_ids from their chunks.
+
+    Runs on the caller's connection and does not commit. A document with no
+    chunks left loses its catalog row.
+    """
+    document_ids = list(dict.fromkeys(str(d) for d in document_ids if d))
+    if not document_ids:
+        return
+    with conn.cursor() as cur:
+        if _is_sqlite(conn):
+            for start in range(0, len(document_ids), SQLITE_BATCH):
+                batch = document_ids[start:start + SQLITE_BATCH]
+                match = f"document_id IN ({', '.join(['%s'] * len(batch))})"
+                cur.execute(f"DELETE FROM document_catalog WHERE {match}", batch)
+                cur.execute(_REFRESH_SQL.format(match=match), batch)
+        else:
+            cur.execute("DELETE FROM document_catalog WHERE document_id = ANY(%s)", (document_ids,))
+            cur.execute(_REFRESH_SQL.format(match="document_id = ANY(%s)"), (document_ids,))
+
+
+def _has_fts(conn) -> bool:
+    with conn.cursor() as cur:
+        cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'document_catalog_fts'"
+        )
+        return cur.fetchone() is not None
+
+
+def search_clause(conn, search: str):
+    """(sql, params) matching catalog rows whose name or id contains `search`."""
+    if not _is_sqlite(conn):
+        like = f"%{search}%"
+        return "(document_name ILIKE %s OR document_id ILIKE %s)", [like, like]
+    if len(search) >= FTS_MIN_CHARS and _has_fts(conn):
+        # A quoted phrase is a substring match under the trigram tokenizer,
+        # case-insensitive like the LIKE it replaces.
+        phrase = '"' + search.replace('"', '""') + '"'
+        return (
+            "rowid IN (SELECT rowid FROM document_catalog_fts WHERE document_catalog_fts MATCH %s)",
+            [phrase],
+        )
+    like = f"%{search}%"
+    return "(document_name LIKE %s OR document_id LIKE %s)", [like, like]
+
+
+def _sync_fts(conn):
+    """Re-seed the SQLite search table if it has drifted from the catalog.
+
+    The triggers keep it in step from the moment it exists; this covers a
+    catalog that was filled before the table was created.
+    """
+    if not _is_sqlite(conn) or not _has_fts(conn):
+        return
+    with conn.cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM document_catalog")
+        catalog_rows = cur.fetchone()[0]
+        cur.execute("SELECT COUNT(*) FROM document_catalog_fts")
+        if cur.fetchone()[0] == catalog_rows:
+            return
+        cur.execute("DELETE FROM document_catalog_fts")
+        cur.execute(
+            """
+            INSERT INTO document_catalog_fts (rowid, document_id, document_name)
+            SELECT rowid, document_id, document_name FROM document_catalog
+            """
+        )
+    conn.commit()
+
+
+def rebuild(conn):
+    """Recompute the whole catalog from the chunk table. Does not commit."""
+    with conn.cursor() as cur:
+        cur.execute("DELETE FROM document_catalog")
+        cur.execute(_REFRESH_SQL.format(match="document_id IS NOT NULL"))
+
+
+def ensure_built():
+    """Build the catalog once for a database whose chunks predate it."""
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT done FROM data_migrations WHERE name = %s", (MIGRATION_NAME,))
+            row = cur.fetchone()
+            if row and row[0]:
+                _sync_fts(conn)
+                return
+        rebuild(conn)
+        with conn.cursor() as cur:
+            cur.execute("SELECT COUNT(*) FROM document_catalog")
+            built = cur.fetchone()[0]
+            cur.execute("DELETE FROM data_migrations WHERE name = %s", (MIGRATION_NAME,))
+            cur.execute(
+                """
+                INSERT INTO data_migrations (name, processed, done, updated_at)
+                VALUES (%s, %s, %s, %s)
+                """,
+                (MIGRATION_NAME, built, True, datetime.now().isoformat()),
+            )
+        conn.commit()
+        print(f"DEBUG: document catalog built ({built} documents)")
+    except Exception as e:
+        conn.rollback()
+        print(f"WARNING: could not build document catalog: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,238 @@
+"""
+Persistent embedding cache, keyed by (sha256 of normalized text, model).
+
+A nightly re-sync drops and re-ingests every chunk of every document, but most
+chunks are byte-identical to last night's. Looking each chunk up here before
+calling the provider turns those into a local read instead of a paid request.
+
+The model is part of the key on purpose: a vector is only reusable for the model
+that produced it (see RAGService.EMBEDDING_MODEL), so a model change simply
+misses rather than serving vectors from the wrong space.
+
+Every method is best-effort. A cache failure degrades to "miss" and never fails
+an ingest or a query.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime
+
+from db import get_conn
+
+
+def normalize_text(text) -> str:
+    """Collapse whitespace so formatting-only differences share one entry."""
+    return ' '.join(str(text or '').split())
+
+
+def content_hash(text) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Read-through store of embeddings in the embedding_cache table."""
+
+    # Rows kept before the least recently used are evicted. 0 disables the cache.
+    MAX_ROWS = int(os.getenv("EMBEDDING_CACHE_MAX_ROWS", "200000"))
+    # Counting the table on every write would cost more than it saves.
+    EVICT_INTERVAL_SECONDS = 60
+    # Keep IN (...) lists to a size every backend accepts.
+    LOOKUP_BATCH = 500
+
+    def __init__(self, max_rows=None):
+        self.max_rows = self.MAX_ROWS if max_rows is None else max_rows
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._writes = 0
+        self._evicted = 0
+        self._last_evict_at = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_rows > 0
+
+    def get_many(self, texts, model) -> list:
+        """Return a list aligned with texts: the cached vector, or None on a miss."""
+        texts = list(texts)
+        if not self.enabled or not texts:
+            return [None] * len(texts)
+
+        hashes = [content_hash(t) for t in texts]
+        found = {}
+        conn = None
+        try:
+            conn = get_conn()
+            unique = list(dict.fromkeys(hashes))
+            with conn.cursor() as cur:
+                for start in range(0, len(unique), self.LOOKUP_BATCH):
+                    batch = unique[start:start + self.LOOKUP_BATCH]
+                    marks = ", ".join(["%s"] * len(batch))
+                    cur.execute(
+                        f"""
+                        SELECT content_hash, embedding FROM embedding_cache
+                        WHERE model = %s AND content_hash IN ({marks})
+                        """,
+                        [model] + batch,
+                    )
+                    # Plain cursor: tuples on Postgres, sqlite3.Row on SQLite —
+                    # both index by position.
+                    for row in cur.fetchall():
+                        vector = self._decode(row[1])
+                        if vector:
+                            found[row[0]] = vector
+
+                if found:
+                    # Recency drives eviction, so a hit has to refresh it.
+                    hit_hashes = list(found)
+                    now = datetime.now()
+                    for start in range(0, len(hit_hashes), self.LOOKUP_BATCH):
+                        batch = hit_hashes[start:start + self.LOOKUP_BATCH]
+                        marks = ", ".join(["%s"] * len(batch))
+                        cur.execute(
+                            f"""
+                            UPDATE embedding_cache SET last_used_at = %s
+                            WHERE model = %s AND content_hash IN ({marks})
+                            """,
+                            [now, model] + batch,
+                        )
+            conn.commit()
+        except Exception as e:
+            print(f"EMBEDDING_CACHE: lookup failed, treating as miss: {e}")
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            found = {}
+        finally:
+            if conn is not None:
+                conn.close()
+
+        result = [found.get(h) for h in hashes]
+        hits = sum(1 for v in result if v is not None)
+        with self._lock:
+            self._hits += hits
+            self._misses += len(result) - hits
+        return result
+
+    def put_many(self, texts, vectors, model):
+        """Store vectors for texts. Existing entries are refreshed, not duplicated."""
+        if not self.enabled:
+            return
+        entries = {}
+        for text, vector in zip(texts, vectors):
+            if vector is not None:
+                entries[content_hash(text)] = vector
+        if not entries:
+            return
+
+        now = datetime.now()
+        conn = None
+        try:
+            conn = get_conn()
+            with conn.cursor() as cur:
+                for digest, vector in entries.items():
+                    cur.execute(
+                        """
+                        INSERT INTO embedding_cache
+                            (content_hash, model, embedding, created_at, last_used_at)
+                        VALUES (%s, %s, %s, %s, %s)
+                        ON CONFLICT (content_hash, model) DO UPDATE SET
+                            embedding = EXCLUDED.embedding,
+                            last_used_at = EXCLUDED.last_used_at
+                        """,
+                        (digest, model, self._encode(vector, model), now, now),
+                    )
+            conn.commit()
+            with self._lock:
+                self._writes += len(entries)
+        except Exception as e:
+            print(f"EMBEDDING_CACHE: write failed: {e}")
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+        finally:
+            if conn is not None:
+                conn.close()
+
+        self._maybe_evict()
+
+    def _maybe_evict(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_evict_at < self.EVICT_INTERVAL_SECONDS:
+                return
+            self._last_evict_at = now
+        self.evict()
+
+    def evict(self) -> int:
+        """Trim the table to max_rows, least recently used first."""
+        conn = None
+        try:
+            conn = get_conn()
+            with conn.cursor() as cur:
+                cur.execute("SELECT COUNT(*) FROM embedding_cache")
+                row = cur.fetchone()
+                total = (row[0] if row else 0) or 0
+                overflow = total - self.max_rows
+                if overflow <= 0:
+                    return 0
+                cur.execute(
+                    """
+                    DELETE FROM embedding_cache
+                    WHERE (content_hash, model) IN (
+                        SELECT content_hash, model FROM embedding_cache
+                        ORDER BY last_used_at ASC
+                        LIMIT %s
+                    )
+                    """,
+                    (overflow,),
+                )
+                removed = cur.rowcount or 0
+            conn.commit()
+            with self._lock:
+                self._evicted += removed
+            return removed
+        except Exception as e:
+            print(f"EMBEDDING_CACHE: eviction failed: {e}")
+            if conn is not None:
+                try:
+                    conn.rollback()
+                except Exception:
+                    pass
+            return 0
+        finally:
+            if conn is not None:
+                conn.close()
+
+    def stats(self) -> dict:
+        """Counters since process start, for /api/health."""
+        with self._lock:
+            hits, misses = self._hits, self._misses
+            writes, evicted = self._writes, self._evicted
+        lookups = hits + misses
+        return {
+            'enabled': self.enabled,
+            'max_rows': self.max_rows,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else None,
+            'writes': writes,
+            'evicted': evicted,
+        }
+
+    @staticmethod
+    def _encode(vector, model) -> bytes:
+        from services.rag_service import _serialize_embedding
+        return _serialize_embedding(vector, model)
+
+    @staticmethod
+    def _decode(raw):
+        # Same shapes as RAGService's stored embeddings; reuse its decoder.
+        from services.rag_service import _deserialize_embedding
+        return _deserialize_embedding(raw)
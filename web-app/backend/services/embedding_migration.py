@@ -0,0 +1,203 @@
+"""
+Online rewrite of JSON-text embeddings into the binary float32 format.
+
+Until the binary format (see EMBEDDING_MAGIC in services/rag_service.py) every
+app-side embedding was stored as JSON text in BYTEA: ~30 KB a vector instead of
+~6 KB, and a JSON parse on every read. New writes are binary; this converts the
+rows written before that, in the background, while the app keeps serving.
+
+Nothing waits for it. _deserialize_embedding reads both formats, so a table
+that is half migrated behaves exactly like one that is fully migrated.
+
+Progress is checkpointed per table in data_migrations after every batch, so a
+restart resumes from the last key rather than rescanning from the start. Each
+row is rewritten only if it still holds the JSON that was read — an ingest
+that replaced the vector in the meantime wins.
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from db import SQLiteConnectionProxy, get_conn, pgvector_available
+
+
+class EmbeddingFormatMigration:
+    """Converts documents.embedding and embedding_cache.embedding to binary."""
+
+    BATCH_SIZE = int(os.getenv("EMBEDDING_MIGRATION_BATCH_SIZE", "500"))
+    # Breathing room between batches, so the rewrite never starves live traffic.
+    PAUSE_SECONDS = float(os.getenv("EMBEDDING_MIGRATION_PAUSE_SECONDS", "0.1"))
+
+    # table -> (key columns, column holding the model name)
+    TARGETS = {
+        'documents': (('id',), 'embedding_model'),
+        'embedding_cache': (('content_hash', 'model'), 'model'),
+    }
+
+    def __init__(self, default_model: str):
+        # Model stamped into the header of rows with no embedding_model
+        # (historical rows, all embedded with the corpus model).
+        self.default_model = default_model
+        self._thread = None
+        self._lock = threading.Lock()
+        self.running = False
+
+    def start(self):
+        """Run the migration on a background thread. No-op if already started."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(
+                target=self.run, name="embedding-migration", daemon=True
+            )
+        self._thread.start()
+
+    def run(self):
+        self.running = True
+        try:
+            for table in self._tables():
+                self._migrate_table(table)
+        except Exception as e:
+            print(f"EMBEDDING_MIGRATION: stopped, will resume on next start: {e}")
+        finally:
+            self.running = False
+
+    def _tables(self) -> list:
+        conn = get_conn()
+        try:
+            # With pgvector, documents.embedding is a vector column, not bytes.
+            app_side = isinstance(conn, SQLiteConnectionProxy) or not pgvector_available()
+        finally:
+            conn.close()
+        return [t for t in self.TARGETS if app_side or t != 'documents']
+
+    def _migrate_table(self, table: str):
+        from services.rag_service import _deserialize_embedding, _is_binary_embedding, _serialize_embedding
+
+        name = f"embedding_format:{table}"
+        state = self._load_state(name)
+        if state['done']:
+            return
+        key_columns, model_column = self.TARGETS[table]
+        keys = ", ".join(key_columns)
+        key_match = " AND ".join(f"{c} = %s" for c in key_columns)
+        resume_key = state['resume_key']
+        processed, rewritten = state['processed'], state['rewritten']
+        started = time.monotonic()
+        print(f"EMBEDDING_MIGRATION: {table} starting at {resume_key or 'the beginning'}")
+
+        while True:
+            conn = get_conn()
+            try:
+                with conn.cursor() as cur:
+                    where, params = "", []
+                    if resume_key:
+                        # Row-value comparison: keyset pagination over a
+                        # composite key in one predicate, on both backends.
+                        marks = ", ".join(["%s"] * len(key_columns))
+                        where = f"WHERE ({keys}) > ({marks})"
+                        params = list(resume_key)
+                    cur.execute(
+                        f"SELECT {keys}, embedding, {model_column} FROM {table} "
+                        f"{where} ORDER BY {keys} LIMIT %s",
+                        params + [self.BATCH_SIZE],
+                    )
+                    rows = cur.fetchall()
+                    if not rows:
+                        self._save_state(cur, name, resume_key, processed, rewritten, done=True)
+                        conn.commit()
+                        break
+
+                    updates = []
+                    width = len(key_columns)
+                    for row in rows:
+                        raw = row[width]
+                        if raw is None or _is_binary_embedding(raw):
+                            continue
+                        vector = _deserialize_embedding(raw)
+                        if not vector:
+                            continue
+                        model = row[width + 1] or self.default_model
+                        updates.append(
+                            (_serialize_embedding(vector, model),
+                             *(row[i] for i in range(width)),
+                             bytes(raw))
+                        )
+                    if updates:
+                        # embedding = old value: skip rows re-ingested since the read.
+                        cur.executemany(
+                            f"UPDATE {table} SET embedding = %s WHERE {key_match} AND embedding = %s",
+                            updates,
+                        )
+
+                    processed += len(rows)
+                    rewritten += len(updates)
+                    resume_key = [rows[-1][i] for i in range(width)]
+                    self._save_state(cur, name, resume_key, processed, rewritten, done=False)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                raise
+            finally:
+                conn.close()
+            time.sleep(self.PAUSE_SECONDS)
+
+        print(
+            f"EMBEDDING_MIGRATION: {table} done — {rewritten} of {processed} rows rewritten "
+            f"({time.monotonic() - started:.1f}s this run)"
+        )
+
+    def _load_state(self, name: str) -> dict:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT resume_key, processed, rewritten, done FROM data_migrations WHERE name = %s",
+                    (name,),
+                )
+                row = cur.fetchone()
+        finally:
+            conn.close()
+        if not row:
+            return {'resume_key': None, 'processed': 0, 'rewritten': 0, 'done': False}
+        return {
+            'resume_key': json.loads(row[0]) if row[0] else None,
+            'processed': row[1] or 0,
+            'rewritten': row[2] or 0,
+            'done': bool(row[3]),
+        }
+
+    @staticmethod
+    def _save_state(cur, name, resume_key, processed, rewritten, done):
+        cur.execute(
+            """
+            INSERT INTO data_migrations (name, resume_key, processed, rewritten, done, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            ON CONFLICT (name) DO UPDATE SET
+                resume_key = EXCLUDED.resume_key,
+                processed = EXCLUDED.processed,
+                rewritten = EXCLUDED.rewritten,
+                done = EXCLUDED.done,
+                updated_at = EXCLUDED.updated_at
+            """,
+            (name, json.dumps(resume_key) if resume_key else None, processed, rewritten,
+             done, datetime.now().isoformat()),
+        )
+
+    def stats(self) -> dict:
+        """Per-table progress, for /api/health."""
+        result = {'running': self.running}
+        for table in self.TARGETS:
+            try:
+                state = self._load_state(f"embedding_format:{table}")
+                result[table] = {
+                    'done': state['done'],
+                    'processed': state['processed'],
+                    'rewritten': state['rewritten'],
+                }
+            except Exception as e:
+                result[table] = {'error': str(e)}
+        return result
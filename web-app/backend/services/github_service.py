@@ -1,7 +1,8 @@
 import os
-import requests
 import base64
 
+from services import http_transport
+
 class GitHubService:
     def __init__(self, token=None):
         self.token = token
@@ -13,11 +14,11 @@ class GitHubService:
             self.headers["Authorization"] = f"token {token}"
 
     def get_user(self):
-        response = requests.get(f"{self.base_url}/user", headers=self.headers)
+        response = http_transport.get(f"{self.base_url}/user", headers=self.headers)
         return response.json() if response.status_code == 200 else None
 
     def list_repos(self):
-        response = requests.get(f"{self.base_url}/user/repos?sort=updated&per_page=100", headers=self.headers)
+        response = http_transport.get(f"{self.base_url}/user/repos?sort=updated&per_page=100", headers=self.headers)
         return response.json() if response.status_code == 200 else []
 
     def create_repo(self, name, private=False):
@@ -26,13 +27,13 @@ class GitHubService:
             "private": private,
             "auto_init": True
         }
-        response = requests.post(f"{self.base_url}/user/repos", headers=self.headers, json=data)
+        response = http_transport.post(f"{self.base_url}/user/repos", headers=self.headers, json=data)
         return response.json() if response.status_code == 201 else None
 
     def push_file(self, repo_full_name, path, content, commit_message):
         # 1. Get current file (if exists) to get the SHA
         url = f"{self.base_url}/repos/{repo_full_name}/contents/{path}"
-        get_res = requests.get(url, headers=self.headers)
+        get_res = http_transport.get(url, headers=self.headers)
         
         sha = None
         if get_res.status_code == 200:
@@ -47,5 +48,5 @@ class GitHubService:
         if sha:
             data["sha"] = sha
             
-        put_res = requests.put(url, headers=self.headers, json=data)
+        put_res = http_transport.put(url, headers=self.headers, json=data)
         return put_res.json() if put_res.status_code in [200, 201] else put_res.json()
@@ -0,0 +1,168 @@
+"""
+Shared HTTP transport for the outbound API clients (CALM, BTP, AI Core, GitHub).
+
+The clients used to call requests.get/post/put at module level, which opens a
+new TCP connection and TLS handshake for every call. Sync, BTP code fetch and
+AI Core chat all talk to the same handful of hosts over and over, so most of
+their latency was handshakes. This keeps one pooled requests.Session per host
+and routes every call through it.
+
+Each session:
+  - keeps up to HTTP_POOL_SIZE keep-alive connections to its host;
+  - retries connection failures and 429/502/503/504 responses with
+    exponential backoff — idempotent methods only, so a POST is never sent
+    twice;
+  - refuses cookies. Sessions are shared by every caller that talks to the
+    host, including clients holding different credentials, so nothing one
+    caller receives may ride along on another caller's request.
+
+Responses are gzip-negotiated by requests already. Request bodies can be
+gzipped per call with compress=True, for endpoints known to accept
+Content-Encoding: gzip.
+
+Per-host request counts, latency and error counts are kept in memory and
+reported by /api/health.
+"""
+
+import gzip
+import http.cookiejar
+import json
+import os
+import threading
+import time
+import urllib.parse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+RETRIES = int(os.getenv("HTTP_RETRIES", "2"))
+BACKOFF_SECONDS = float(os.getenv("HTTP_BACKOFF_SECONDS", "0.3"))
+# Used when a caller does not pass a timeout; requests' own default is none.
+DEFAULT_TIMEOUT = float(os.getenv("HTTP_DEFAULT_TIMEOUT", "60"))
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+_sessions = {}
+_stats = {}
+_lock = threading.Lock()
+
+
+def _host(url: str) -> str:
+    parts = urllib.parse.urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}".lower()
+
+
+def _new_session() -> requests.Session:
+    session = requests.Session()
+    session.cookies.set_policy(http.cookiejar.DefaultCookiePolicy(allowed_domains=[]))
+    retry = Retry(
+        total=RETRIES,
+        connect=RETRIES,
+        read=RETRIES,
+        status=RETRIES,
+        backoff_factor=BACKOFF_SECONDS,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        # Hand the last response back instead of raising, so callers keep
+        # their own status handling.
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(url: str) -> requests.Session:
+    """The shared session for the host of `url`."""
+    host = _host(url)
+    with _lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = _new_session()
+            _sessions[host] = session
+            _stats[host] = {
+                'requests': 0,
+                'errors': 0,
+                'client_errors': 0,
+                'total_ms': 0.0,
+                'max_ms': 0.0,
+            }
+        return session
+
+
+def _record(host: str, elapsed_ms: float, status_code=None):
+    with _lock:
+        counters = _stats.get(host)
+        if counters is None:
+            return
+        counters['requests'] += 1
+        counters['total_ms'] += elapsed_ms
+        counters['max_ms'] = max(counters['max_ms'], elapsed_ms)
+        if status_code is None or status_code >= 500:
+            counters['errors'] += 1
+        elif status_code >= 400:
+            counters['client_errors'] += 1
+
+
+def request(method: str, url: str, compress: bool = False, **kwargs) -> requests.Response:
+    """
+    Send a request over the pooled session for the URL's host.
+
+    Takes the same keyword arguments as requests.request. With compress=True a
+    json= or data= body is gzipped and sent with Content-Encoding: gzip.
+    """
+    kwargs.setdefault('timeout', DEFAULT_TIMEOUT)
+    if compress:
+        headers = dict(kwargs.pop('headers', None) or {})
+        if 'json' in kwargs:
+            body = json.dumps(kwargs.pop('json')).encode('utf-8')
+            headers.setdefault('Content-Type', 'application/json')
+        else:
+            body = kwargs.pop('data', b'') or b''
+            if isinstance(body, str):
+                body = body.encode('utf-8')
+        kwargs['data'] = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+        kwargs['headers'] = headers
+
+    session = get_session(url)
+    host = _host(url)
+    started = time.monotonic()
+    try:
+        response = session.request(method, url, **kwargs)
+    except requests.exceptions.RequestException:
+        _record(host, (time.monotonic() - started) * 1000)
+        raise
+    _record(host, (time.monotonic() - started) * 1000, response.status_code)
+    return response
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request('GET', url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request('POST', url, **kwargs)
+
+
+def put(url: str, **kwargs) -> requests.Response:
+    return request('PUT', url, **kwargs)
+
+
+def stats() -> dict:
+    """Per-host counters, for /api/health."""
+    with _lock:
+        result = {}
+        for host, counters in _stats.items():
+            count = counters['requests']
+            result[host] = {
+                'requests': count,
+                'errors': counters['errors'],
+                'client_errors': counters['client_errors'],
+                'avg_ms': round(counters['total_ms'] / count, 1) if count else None,
+                'max_ms': round(counters['max_ms'], 1),
+            }
+        return result
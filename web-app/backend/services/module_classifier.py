@@ -5,26 +5,37 @@ Layers run in order and the first one that answers wins:
 
   1. scope_map — join the document's CALM scope_id to the calm_scopes cache.
      Free, exact, and explainable ("it sits under the Inventory Management scope").
-  2. llm       — classify title + opening text. Only reached for file uploads and
-     scopes we have no mapping for.
-  3. UNCLASSIFIED — no guess rather than a bad guess.
+  2. vector    — weighted vote of the nearest documents whose module we trust
+     (scope_map or manual), using the chunk embeddings ingest creates anyway.
+     Free once the document is embedded; answers when the vote is clear.
+  3. llm       — classify title + opening text. Only reached when neither of
+     the above has an answer.
+  4. UNCLASSIFIED — no guess rather than a bad guess.
 
 A module set by a human (method='manual') is never recomputed; callers check
 should_reclassify() before re-running this on an existing document.
+
+classify_many() runs the same cascade over many documents and packs the LLM
+layer several documents to a request — for backfills and syncs, where one
+call per document is most of the cost.
 """
 
 import json
+import os
 
 from config.sap_modules import (
     ASSIGNABLE_CODES,
     METHOD_LLM,
     METHOD_SCOPE_MAP,
+    METHOD_VECTOR,
     MODULE_LABELS,
+    REVIEW_CONFIDENCE_THRESHOLD,
     STICKY_METHODS,
     UNCLASSIFIED,
     module_from_scope_name,
     normalize_module,
 )
+from services import scope_map_cache
 
 # Enough of the document for the module to be obvious; more just costs tokens.
 CLASSIFY_CHAR_LIMIT = 2000
@@ -50,9 +61,38 @@ Rules:
   it. State only what the document says. No preamble like "This document describes".
 - Never invent a module code. Never explain outside the JSON. JSON only."""
 
+CLASSIFIER_BATCH_SYSTEM_PROMPT = CLASSIFIER_SYSTEM_PROMPT.replace(
+    "Classify a document into exactly one SAP functional module, and summarize what it specifies.",
+    "You will receive several documents, each introduced by its id. Classify each one into "
+    "exactly one SAP functional module, and summarize what it specifies.",
+).replace(
+    '- Reply with JSON only: {"module": "<CODE>", "confidence": <0.0-1.0>, "summary": "<2-3 sentences>"}',
+    '- Reply with JSON only: {"results": [{"id": "<id as given>", "module": "<CODE>", '
+    '"confidence": <0.0-1.0>, "summary": "<2-3 sentences>"}, ...]}\n'
+    '- Exactly one entry per document, in the order given. Judge each document on its own '
+    'content alone.',
+)
+
 # Long enough for a useful design summary, short enough to skim in a list.
 SUMMARY_CHAR_LIMIT = 600
 
+# Batched LLM classification. The budget covers the excerpts sent per request;
+# BATCH_MAX_ITEMS bounds the reply, at BATCH_REPLY_TOKENS_PER_ITEM each.
+BATCH_TOKEN_BUDGET = int(os.getenv("MODULE_BATCH_TOKEN_BUDGET", "8000"))
+BATCH_MAX_ITEMS = int(os.getenv("MODULE_BATCH_MAX_ITEMS", "10"))
+BATCH_REPLY_TOKENS_PER_ITEM = 250
+BATCH_RETRIES = 2
+
+# Vector layer. Neighbours are whole documents (best-matching chunk each);
+# those less similar than VECTOR_MIN_SIMILARITY do not vote, and fewer than
+# VECTOR_MIN_VOTES voters is no verdict. A winner whose closest supporter is
+# at least VECTOR_FULL_SIMILARITY keeps its whole vote share as confidence.
+# Picked by eye on text-embedding-3-small — revisit against manual corrections.
+VECTOR_NEIGHBOURS = int(os.getenv("MODULE_VECTOR_NEIGHBOURS", "10"))
+VECTOR_MIN_SIMILARITY = float(os.getenv("MODULE_VECTOR_MIN_SIMILARITY", "0.35"))
+VECTOR_FULL_SIMILARITY = float(os.getenv("MODULE_VECTOR_FULL_SIMILARITY", "0.6"))
+VECTOR_MIN_VOTES = 3
+
 
 def should_reclassify(current_method) -> bool:
     """False when a human has set the module by hand."""
@@ -62,11 +102,15 @@ def should_reclassify(current_method) -> bool:
 class ModuleClassifier:
     """Resolves (module, confidence, method) for a document."""
 
-    def __init__(self, openai_service=None):
+    def __init__(self, openai_service=None, neighbour_search=None):
         # Injected so callers can share one OpenAIService instance. Built on first
         # use rather than here, so the scope-mapping layer stays usable with no
         # LLM provider configured (e.g. a scope-only backfill).
         self._openai_service = openai_service
+        # neighbour_search(embedding, conn, exclude_document_id, k) ->
+        # [(module, similarity)], nearest first. RAGService owns the vectors, so
+        # it supplies this; without one the vector layer is skipped.
+        self.neighbour_search = neighbour_search
 
     @property
     def openai_service(self):
@@ -78,10 +122,18 @@ class ModuleClassifier:
     # ── Layer 1: scope mapping ────────────────────────────────────────────────
 
     def classify_by_scope(self, scope_id, conn=None):
-        """Look the scope up in the cache. Returns a module code or None."""
+        """Look the scope up in the cache. Returns a module code or None.
+
+        Answered from the in-process scope map (services/scope_map_cache.py);
+        calm_scopes is only queried here if the map cannot be loaded.
+        """
         if not scope_id:
             return None
 
+        mapping = scope_map_cache.current()
+        if mapping is not None:
+            return mapping.get(str(scope_id))
+
         own_conn = conn is None
         if own_conn:
             from db import get_conn
@@ -112,7 +164,64 @@ class ModuleClassifier:
         name = row['name'] if not isinstance(row, tuple) else row[1]
         return module_from_scope_name(name)
 
-    # ── Layer 2: LLM ──────────────────────────────────────────────────────────
+    def classify_by_scopes(self, scope_ids, conn=None):
+        """classify_by_scope for many scopes at once: {scope_id: module or None}."""
+        scope_ids = [scope_id for scope_id in dict.fromkeys(scope_ids) if scope_id]
+        resolved = scope_map_cache.resolve_many(scope_ids)
+        if resolved is None:
+            resolved = {scope_id: self.classify_by_scope(scope_id, conn=conn) for scope_id in scope_ids}
+        return resolved
+
+    # ── Layer 2: nearest classified neighbours ────────────────────────────────
+
+    @staticmethod
+    def vote(neighbours):
+        """Weighted vote over [(module, similarity)].
+
+        Returns (module_code, confidence), or None when the vote is ambiguous.
+        Each neighbour votes with its similarity. Confidence is the winner's
+        share of the vote, scaled down when even its closest supporter is only
+        loosely similar — a unanimous vote of distant documents is still a
+        weak signal. Anything under REVIEW_CONFIDENCE_THRESHOLD is left to the
+        LLM rather than stored as a guess for review.
+        """
+        weights, closest, voters = {}, {}, 0
+        for module, similarity in neighbours:
+            module = normalize_module(module)
+            if not module or module == UNCLASSIFIED or similarity < VECTOR_MIN_SIMILARITY:
+                continue
+            weights[module] = weights.get(module, 0.0) + similarity
+            closest[module] = max(closest.get(module, 0.0), similarity)
+            voters += 1
+        if voters < VECTOR_MIN_VOTES:
+            return None
+
+        winner = max(weights, key=weights.get)
+        share = weights[winner] / sum(weights.values())
+        closeness = min(1.0, closest[winner] / VECTOR_FULL_SIMILARITY)
+        confidence = round(share * closeness, 3)
+        if confidence < REVIEW_CONFIDENCE_THRESHOLD:
+            return None
+        return winner, confidence
+
+    def classify_by_vector(self, embedding, conn=None, exclude_document_id=None):
+        """Vote among the document's nearest classified neighbours.
+
+        Returns (module_code, confidence) or None.
+        """
+        if embedding is None or self.neighbour_search is None:
+            return None
+        try:
+            neighbours = self.neighbour_search(
+                embedding, conn=conn, exclude_document_id=exclude_document_id,
+                k=VECTOR_NEIGHBOURS,
+            )
+        except Exception as e:
+            print(f"MODULE_CLASSIFIER: neighbour search failed: {e}")
+            return None
+        return self.vote(neighbours)
+
+    # ── Layer 3: LLM ──────────────────────────────────────────────────────────
 
     def classify_by_llm(self, title, text, llm_provider='openai'):
         """Classify and summarize from content.
@@ -156,6 +265,14 @@ class ModuleClassifier:
             print(f"MODULE_CLASSIFIER: non-JSON response discarded: {raw!r}")
             return None, 0.0, ''
 
+        return self._parse_verdict(parsed)
+
+    @staticmethod
+    def _parse_verdict(parsed):
+        """(module_code, confidence, summary) from one {module, confidence,
+        summary} object, with off-taxonomy modules discarded."""
+        if not isinstance(parsed, dict):
+            return None, 0.0, ''
         summary = str(parsed.get('summary') or '').strip()[:SUMMARY_CHAR_LIMIT]
 
         module = normalize_module(parsed.get('module'))
@@ -171,10 +288,165 @@ class ModuleClassifier:
 
         return module, max(0.0, min(1.0, confidence)), summary
 
+    # ── Layer 3, batched ──────────────────────────────────────────────────────
+
+    @staticmethod
+    def _batch_item_tokens(title, excerpt) -> int:
+        # Same estimate as RAGService._estimate_tokens, plus the item's framing.
+        return (len(title or '') + len(excerpt)) // 3 + 20
+
+    def _llm_batches(self, documents, max_items):
+        """Split [(key, title, excerpt)] into batches within the token budget."""
+        batch, tokens = [], 0
+        for doc in documents:
+            cost = self._batch_item_tokens(doc[1], doc[2])
+            if batch and (len(batch) >= max_items or tokens + cost > BATCH_TOKEN_BUDGET):
+                yield batch
+                batch, tokens = [], 0
+            batch.append(doc)
+            tokens += cost
+        if batch:
+            yield batch
+
+    def _classify_llm_batch(self, batch, llm_provider):
+        """One request for a batch of [(key, title, excerpt)].
+
+        Returns {key: (module_code, confidence, summary)} for the items the
+        model answered; anything missing, duplicated or unparseable is absent.
+        Items are numbered in the prompt rather than sent with their document
+        ids, which are long and easy for a model to garble.
+        """
+        parts = []
+        for number, (_, title, excerpt) in enumerate(batch, start=1):
+            parts.append(
+                f"Document id: {number}\nDocument title: {title or 'Untitled'}\n\n"
+                f"Document content:\n{excerpt}"
+            )
+        try:
+            raw = self.openai_service.chat_completion(
+                [
+                    {"role": "system", "content": CLASSIFIER_BATCH_SYSTEM_PROMPT},
+                    {"role": "user", "content": "\n\n---\n\n".join(parts)},
+                ],
+                temperature=0,
+                max_tokens=BATCH_REPLY_TOKENS_PER_ITEM * len(batch) + 100,
+                provider=llm_provider,
+                json_mode=True,
+            )
+        except Exception as e:
+            print(f"MODULE_CLASSIFIER: batch LLM call failed ({len(batch)} documents): {e}")
+            return {}
+
+        text = (raw or '').strip()
+        if text.startswith('```'):
+            # Providers without a JSON mode sometimes fence the reply anyway.
+            text = text.strip('`').strip()
+            if text.lower().startswith('json'):
+                text = text[4:]
+        try:
+            parsed = json.loads(text)
+        except (json.JSONDecodeError, TypeError):
+            print(f"MODULE_CLASSIFIER: non-JSON batch response discarded ({len(batch)} documents)")
+            return {}
+
+        # JSON mode only allows an object at the top level, so the array is
+        # asked for under "results"; take a bare array too.
+        entries = parsed.get('results') if isinstance(parsed, dict) else parsed
+        if not isinstance(entries, list):
+            return {}
+
+        keys = {str(number): doc[0] for number, doc in enumerate(batch, start=1)}
+        answered, seen = {}, set()
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            number = str(entry.get('id', '')).strip()
+            if number not in keys:
+                continue
+            if number in seen:
+                # Two answers for one document: trust neither.
+                answered.pop(keys[number], None)
+                continue
+            seen.add(number)
+            answered[keys[number]] = self._parse_verdict(entry)
+        return answered
+
+    def classify_batch_by_llm(self, documents, llm_provider='openai'):
+        """classify_by_llm for many documents, several per request.
+
+        documents is [(key, title, text)]. Returns {key: (module_code,
+        confidence, summary)} with an entry for every key, shaped like
+        classify_by_llm's return.
+
+        Batches are cut by BATCH_TOKEN_BUDGET (and BATCH_MAX_ITEMS, which
+        bounds the reply). Items the model left out or answered off-taxonomy
+        are re-sent, and only those, in batches half the size each round, up
+        to BATCH_RETRIES times. A summary from a round whose module was
+        unusable is kept in case no later round does better.
+        """
+        results = {}
+        remaining = []
+        for key, title, text in documents:
+            excerpt = (text or '').strip()[:CLASSIFY_CHAR_LIMIT]
+            results[key] = (None, 0.0, '')
+            if excerpt or title:
+                remaining.append((key, title, excerpt))
+
+        max_items = BATCH_MAX_ITEMS
+        for _ in range(1 + BATCH_RETRIES):
+            if not remaining:
+                break
+            retry = []
+            for batch in self._llm_batches(remaining, max_items):
+                answered = self._classify_llm_batch(batch, llm_provider)
+                for doc in batch:
+                    verdict = answered.get(doc[0])
+                    if verdict and verdict[0]:
+                        results[doc[0]] = verdict
+                        continue
+                    if verdict and verdict[2]:
+                        results[doc[0]] = verdict
+                    retry.append(doc)
+            remaining = retry
+            max_items = max(1, max_items // 2)
+
+        if remaining:
+            print(f"MODULE_CLASSIFIER: no usable module for {len(remaining)} document(s) after retries")
+        return results
+
     # ── The cascade ───────────────────────────────────────────────────────────
 
+    @staticmethod
+    def needs_llm(method, want_summary=True) -> bool:
+        """Whether the LLM still has something to add after the free layers.
+
+        The call is skipped only when it could tell us nothing we still need:
+        the scope map settled the module and no summary is wanted, or the
+        vector layer answered (see classify).
+        """
+        if method == METHOD_VECTOR:
+            return False
+        return want_summary or method != METHOD_SCOPE_MAP
+
+    def _classify_free(self, scope_id, conn, embedding, document_id, scope_modules=None):
+        """The layers that cost no API call: (module_code, confidence, method).
+
+        scope_modules, from classify_by_scopes, saves the per-document lookup.
+        """
+        if scope_modules is not None:
+            scope_module = scope_modules.get(scope_id) if scope_id else None
+        else:
+            scope_module = self.classify_by_scope(scope_id, conn=conn)
+        if scope_module:
+            return scope_module, 1.0, METHOD_SCOPE_MAP
+        verdict = self.classify_by_vector(embedding, conn=conn, exclude_document_id=document_id)
+        if verdict:
+            return verdict[0], verdict[1], METHOD_VECTOR
+        return UNCLASSIFIED, 0.0, None
+
     def classify(self, title='', text='', scope_id=None, conn=None,
-                 llm_provider='openai', use_llm=True, want_summary=True):
+                 llm_provider='openai', use_llm=True, want_summary=True,
+                 embedding=None, document_id=None):
         """Resolve a document's module, and summarize it.
 
         Returns (module_code, confidence, method, summary). Always returns a
@@ -184,21 +456,65 @@ class ModuleClassifier:
         and explainable, where the model is guessing. But the summary only comes
         from the LLM, so when a summary is wanted the call happens either way and
         the scope's verdict is layered on top of it.
+
+        embedding (the document's vector) enables the vector layer; document_id
+        keeps the document from voting for itself on a re-sync. A clear vote
+        ends the cascade without the call, summary included: taking the call
+        off the ingest path is the point of the layer, and a missing summary
+        keeps the stored one.
         """
         module, confidence, method, summary = UNCLASSIFIED, 0.0, None, ''
         try:
-            scope_module = self.classify_by_scope(scope_id, conn=conn)
-            if scope_module:
-                module, confidence, method = scope_module, 1.0, METHOD_SCOPE_MAP
-
-            # Skip the call only when it could tell us nothing we still need.
-            if use_llm and (want_summary or not scope_module):
+            module, confidence, method = self._classify_free(
+                scope_id, conn, embedding, document_id
+            )
+            if use_llm and self.needs_llm(method, want_summary):
                 llm_module, llm_confidence, summary = self.classify_by_llm(
                     title, text, llm_provider=llm_provider
                 )
-                if llm_module and not scope_module:
+                if llm_module and method is None:
                     module, confidence, method = llm_module, llm_confidence, METHOD_LLM
         except Exception as e:
             print(f"MODULE_CLASSIFIER: classification failed for {title!r}: {e}")
 
         return module, confidence, method, summary
+
+    def classify_many(self, documents, conn=None, llm_provider='openai',
+                      use_llm=True, want_summary=True):
+        """classify() for many documents, with the LLM layer batched.
+
+        documents are dicts with 'id', 'title', 'text' and optionally
+        'scope_id' and 'embedding'. Returns {id: (module_code, confidence,
+        method, summary)} with the same per-document outcome as classify(),
+        but one request per batch instead of one per document.
+        """
+        verdicts, ask = {}, []
+        try:
+            scope_modules = self.classify_by_scopes(
+                [doc.get('scope_id') for doc in documents], conn=conn
+            )
+        except Exception as e:
+            print(f"MODULE_CLASSIFIER: batch scope lookup failed: {e}")
+            scope_modules = None
+        for doc in documents:
+            doc_id = doc['id']
+            try:
+                module, confidence, method = self._classify_free(
+                    doc.get('scope_id'), conn, doc.get('embedding'), doc_id,
+                    scope_modules=scope_modules,
+                )
+            except Exception as e:
+                print(f"MODULE_CLASSIFIER: classification failed for {doc.get('title')!r}: {e}")
+                module, confidence, method = UNCLASSIFIED, 0.0, None
+            verdicts[doc_id] = (module, confidence, method, '')
+            if use_llm and self.needs_llm(method, want_summary):
+                ask.append((doc_id, doc.get('title') or '', doc.get('text') or ''))
+
+        if ask:
+            answers = self.classify_batch_by_llm(ask, llm_provider=llm_provider)
+            for doc_id, (llm_module, llm_confidence, summary) in answers.items():
+                module, confidence, method, _ = verdicts[doc_id]
+                if llm_module and method is None:
+                    module, confidence, method = llm_module, llm_confidence, METHOD_LLM
+                verdicts[doc_id] = (module, confidence, method, summary)
+        return verdicts
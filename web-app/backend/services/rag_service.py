@@ -1,11 +1,15 @@
 import os
 import io
+import base64
+import heapq
 import json
+import struct
 import zipfile
 import re
 from datetime import datetime
 from html import unescape
 
+import numpy as np
 import PyPDF2
 import psycopg2
 import psycopg2.extras
@@ -14,10 +18,14 @@ from docx import Document
 
 from db import get_conn, pgvector_available
 from services.openai_service import OpenAIService
-from services.module_classifier import ModuleClassifier, should_reclassify
+from services import corpus_cache, document_catalog
+from services.embedding_cache import EmbeddingCache, content_hash
+from services.vector_index import get_vector_index
+from services.module_classifier import CLASSIFY_CHAR_LIMIT, ModuleClassifier, should_reclassify
 from config.sap_modules import (
     METHOD_LLM,
     METHOD_MANUAL,
+    METHOD_SCOPE_MAP,
     MODULE_LABELS,
     REVIEW_CONFIDENCE_THRESHOLD,
     UNCLASSIFIED,
@@ -32,13 +40,100 @@ SUPPORTED_EXTENSIONS = {
     '.py', '.js', '.ts', '.java', '.abap', '.json', '.yaml', '.yml', '.xml'
 }
 
+# Document-level columns: every chunk of a document carries the same values.
+# Order matters — RAGService._document_columns and the upsert below follow it.
+DOCUMENT_COLUMNS = (
+    'document_name', 'source', 'doc_type', 'project', 'updated_by', 'updated_on',
+    'web_url', 'is_placeholder', 'uuid', 'display_id', 'project_id', 'scope_id',
+    'version', 'is_latest', 'calm_display_id',
+    'sap_module', 'sap_module_confidence', 'sap_module_method', 'summary',
+)
+
+# Every column a chunk row is written with, in RAGService._chunk_row order.
+CHUNK_COLUMNS = (
+    ('id', 'document_id', 'content', 'embedding', 'html_content')
+    + DOCUMENT_COLUMNS
+    + ('synced_on', 'embedding_model', 'content_hash')
+)
+
+# Built once at import rather than on every write. {values} is either a single
+# row of placeholders (SQLite executemany) or execute_values' "VALUES %s".
+_CHUNK_UPSERT_TEMPLATE = """
+    INSERT INTO documents ({columns})
+    VALUES {{values}}
+    ON CONFLICT (id) DO UPDATE SET
+        {updates}
+""".format(
+    columns=", ".join(CHUNK_COLUMNS),
+    updates=",\n        ".join(
+        # Keep the stored summary when this run produced none, rather than
+        # wiping it: a re-ingest with use_llm=False has no summary to offer,
+        # and losing one is worse than keeping a stale one.
+        "summary = COALESCE(EXCLUDED.summary, documents.summary)"
+        if column == 'summary' else f"{column} = EXCLUDED.{column}"
+        for column in CHUNK_COLUMNS if column != 'id'
+    ),
+)
+CHUNK_UPSERT_ROW_SQL = _CHUNK_UPSERT_TEMPLATE.format(
+    values="(" + ", ".join(["%s"] * len(CHUNK_COLUMNS)) + ")"
+)
+CHUNK_UPSERT_VALUES_SQL = _CHUNK_UPSERT_TEMPLATE.format(values="%s")
+_EMBEDDING_POS = CHUNK_COLUMNS.index('embedding')
+_HASH_POS = CHUNK_COLUMNS.index('content_hash')
+
+
+# Binary embedding format for BYTEA/BLOB columns (app-side vectors and the
+# embedding cache). Replaces JSON text, which is ~5x larger and has to be parsed
+# on every read:
+#
+#   magic b'YVEC' | version u8 | dim u32 | model length u8 | model utf-8 |
+#   dim little-endian float32
+#
+# JSON blobs always start with '[', so the two formats never collide and old
+# rows stay readable while services/embedding_migration.py rewrites them.
+EMBEDDING_MAGIC = b'YVEC'
+EMBEDDING_FORMAT_VERSION = 1
+_EMBEDDING_HEADER = struct.Struct('<4sBIB')
+
+
+def _serialize_embedding(vector, model: str = '') -> bytes:
+    """Encode a vector in the binary format above."""
+    values = np.asarray(vector, dtype='<f4').reshape(-1)
+    model_bytes = (model or '').encode('utf-8')[:255]
+    header = _EMBEDDING_HEADER.pack(
+        EMBEDDING_MAGIC, EMBEDDING_FORMAT_VERSION, values.shape[0], len(model_bytes)
+    )
+    return header + model_bytes + values.tobytes()
+
+
+def _is_binary_embedding(raw) -> bool:
+    return (
+        isinstance(raw, (bytes, bytearray, memoryview))
+        and bytes(raw[:len(EMBEDDING_MAGIC)]) == EMBEDDING_MAGIC
+    )
+
+
+def _embedding_header(raw):
+    """(version, dim, model) of a binary embedding, or None for any other shape."""
+    if not _is_binary_embedding(raw):
+        return None
+    _, version, dim, model_len = _EMBEDDING_HEADER.unpack_from(raw)
+    start = _EMBEDDING_HEADER.size
+    model = bytes(raw[start:start + model_len]).decode('utf-8', errors='replace')
+    return version, dim, model
 
-def _deserialize_embedding(raw):
+
+def _deserialize_embedding(raw, as_array: bool = False):
     """Normalize a stored embedding to a plain list of floats.
 
+    With as_array=True a binary embedding comes back as a read-only float32
+    ndarray viewing the stored buffer — no copy, no parse. Hot paths (search,
+    the vector index) ask for that; everything else gets a list.
+
     Shapes that reach this, depending on how the row was written and read:
-      - bytes / bytearray / memoryview — BYTEA/BLOB holding JSON text, used
-        wherever pgvector is unavailable and vectors are handled app-side.
+      - bytes / bytearray / memoryview — BYTEA/BLOB, used wherever pgvector is
+        unavailable and vectors are handled app-side. Either the binary format
+        above or, on rows not yet migrated, JSON text.
         psycopg2 hands bytea back as a memoryview, not bytes.
       - str    — JSON text, via SQLite
       - Vector — pgvector's own type, once register_vector() is on the connection
@@ -60,8 +155,16 @@ def _deserialize_embedding(raw):
     if raw is None:
         return None
     try:
-        # Buffer types first: they carry JSON text, and memoryview would
-        # otherwise be mistaken for an ndarray by the .tolist() branch below.
+        # Buffer types first: memoryview would otherwise be mistaken for an
+        # ndarray by the .tolist() branch below.
+        if _is_binary_embedding(raw):
+            version, dim, model_len = _EMBEDDING_HEADER.unpack_from(raw)[1:]
+            if version != EMBEDDING_FORMAT_VERSION:
+                raise ValueError(f"unknown embedding format version {version}")
+            vector = np.frombuffer(
+                raw, dtype='<f4', count=dim, offset=_EMBEDDING_HEADER.size + model_len
+            )
+            return vector if as_array else vector.tolist()
         if isinstance(raw, (bytes, bytearray, memoryview)):
             return json.loads(bytes(raw).decode('utf-8'))
         if isinstance(raw, str):
@@ -71,7 +174,7 @@ def _deserialize_embedding(raw):
         if hasattr(raw, 'tolist'):      # numpy.ndarray
             return list(raw.tolist())
         return list(raw)
-    except (json.JSONDecodeError, TypeError, ValueError) as e:
+    except (json.JSONDecodeError, TypeError, ValueError, struct.error) as e:
         print(f"WARNING: could not deserialize embedding ({type(raw).__name__}): {e}")
         return None
 
@@ -79,7 +182,12 @@ def _deserialize_embedding(raw):
 class RAGService:
     def __init__(self):
         self.openai_service = OpenAIService()
-        self.module_classifier = ModuleClassifier(openai_service=self.openai_service)
+        self.module_classifier = ModuleClassifier(
+            openai_service=self.openai_service,
+            neighbour_search=self._labelled_neighbours,
+        )
+        self.embedding_cache = EmbeddingCache()
+        self.vector_index = get_vector_index(self.EMBEDDING_MODEL, self.EMBEDDING_DIM)
         self._is_sqlite_cache = None
         print("DEBUG: RAG Service initialized with OpenAI embeddings + PostgreSQL (pgvector) fallback")
 
@@ -93,6 +201,22 @@ class RAGService:
         """SQLite or PostgreSQL without pgvector — store/query embeddings in Python."""
         return self._is_sqlite(conn) or not pgvector_available()
 
+    def start_vector_index(self):
+        """Warm the in-memory index in the background, where it is the search path.
+
+        With pgvector the database does the nearest-neighbour search, so holding
+        a second copy of the corpus in memory would be pure cost.
+        """
+        conn = get_conn()
+        try:
+            app_side = self._use_app_side_vectors(conn)
+        finally:
+            conn.close()
+        if app_side:
+            self.vector_index.warm_up()
+        else:
+            self.vector_index.disable()
+
     # ── Embedding ─────────────────────────────────────────────────────────────
     #
     # The whole corpus is embedded with ONE model. Every stored vector and every
@@ -111,13 +235,37 @@ class RAGService:
         order = [p.strip().lower() for p in raw.split(",") if p.strip()]
         return order or ["openai"]
 
-    def _embed_openai(self, text):
+    # Batching. OpenAI takes up to 2048 inputs and ~300k tokens per embeddings
+    # request; both knobs sit well under that so one oversized chunk cannot tip a
+    # batch over. Tokens are estimated from characters — no tokenizer dependency —
+    # and a batch the provider still rejects as too large is split and retried.
+    EMBEDDING_BATCH_MAX_INPUTS = int(os.getenv("EMBEDDING_BATCH_MAX_INPUTS", "256"))
+    EMBEDDING_BATCH_MAX_TOKENS = int(os.getenv("EMBEDDING_BATCH_MAX_TOKENS", "100000"))
+
+    # Provider errors meaning "this request is too big", not "this provider is down".
+    _BATCH_LIMIT_MARKERS = (
+        'maximum context length', 'max_tokens_per_request', 'too many tokens',
+        'too many inputs', 'request too large', 'payload too large',
+    )
+    # HTTP 413 as the status gets worded: by the openai client ("Error code:
+    # 413"), by requests ("413 Client Error") and by _embed_with_failover
+    # ("status 413"). A bare '413' would match any number in a message.
+    _BATCH_LIMIT_STATUS = re.compile(r"\b(?:error code|status):? 413\b|\b413 client error\b")
+
+    @classmethod
+    def _is_batch_limit_error(cls, message: str) -> bool:
+        message = message.lower()
+        return (any(s in message for s in cls._BATCH_LIMIT_MARKERS)
+                or bool(cls._BATCH_LIMIT_STATUS.search(message)))
+
+    def _embed_openai(self, texts):
         from openai import OpenAI
         client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'), timeout=120.0)
-        response = client.embeddings.create(model=self.EMBEDDING_MODEL, input=text)
-        return response.data[0].embedding
+        response = client.embeddings.create(model=self.EMBEDDING_MODEL, input=list(texts))
+        # Order by index rather than trusting response order.
+        return [item.embedding for item in sorted(response.data, key=lambda d: d.index)]
 
-    def _embed_ai_core(self, text):
+    def _embed_ai_core(self, texts):
         ai_core = self.openai_service.ai_core_service
         # Vector-space guard: AI Core must be serving the exact corpus model.
         # A different model would deserialize and score fine while returning
@@ -129,10 +277,10 @@ class RAGService:
                 f"AI Core embedding model '{ai_core.embedding_model}' != corpus model "
                 f"'{self.EMBEDDING_MODEL}'; refusing to mix vector spaces"
             )
-        return ai_core.create_embedding(text)
+        return ai_core.create_embeddings(list(texts))
 
-    def _create_embedding(self, text, _retries=2):
-        """Embed text with the corpus model, trying each configured provider.
+    def _embed_with_failover(self, texts, _retries=2):
+        """Embed a list of texts in one request per provider attempt.
 
         Falls over from one gateway to the next (e.g. OpenAI 429 → AI Core) and
         retries transient failures, so a single provider's outage or a blip does
@@ -153,18 +301,32 @@ class RAGService:
                 continue
             for attempt in range(1, _retries + 1):
                 try:
-                    vec = fn(text)
+                    vectors = fn(texts)
+                    if len(vectors) != len(texts):
+                        raise RuntimeError(
+                            f"returned {len(vectors)} vector(s) for {len(texts)} input(s)"
+                        )
                     if name != 'openai':
                         print(f"EMBEDDING: served by fallback provider '{name}'")
-                    return vec
+                    return vectors
                 except Exception as e:
                     msg = str(e)
+                    # The status code off the exception (openai) or its response
+                    # (requests), so a 413 reads as one whatever the message says.
+                    status = getattr(e, 'status_code', None) or getattr(
+                        getattr(e, 'response', None), 'status_code', None
+                    )
+                    if status == 413:
+                        msg = f"status 413: {msg}"
                     errors.append(f"{name}: {msg}")
-                    # Quota/config errors will not recover on retry — move on.
-                    transient = not any(
-                        s in msg.lower()
-                        for s in ('quota', 'insufficient', 'credit', 'not configured',
-                                  'refusing to mix', 'invalid api key', 'unauthorized')
+                    # Quota/config/size errors will not recover on retry — move on.
+                    transient = not (
+                        any(
+                            s in msg.lower()
+                            for s in ('quota', 'insufficient', 'credit', 'not configured',
+                                      'refusing to mix', 'invalid api key', 'unauthorized')
+                        )
+                        or self._is_batch_limit_error(msg)
                     )
                     if transient and attempt < _retries:
                         import time
@@ -173,6 +335,67 @@ class RAGService:
                     break
         raise RuntimeError("All embedding providers failed → " + " | ".join(errors))
 
+    def _create_embedding(self, text, _retries=2):
+        """Embed one text with the corpus model. See _create_embeddings."""
+        return self._create_embeddings([text], _retries=_retries)[0]
+
+    @staticmethod
+    def _estimate_tokens(text):
+        # ~4 chars per token for English prose; dividing by 3 errs on the safe side.
+        return len(text) // 3 + 1
+
+    def _embedding_batches(self, texts):
+        """Yield consecutive slices of texts that fit one embeddings request."""
+        batch, batch_tokens = [], 0
+        for text in texts:
+            tokens = self._estimate_tokens(text)
+            if batch and (len(batch) >= self.EMBEDDING_BATCH_MAX_INPUTS
+                          or batch_tokens + tokens > self.EMBEDDING_BATCH_MAX_TOKENS):
+                yield batch
+                batch, batch_tokens = [], 0
+            batch.append(text)
+            batch_tokens += tokens
+        if batch:
+            yield batch
+
+    def _create_embeddings(self, texts, _retries=2):
+        """Embed many texts with the corpus model, batching requests.
+
+        Returns one vector per input, in input order. Every ingest path goes
+        through here: a 40-chunk document is one request instead of 40. Batches
+        are packed to the token budget; one the provider still rejects as too
+        large is halved and retried, down to single inputs.
+
+        The embedding cache is consulted first, so only text that has never been
+        embedded with EMBEDDING_MODEL reaches a provider — on a re-sync of an
+        unchanged document, nothing does.
+        """
+        texts = list(texts)
+        vectors = self.embedding_cache.get_many(texts, self.EMBEDDING_MODEL)
+
+        # Embed each distinct missing text once, even if it repeats in the input.
+        missing = list(dict.fromkeys(t for t, v in zip(texts, vectors) if v is None))
+        if missing:
+            fresh = []
+            for batch in self._embedding_batches(missing):
+                fresh.extend(self._embed_batch_adaptive(batch, _retries))
+            self.embedding_cache.put_many(missing, fresh, self.EMBEDDING_MODEL)
+            by_text = dict(zip(missing, fresh))
+            vectors = [v if v is not None else by_text[t] for t, v in zip(texts, vectors)]
+        return vectors
+
+    def _embed_batch_adaptive(self, batch, _retries):
+        try:
+            return self._embed_with_failover(batch, _retries=_retries)
+        except RuntimeError as e:
+            too_large = self._is_batch_limit_error(str(e))
+            if len(batch) <= 1 or not too_large:
+                raise
+            mid = len(batch) // 2
+            print(f"EMBEDDING: batch of {len(batch)} rejected as too large; splitting")
+            return (self._embed_batch_adaptive(batch[:mid], _retries)
+                    + self._embed_batch_adaptive(batch[mid:], _retries))
+
     # ── Internal helpers ───────────────────────────────────────────────────────
 
     def _chunk_text(self, text, chunk_size=500, overlap=50):
@@ -195,109 +418,223 @@ class RAGService:
         }
         return type_map.get(ext, ext.upper())
 
-    def _delete_chunks_for_doc(self, doc_id: str, conn):
+    def _delete_chunks_for_doc(self, doc_id: str, conn, index_changes):
         """Delete all existing chunks that start with doc_id."""
         with conn.cursor() as cur:
+            if self.vector_index.tracking:
+                cur.execute("SELECT id FROM documents WHERE id LIKE %s", (f"{doc_id}_%",))
+                index_changes.remove(row[0] for row in cur.fetchall())
             cur.execute(
                 "DELETE FROM documents WHERE id LIKE %s",
                 (f"{doc_id}_%",)
             )
 
-    def _insert_chunk(self, conn, chunk_id: str, doc_id: str, content: str,
-                      embedding, metadata: dict):
-        """Insert a single chunk row into the documents table."""
-        is_sqlite = self._is_sqlite(conn)
-        app_side = self._use_app_side_vectors(conn)
-        
+    def _delete_chunk_ids(self, chunk_ids, conn, index_changes):
+        """Delete specific chunk rows by id."""
+        if not chunk_ids:
+            return
+        with conn.cursor() as cur:
+            cur.execute(
+                f"DELETE FROM documents WHERE id IN ({', '.join(['%s'] * len(chunk_ids))})",
+                list(chunk_ids),
+            )
+        index_changes.remove(chunk_ids)
+
+    def _diff_stored_chunks(self, doc_id: str, chunks: list, conn):
+        """Compare a document's new chunk list with what is stored, by content hash.
+
+        Chunk ids are positional ("<doc_id>_<i>"), so chunk i is unchanged when
+        the stored row with that id hashes the same. Returns None — meaning
+        "rewrite everything" — when there is nothing to diff against: a first
+        ingest, a placeholder, or rows embedded with another model, which have
+        to be re-embedded regardless. Otherwise returns:
+
+            changed   — indexes into chunks that need embedding and an upsert
+            unchanged — stored rows (dicts) to leave in place
+            removed   — stored chunk ids with no counterpart in chunks
+            anchor    — one stored row, for document-level fields
+        """
+        # embedding: the unchanged rows' vectors still count towards the
+        # document's vector for classification.
+        columns = ['id', 'content', 'content_hash', 'embedding', 'embedding_model', 'html_content']
+        columns += [c for c in DOCUMENT_COLUMNS if c not in columns]
+        cursor_factory = None if self._is_sqlite(conn) else psycopg2.extras.RealDictCursor
+        with conn.cursor(cursor_factory=cursor_factory) as cur:
+            cur.execute(
+                f"SELECT {', '.join(columns)} FROM documents WHERE document_id = %s",
+                (doc_id,),
+            )
+            stored = {row['id']: row for row in (dict(r) for r in cur.fetchall())}
+
+        if not stored:
+            return None
+        for row in stored.values():
+            if row.get('is_placeholder'):
+                return None
+            model = row.get('embedding_model')
+            if model and model != self.EMBEDDING_MODEL:
+                return None
+
+        changed, unchanged = [], []
+        for i, chunk in enumerate(chunks):
+            row = stored.get(f"{doc_id}_{i}")
+            # Historical rows predate content_hash; hash their text instead.
+            stored_hash = row and (row.get('content_hash') or content_hash(row.get('content')))
+            if row and stored_hash == content_hash(chunk):
+                unchanged.append(row)
+            else:
+                changed.append(i)
+
+        keep = {f"{doc_id}_{i}" for i in range(len(chunks))}
+        return {
+            'changed': changed,
+            'unchanged': unchanged,
+            'removed': [chunk_id for chunk_id in stored if chunk_id not in keep],
+            'anchor': stored.get(f"{doc_id}_0") or next(iter(stored.values())),
+        }
+
+    @staticmethod
+    def _column_matches(stored, new) -> bool:
+        # SQLite hands booleans back as 0/1 and numbers may round-trip as text.
+        if isinstance(new, bool) or isinstance(stored, bool):
+            return bool(stored) == bool(new)
+        if isinstance(new, (int, float)) and isinstance(stored, (int, float)):
+            return float(stored) == float(new)
+        return ('' if stored is None else str(stored)) == ('' if new is None else str(new))
+
+    def _refresh_unchanged_chunks(self, diff, metadata: dict, html: str, conn):
+        """Bring document-level fields up to date on rows whose text did not change.
+
+        Content, embedding and synced_on are left alone — only metadata that
+        drifted (a rename, a new module, a changed date) is written, in one
+        statement, and only to the rows where it actually differs.
+        """
+        wanted = self._document_columns(metadata)
+        if wanted.get('summary') is None:
+            # No summary this run means "keep the stored one", not "clear it".
+            wanted.pop('summary')
+
+        stale = [
+            row['id'] for row in diff['unchanged']
+            if not all(self._column_matches(row.get(c), v) for c, v in wanted.items())
+        ]
+        with conn.cursor() as cur:
+            if stale:
+                cur.execute(
+                    f"""
+                    UPDATE documents
+                    SET {", ".join(f"{c} = %s" for c in wanted)}
+                    WHERE id IN ({", ".join(["%s"] * len(stale))})
+                    """,
+                    list(wanted.values()) + stale,
+                )
+            # Only the first chunk carries the HTML, and it can change (markup,
+            # images) while the extracted text stays the same.
+            for row in diff['unchanged']:
+                if row['id'].endswith('_0') and (row.get('html_content') or '') != html:
+                    cur.execute(
+                        "UPDATE documents SET html_content = %s WHERE id = %s",
+                        (html, row['id']),
+                    )
+
+    def _document_columns(self, metadata: dict) -> dict:
+        """Document-level column values for a chunk row, keyed by column.
+
+        Every chunk of a document carries the same values here; only id,
+        content, embedding and html_content vary per chunk.
+        """
+        return {
+            'document_name': metadata.get('document_name', ''),
+            'source': metadata.get('source', 'File Upload'),
+            'doc_type': metadata.get('type', 'Unknown'),
+            'project': metadata.get('project', 'N/A'),
+            'updated_by': metadata.get('updatedBy', 'System'),
+            'updated_on': metadata.get('updatedOn', 'N/A'),
+            'web_url': metadata.get('webUrl', ''),
+            'is_placeholder': metadata.get('is_placeholder', False),
+            'uuid': metadata.get('uuid', ''),
+            'display_id': metadata.get('displayId', ''),
+            'project_id': metadata.get('projectId', ''),
+            'scope_id': metadata.get('scopeId', ''),
+            'version': metadata.get('version', 1),
+            'is_latest': metadata.get('isLatest', True),
+            'calm_display_id': metadata.get('calmDisplayId', metadata.get('displayId', '')),
+            'sap_module': metadata.get('sapModule', UNCLASSIFIED),
+            'sap_module_confidence': metadata.get('sapModuleConfidence'),
+            'sap_module_method': metadata.get('sapModuleMethod'),
+            'summary': metadata.get('summary'),
+        }
+
+    def _chunk_row(self, conn, chunk_id: str, doc_id: str, content: str,
+                   embedding, metadata: dict) -> tuple:
+        """One chunk as a parameter tuple in CHUNK_COLUMNS order."""
         # Serialize embeddings when pgvector is not available (SQLite or managed Postgres)
-        if app_side and isinstance(embedding, list):
-            import json
-            embedding_val = json.dumps(embedding).encode('utf-8')
+        if self._use_app_side_vectors(conn) and isinstance(embedding, (list, np.ndarray)):
+            embedding_val = _serialize_embedding(embedding, self.EMBEDDING_MODEL)
         else:
             embedding_val = embedding
 
-        insert_sql = """
-                INSERT INTO documents (
-                    id, document_id, document_name, content, embedding,
-                    source, doc_type, project, updated_by, updated_on,
-                    web_url, is_placeholder, html_content,
-                    uuid, display_id, project_id, scope_id,
-                    version, is_latest, calm_display_id,
-                    sap_module, sap_module_confidence, sap_module_method,
-                    synced_on, summary, embedding_model
-                ) VALUES (
-                    {placeholders}
-                )
-                ON CONFLICT (id) DO UPDATE SET
-                    content = EXCLUDED.content,
-                    embedding = EXCLUDED.embedding,
-                    html_content = EXCLUDED.html_content,
-                    updated_on = EXCLUDED.updated_on,
-                    document_name = EXCLUDED.document_name,
-                    source = EXCLUDED.source,
-                    doc_type = EXCLUDED.doc_type,
-                    project = EXCLUDED.project,
-                    updated_by = EXCLUDED.updated_by,
-                    web_url = EXCLUDED.web_url,
-                    is_placeholder = EXCLUDED.is_placeholder,
-                    uuid = EXCLUDED.uuid,
-                    display_id = EXCLUDED.display_id,
-                    project_id = EXCLUDED.project_id,
-                    scope_id = EXCLUDED.scope_id,
-                    version = EXCLUDED.version,
-                    is_latest = EXCLUDED.is_latest,
-                    calm_display_id = EXCLUDED.calm_display_id,
-                    sap_module = EXCLUDED.sap_module,
-                    sap_module_confidence = EXCLUDED.sap_module_confidence,
-                    sap_module_method = EXCLUDED.sap_module_method,
-                    synced_on = EXCLUDED.synced_on,
-                    -- Keep the stored summary when this run produced none, rather
-                    -- than wiping it: a re-ingest with use_llm=False has no summary
-                    -- to offer, and losing one is worse than keeping a stale one.
-                    summary = COALESCE(EXCLUDED.summary, documents.summary),
-                    embedding_model = EXCLUDED.embedding_model
-                """
-        params = (
-            chunk_id, doc_id, metadata.get('document_name', ''), content, embedding_val,
-            metadata.get('source', 'File Upload'), metadata.get('type', 'Unknown'),
-            metadata.get('project', 'N/A'), metadata.get('updatedBy', 'System'),
-            metadata.get('updatedOn', 'N/A'), metadata.get('webUrl', ''),
-            metadata.get('is_placeholder', False), metadata.get('html_content', ''),
-            metadata.get('uuid', ''), metadata.get('displayId', ''),
-            metadata.get('projectId', ''), metadata.get('scopeId', ''),
-            metadata.get('version', 1), metadata.get('isLatest', True),
-            metadata.get('calmDisplayId', metadata.get('displayId', '')),
-            metadata.get('sapModule', UNCLASSIFIED),
-            metadata.get('sapModuleConfidence'),
-            metadata.get('sapModuleMethod'),
+        document = self._document_columns(metadata)
+        return (
+            chunk_id, doc_id, content, embedding_val, metadata.get('html_content', ''),
+            *(document[column] for column in DOCUMENT_COLUMNS),
             # Set here rather than left to the column default: the default only
             # fires on INSERT, and a re-sync takes the ON CONFLICT path.
             metadata.get('syncedOn') or datetime.now(),
-            metadata.get('summary'),
             # Every chunk is embedded by _create_embedding, which only ever uses
             # EMBEDDING_MODEL, so stamp that as the source of truth.
             self.EMBEDDING_MODEL,
+            # What incremental re-ingest diffs against; see _diff_stored_chunks.
+            content_hash(content),
         )
 
+    # Rows per INSERT statement. A whole document fits in one; the cap only
+    # bounds statement size for a very large batch.
+    CHUNK_WRITE_PAGE_SIZE = 500
+
+    def _write_chunks(self, conn, rows, index_changes):
+        """Upsert many chunk rows (from _chunk_row) in as few statements as possible.
+
+        Postgres gets one multi-row INSERT ... ON CONFLICT via execute_values
+        instead of one round trip per chunk; SQLite gets executemany. The
+        vectors go into index_changes, for the caller to apply after commit.
+        """
+        # A statement may not upsert the same id twice, so the last row wins.
+        rows = list({row[0]: row for row in rows}.values())
+        if not rows:
+            return
         with conn.cursor() as cur:
-            if is_sqlite:
-                placeholders = ", ".join(["?"] * len(params))
-                cur.execute(
-                    insert_sql.format(placeholders=placeholders),
-                    params,
-                )
+            if self._is_sqlite(conn):
+                cur.executemany(CHUNK_UPSERT_ROW_SQL, rows)
             else:
-                placeholders = ", ".join(["%s"] * len(params))
-                cur.execute(
-                    insert_sql.format(placeholders=placeholders),
-                    params,
+                psycopg2.extras.execute_values(
+                    cur, CHUNK_UPSERT_VALUES_SQL, rows,
+                    page_size=self.CHUNK_WRITE_PAGE_SIZE,
                 )
+        if self.vector_index.tracking:
+            index_changes.upsert(
+                [row[0] for row in rows],
+                [_deserialize_embedding(row[_EMBEDDING_POS], as_array=True) for row in rows],
+                [row[_HASH_POS] for row in rows],
+            )
+
+    def _insert_chunk(self, conn, chunk_id: str, doc_id: str, content: str,
+                      embedding, metadata: dict, index_changes):
+        """Insert a single chunk row into the documents table."""
+        self._write_chunks(
+            conn, [self._chunk_row(conn, chunk_id, doc_id, content, embedding, metadata)],
+            index_changes,
+        )
 
     # ── Module classification ──────────────────────────────────────────────────
 
-    def _existing_module_override(self, doc_id: str, conn):
+    def _existing_module_override(self, doc_id: str, conn, method=METHOD_MANUAL):
         """Return (module, confidence, method) if a human set this document's
-        module, else None. Keeps re-ingest from clobbering a correction."""
+        module, else None. Keeps re-ingest from clobbering a correction.
+
+        With method=METHOD_LLM, the stored LLM verdict instead — what a
+        deferred classification keeps until its batch runs.
+        """
         try:
             with conn.cursor() as cur:
                 cur.execute(
@@ -307,7 +644,7 @@ class RAGService:
                     WHERE document_id = %s AND sap_module_method = %s
                     LIMIT 1
                     """,
-                    (doc_id, METHOD_MANUAL),
+                    (doc_id, method),
                 )
                 row = cur.fetchone()
         except Exception as e:
@@ -320,14 +657,19 @@ class RAGService:
             return row[0], row[1], row[2]
         return row['sap_module'], row['sap_module_confidence'], row['sap_module_method']
 
-    def _resolve_module(self, doc_id, title, text, scope_id, conn, use_llm=True):
+    def _resolve_module(self, doc_id, title, text, scope_id, conn, use_llm=True,
+                        embeddings=None):
         """Resolve a document's module and summary for ingest.
 
+        embeddings are the chunk vectors ingest just created; their mean is the
+        document's vector for the classifier's nearest-neighbour layer.
+
         Returns a metadata fragment ready to merge into the chunk metadata.
         Never raises — a classification failure must not fail an ingest.
         """
         module, confidence, method, summary = self.module_classifier.classify(
-            title=title, text=text, scope_id=scope_id, conn=conn, use_llm=use_llm
+            title=title, text=text, scope_id=scope_id, conn=conn, use_llm=use_llm,
+            embedding=self._mean_vector(embeddings), document_id=doc_id,
         )
 
         # A human's correction outranks both the scope map and the model, but it
@@ -345,6 +687,154 @@ class RAGService:
             'summary': summary or None,
         }
 
+    @staticmethod
+    def _mean_vector(vectors):
+        """Mean of chunk vectors as a list, or None when there are none."""
+        vectors = [v for v in (vectors or []) if v is not None and len(v)]
+        if not vectors:
+            return None
+        try:
+            return np.mean(np.asarray(vectors, dtype=np.float32), axis=0).tolist()
+        except ValueError:
+            # Ragged: vectors of different dimensions cannot be averaged.
+            return None
+
+    def stored_document_vector(self, conn, doc_id: str):
+        """The document's vector from its stored chunk embeddings, or None.
+
+        For documents classified outside ingest (backfill_modules.py), where
+        there are no freshly created embeddings to reuse.
+        """
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT embedding FROM documents
+                WHERE document_id = %s
+                  AND (embedding_model = %s OR embedding_model IS NULL)
+                  AND (is_placeholder = %s OR is_placeholder IS NULL)
+                """,
+                (doc_id, self.EMBEDDING_MODEL, False),
+            )
+            raw_vectors = [row[0] for row in cur.fetchall()]
+        return self._mean_vector([
+            _deserialize_embedding(raw, as_array=True) for raw in raw_vectors
+        ])
+
+    # Chunks fetched per neighbour wanted: chunks of one document tend to rank
+    # together, and each document only votes once.
+    NEIGHBOUR_CHUNK_FACTOR = 5
+
+    def _labelled_neighbours(self, embedding, conn=None, exclude_document_id=None, k=10):
+        """The classifier's neighbour search: [(module, similarity)] for the k
+        documents nearest to `embedding`, nearest first, scored by their best
+        chunk.
+
+        Only documents whose module came from the scope map or a human vote.
+        Letting earlier vector or LLM verdicts vote too would let one wrong
+        guess spread to everything that resembles it.
+        """
+        query_embedding = [float(x) for x in embedding]
+        clauses = [
+            "sap_module_method IN (%s, %s)",
+            "(is_placeholder = %s OR is_placeholder IS NULL)",
+        ]
+        params = [METHOD_SCOPE_MAP, METHOD_MANUAL, False]
+        if exclude_document_id:
+            clauses.append("document_id <> %s")
+            params.append(str(exclude_document_id))
+        top_chunks = k * self.NEIGHBOUR_CHUNK_FACTOR
+
+        own_conn = conn is None
+        if own_conn:
+            conn = get_conn()
+        try:
+            if self._use_app_side_vectors(conn):
+                # Filtered by the index's own labels: this runs for every
+                # document a sync or backfill classifies, so no per-call SELECT
+                # of every labelled chunk id.
+                exclude = None
+                if exclude_document_id:
+                    with conn.cursor() as cur:
+                        cur.execute(
+                            "SELECT id FROM documents WHERE document_id = %s",
+                            (str(exclude_document_id),),
+                        )
+                        exclude = {row[0] for row in cur.fetchall()}
+                rows = self._index_search(
+                    conn, query_embedding, top_chunks,
+                    filters={
+                        'sap_module_method': {METHOD_SCOPE_MAP, METHOD_MANUAL},
+                        'is_placeholder': {False},
+                    },
+                    exclude=exclude,
+                )
+                if rows is None:
+                    rows = self._scan_search(conn, query_embedding, top_chunks, clauses, params)
+                hits = [(row['document_id'], row['score']) for row in rows]
+            else:
+                where = ["(embedding_model = %s OR embedding_model IS NULL)"] + clauses
+                with conn.cursor() as cur:
+                    cur.execute(
+                        f"""
+                        SELECT document_id, 1 - (embedding <=> %s::vector)
+                        FROM documents
+                        WHERE {" AND ".join(where)}
+                        ORDER BY embedding <=> %s::vector
+                        LIMIT %s
+                        """,
+                        [query_embedding, self.EMBEDDING_MODEL] + params
+                        + [query_embedding, top_chunks],
+                    )
+                    hits = [(row[0], float(row[1])) for row in cur.fetchall()]
+
+            nearest = {}
+            for doc_id, score in hits:
+                # Hits come nearest first, so the first is the document's best chunk.
+                if doc_id and doc_id not in nearest:
+                    nearest[doc_id] = score
+            nearest = list(nearest.items())[:k]
+            if not nearest:
+                return []
+
+            # The module as the chunks hold it now: the index labels that chose
+            # these neighbours may be a few seconds old, and the catalog is a
+            # derived copy of the same rows.
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT document_id, MIN(sap_module) FROM documents "
+                    f"WHERE document_id IN ({', '.join(['%s'] * len(nearest))}) "
+                    "GROUP BY document_id",
+                    [doc_id for doc_id, _ in nearest],
+                )
+                modules = {row[0]: row[1] for row in cur.fetchall()}
+        finally:
+            if own_conn:
+                conn.close()
+
+        return [(modules[doc_id], score) for doc_id, score in nearest if modules.get(doc_id)]
+
+    def _carry_over_module(self, stored_row: dict, scope_id, conn):
+        """Module fields for a re-sync whose content has not changed.
+
+        Keeps what is stored — a manual override, or an earlier LLM verdict and
+        its summary — except that a scope mapping, which always wins when it has
+        an answer, is re-checked since it is a free local lookup.
+        """
+        module = stored_row.get('sap_module') or UNCLASSIFIED
+        confidence = stored_row.get('sap_module_confidence')
+        method = stored_row.get('sap_module_method')
+        if should_reclassify(method):
+            scope_module = self.module_classifier.classify_by_scope(scope_id, conn=conn)
+            if scope_module:
+                module, confidence, method = scope_module, 1.0, METHOD_SCOPE_MAP
+        return {
+            'sapModule': module,
+            'sapModuleConfidence': confidence,
+            'sapModuleMethod': method,
+            # None keeps the stored summary (see _insert_chunk).
+            'summary': None,
+        }
+
     def set_document_module(self, doc_id: str, module: str) -> bool:
         """Apply a human's module correction across every chunk of a document.
 
@@ -368,7 +858,8 @@ class RAGService:
                     (normalized, METHOD_MANUAL, doc_id),
                 )
                 updated = cur.rowcount
-            conn.commit()
+            document_catalog.refresh(conn, [doc_id])
+            corpus_cache.commit(conn)
             return updated > 0
         except Exception as e:
             conn.rollback()
@@ -395,15 +886,92 @@ class RAGService:
         finally:
             conn.close()
 
+    # ids per statement on SQLite, which has no array parameters
+    SYNC_STATUS_SQLITE_BATCH = 500
+
+    def get_sync_status(self, document_ids) -> dict:
+        """Sync status of many documents in one round trip.
+
+        Returns {document_id: {synced, chunkCount, syncedOn, version,
+        isPlaceholder, updatedOn}} for every id asked about; ids with no
+        chunks come back as synced=False. syncedOn is the newest chunk's
+        synced_on as an ISO string; updatedOn is the source system's
+        last-changed stamp as it was ingested.
+        """
+        document_ids = list(dict.fromkeys(str(d) for d in document_ids if d))
+        status = {
+            doc_id: {
+                'synced': False,
+                'chunkCount': 0,
+                'syncedOn': None,
+                'version': None,
+                'isPlaceholder': False,
+                'updatedOn': None,
+            }
+            for doc_id in document_ids
+        }
+        if not document_ids:
+            return status
+
+        select = """
+            SELECT document_id, chunk_count, synced_on, version, is_placeholder, updated_on
+            FROM document_catalog
+            WHERE {match}
+        """
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                if self._is_sqlite(conn):
+                    rows = []
+                    for start in range(0, len(document_ids), self.SYNC_STATUS_SQLITE_BATCH):
+                        batch = document_ids[start:start + self.SYNC_STATUS_SQLITE_BATCH]
+                        cur.execute(
+                            select.format(match=f"document_id IN ({', '.join(['%s'] * len(batch))})"),
+                            batch,
+                        )
+                        rows.extend(cur.fetchall())
+                else:
+                    # One array parameter, one statement, and the primary key
+                    # does the lookup — however many ids there are.
+                    cur.execute(select.format(match="document_id = ANY(%s)"), (document_ids,))
+                    rows = cur.fetchall()
+        finally:
+            conn.close()
+
+        for row in rows:
+            synced_on = row[2]
+            if isinstance(synced_on, datetime):
+                synced_on = synced_on.isoformat()
+            status[row[0]] = {
+                'synced': True,
+                'chunkCount': row[1],
+                'syncedOn': str(synced_on).replace(' ', 'T') if synced_on else None,
+                'version': row[3],
+                'isPlaceholder': bool(row[4]),
+                'updatedOn': row[5],
+            }
+        return status
+
     def check_duplicate(self, filename: str) -> bool:
         """Check if a document with the same filename already exists."""
         return self.check_document_exists(filename)
 
-    def ingest_calm_document(self, doc_metadata, html_content: str):
+    def ingest_calm_document(self, doc_metadata, html_content: str, incremental: bool = True,
+                             defer_llm: bool = False):
         """
         Ingest a CALM document with real HTML content into the vector database.
         Strips HTML tags for embedding/search, stores raw HTML in metadata for display.
         Replaces any existing placeholder or chunks for this document.
+
+        With incremental=True (the default) a re-sync only re-embeds and rewrites
+        the chunks whose text changed, deletes the ones that disappeared, and
+        leaves the rest — vectors and synced_on included — where they are. See
+        _diff_stored_chunks for when it falls back to a full rewrite.
+
+        With defer_llm=True the document is stored with what the free
+        classification layers found, and when the LLM still has something to
+        add the result carries a 'classification' item to hand to
+        classify_deferred() along with others.
         """
         doc_id = doc_metadata.get('id', 'unknown')
         meta = doc_metadata.get('metadata', doc_metadata)
@@ -476,32 +1044,147 @@ class RAGService:
 
         chunks = self._chunk_text(plain_text, chunk_size=500, overlap=50)
 
+        classification = None
         conn = get_conn()
+        index_changes = self.vector_index.changes()
         try:
-            # Resolve the module before dropping the old chunks — the lookup for a
-            # prior manual override reads the rows we are about to delete.
-            base_metadata.update(
-                self._resolve_module(doc_id, filename, plain_text, scope_id, conn)
-            )
-
-            # Delete existing chunks for this document
-            self._delete_chunks_for_doc(doc_id, conn)
+            diff = self._diff_stored_chunks(doc_id, chunks, conn) if incremental else None
+
+            changed = diff['changed'] if diff is not None else list(range(len(chunks)))
+            # Embed before touching the table: a provider failure then leaves the
+            # previously synced chunks in place instead of an empty document.
+            embeddings = self._create_embeddings([chunks[i] for i in changed])
+
+            if diff is not None and not diff['changed']:
+                # Same text as last sync: skip the classification call, which
+                # would only read the same excerpt and say the same thing.
+                base_metadata.update(
+                    self._carry_over_module(diff['anchor'], scope_id, conn)
+                )
+            else:
+                # Resolve the module before dropping the old chunks — the lookup for a
+                # prior manual override reads the rows we are about to delete.
+                # On an incremental re-sync only the changed chunks are embedded;
+                # the vector layer votes on the whole document, so the stored
+                # vectors of the unchanged ones join them.
+                document_vectors = list(embeddings)
+                if diff is not None:
+                    document_vectors += [
+                        _deserialize_embedding(row.get('embedding'), as_array=True)
+                        for row in diff['unchanged']
+                    ]
+                base_metadata.update(
+                    self._resolve_module(
+                        doc_id, filename, plain_text, scope_id, conn,
+                        use_llm=not defer_llm, embeddings=document_vectors,
+                    )
+                )
+                if defer_llm and self.module_classifier.needs_llm(base_metadata['sapModuleMethod']):
+                    classification = {
+                        'id': doc_id,
+                        'title': filename,
+                        'text': plain_text[:CLASSIFY_CHAR_LIMIT],
+                    }
+                    if not base_metadata['sapModuleMethod']:
+                        # The free layers found nothing: keep the last LLM verdict
+                        # until classify_deferred replaces it, so a batch that
+                        # fails or never runs leaves the old module, not none.
+                        prior = self._existing_module_override(doc_id, conn, method=METHOD_LLM)
+                        if prior:
+                            base_metadata.update({
+                                'sapModule': prior[0],
+                                'sapModuleConfidence': prior[1],
+                                'sapModuleMethod': prior[2],
+                            })
+
+            if diff is None:
+                # Delete existing chunks for this document
+                self._delete_chunks_for_doc(doc_id, conn, index_changes)
+            else:
+                self._delete_chunk_ids(diff['removed'], conn, index_changes)
+                self._refresh_unchanged_chunks(diff, base_metadata, stored_html, conn)
 
-            for i, chunk in enumerate(chunks):
-                embedding = self._create_embedding(chunk)
+            rows = []
+            for i, embedding in zip(changed, embeddings):
                 chunk_meta = dict(base_metadata)
                 # Only store html_content on the first chunk
                 chunk_meta['html_content'] = stored_html if i == 0 else ''
-                self._insert_chunk(conn, f"{doc_id}_{i}", doc_id, chunk, embedding, chunk_meta)
-
-            conn.commit()
+                rows.append(self._chunk_row(
+                    conn, f"{doc_id}_{i}", doc_id, chunks[i], embedding, chunk_meta
+                ))
+            self._write_chunks(conn, rows, index_changes)
+            document_catalog.refresh(conn, [doc_id])
+
+            corpus_cache.commit(conn)
+            index_changes.apply()
         except Exception as e:
             conn.rollback()
             raise
         finally:
             conn.close()
 
-        return {"status": "success", "chunks": len(chunks), "was_existing": False}
+        result = {
+            "status": "success",
+            "chunks": len(chunks),
+            "was_existing": False,
+            "reembedded": len(changed),
+            "unchanged": len(chunks) - len(changed),
+            "deleted": len(diff['removed']) if diff is not None else 0,
+        }
+        if classification:
+            result["classification"] = classification
+        return result
+
+    def classify_deferred(self, pending, llm_provider='openai') -> int:
+        """The LLM half of ingests run with defer_llm=True, batched.
+
+        pending is the 'classification' items those ingests returned. Writes
+        the summaries, and the module wherever the free layers left none or
+        the last LLM verdict stands in (see ingest_calm_document) — unless a
+        human has set one since. Returns the number of documents updated.
+        """
+        if not pending:
+            return 0
+        answers = self.module_classifier.classify_batch_by_llm(
+            [(item['id'], item.get('title') or '', item.get('text') or '') for item in pending],
+            llm_provider=llm_provider,
+        )
+
+        updated = set()
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                for doc_id, (module, confidence, summary) in answers.items():
+                    if summary:
+                        cur.execute(
+                            "UPDATE documents SET summary = %s WHERE document_id = %s",
+                            (summary, doc_id),
+                        )
+                        if cur.rowcount:
+                            updated.add(doc_id)
+                    if module:
+                        # NULL method: stored unclassified; 'llm': the previous
+                        # verdict, kept meanwhile. Neither corrected since.
+                        cur.execute(
+                            """
+                            UPDATE documents
+                            SET sap_module = %s, sap_module_confidence = %s, sap_module_method = %s
+                            WHERE document_id = %s
+                              AND (sap_module_method IS NULL OR sap_module_method = %s)
+                            """,
+                            (module, confidence, METHOD_LLM, doc_id, METHOD_LLM),
+                        )
+                        if cur.rowcount:
+                            updated.add(doc_id)
+            if updated:
+                document_catalog.refresh(conn, updated)
+                corpus_cache.commit(conn)
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return len(updated)
 
     def add_placeholder_document(self, doc_metadata):
         """Add or update a placeholder document (for synced external files with no content yet)."""
@@ -571,14 +1254,20 @@ class RAGService:
             }
 
             conn = get_conn()
+            index_changes = self.vector_index.changes()
             try:
                 # Scope lookup only: the placeholder text is synthetic boilerplate,
                 # so asking an LLM to classify it would just burn a call on noise.
                 chunk_meta.update(
                     self._resolve_module(doc_id, filename, '', scope_id, conn, use_llm=False)
                 )
-                self._insert_chunk(conn, f"{doc_id}_0", doc_id, placeholder_text, embedding, chunk_meta)
-                conn.commit()
+                self._insert_chunk(
+                    conn, f"{doc_id}_0", doc_id, placeholder_text, embedding, chunk_meta,
+                    index_changes,
+                )
+                document_catalog.refresh(conn, [doc_id])
+                corpus_cache.commit(conn)
+                index_changes.apply()
             finally:
                 conn.close()
 
@@ -590,16 +1279,15 @@ class RAGService:
             return {"status": "error", "error": str(e)}
 
     def get_document_meta(self, doc_id: str) -> dict:
-        """Return stored metadata for a document from any of its chunks."""
+        """Return stored metadata for a document from the catalog."""
         conn = get_conn()
         try:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute(
                     """
                     SELECT document_name, source, doc_type, project, updated_by, updated_on
-                    FROM documents
+                    FROM document_catalog
                     WHERE document_id = %s
-                    LIMIT 1
                     """,
                     (doc_id,),
                 )
@@ -618,7 +1306,7 @@ class RAGService:
         try:
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                 cur.execute(
-                    "SELECT html_content FROM documents WHERE document_id = %s AND html_content != '' AND html_content IS NOT NULL LIMIT 1",
+                    "SELECT html_content FROM document_catalog WHERE document_id = %s",
                     (doc_id,)
                 )
                 row = cur.fetchone()
@@ -680,29 +1368,35 @@ class RAGService:
 
                 chunks = self._chunk_text(text_content, chunk_size=500, overlap=50)
                 doc_id = file.filename
+                embeddings = self._create_embeddings(chunks)
 
                 conn = get_conn()
+                index_changes = self.vector_index.changes()
                 try:
                     # No CALM scope on an upload, so this is an LLM classification.
                     # Resolve once per document, not once per chunk.
                     module_meta = self._resolve_module(
-                        doc_id, file.filename, text_content, None, conn
+                        doc_id, file.filename, text_content, None, conn,
+                        embeddings=embeddings,
                     )
-                    for i, chunk in enumerate(chunks):
-                        embedding = self._create_embedding(chunk)
-                        metadata = {
-                            'source': 'File Upload',
-                            'type': self._get_file_type(file.filename),
-                            'project': 'N/A',
-                            'updatedBy': 'System',
-                            'updatedOn': 'N/A',
-                            'document_name': file.filename,
-                            'is_placeholder': False,
-                            'html_content': '',
-                            **module_meta,
-                        }
-                        self._insert_chunk(conn, f"{doc_id}_{i}", doc_id, chunk, embedding, metadata)
-                    conn.commit()
+                    metadata = {
+                        'source': 'File Upload',
+                        'type': self._get_file_type(file.filename),
+                        'project': 'N/A',
+                        'updatedBy': 'System',
+                        'updatedOn': 'N/A',
+                        'document_name': file.filename,
+                        'is_placeholder': False,
+                        'html_content': '',
+                        **module_meta,
+                    }
+                    self._write_chunks(conn, [
+                        self._chunk_row(conn, f"{doc_id}_{i}", doc_id, chunk, embedding, metadata)
+                        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+                    ], index_changes)
+                    document_catalog.refresh(conn, [doc_id])
+                    corpus_cache.commit(conn)
+                    index_changes.apply()
                 except Exception:
                     conn.rollback()
                     raise
@@ -749,30 +1443,37 @@ class RAGService:
         is_duplicate = self.check_duplicate(doc_name)
         chunks = self._chunk_text(content, chunk_size=500, overlap=50)
         doc_id = doc_name
+        embeddings = self._create_embeddings(chunks)
 
         conn = get_conn()
+        index_changes = self.vector_index.changes()
         try:
             # Resolve before deleting: the manual-override lookup reads existing rows.
-            module_meta = self._resolve_module(doc_id, doc_name, content, None, conn)
+            module_meta = self._resolve_module(
+                doc_id, doc_name, content, None, conn, embeddings=embeddings
+            )
 
             if is_duplicate:
-                self._delete_chunks_for_doc(doc_id, conn)
-
-            for i, chunk in enumerate(chunks):
-                embedding = self._create_embedding(chunk)
-                metadata = {
-                    'source': source,
-                    'type': doc_type,
-                    'project': project,
-                    'updatedBy': updated_by,
-                    'updatedOn': datetime.now().isoformat(),
-                    'document_name': doc_name,
-                    'is_placeholder': False,
-                    'html_content': '',
-                    **module_meta,
-                }
-                self._insert_chunk(conn, f'{doc_id}_{i}', doc_id, chunk, embedding, metadata)
-            conn.commit()
+                self._delete_chunks_for_doc(doc_id, conn, index_changes)
+
+            metadata = {
+                'source': source,
+                'type': doc_type,
+                'project': project,
+                'updatedBy': updated_by,
+                'updatedOn': datetime.now().isoformat(),
+                'document_name': doc_name,
+                'is_placeholder': False,
+                'html_content': '',
+                **module_meta,
+            }
+            self._write_chunks(conn, [
+                self._chunk_row(conn, f'{doc_id}_{i}', doc_id, chunk, embedding, metadata)
+                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+            ], index_changes)
+            document_catalog.refresh(conn, [doc_id])
+            corpus_cache.commit(conn)
+            index_changes.apply()
         except Exception:
             conn.rollback()
             raise
@@ -786,104 +1487,244 @@ class RAGService:
             'was_duplicate': is_duplicate,
         }
 
-    def query(self, query_text, top_k=5, custom_prompt=None, llm_provider='openai'):
+    # Extra candidates asked of the index, so chunks another process deleted
+    # since its last refresh can be dropped without coming up short of top_k.
+    INDEX_OVERFETCH = 10
+
+    def _index_search(self, conn, query_embedding, top_k, filters=None, exclude=None):
+        """Top-k chunk rows via the in-memory vector index.
+
+        filters ({column: accepted values}, see _index_filters) restrict the
+        search to the matching chunks; exclude is chunk ids to leave out.
+        Returns None while the index is still warming up (or failed to load),
+        in which case the caller falls back to _scan_search.
+        """
+        # Idempotent; covers processes that never called start_vector_index().
+        self.vector_index.warm_up()
+        hits = self.vector_index.search(
+            query_embedding, top_k + self.INDEX_OVERFETCH, filters=filters, exclude=exclude
+        )
+        if hits is None:
+            return None
+        if not hits:
+            return []
+
+        return self._fetch_ranked_rows(conn, hits, top_k)
+
+    def _fetch_ranked_rows(self, conn, hits, top_k):
+        """Second retrieval phase: full rows for ranked (chunk_id, score) hits.
+
+        Ids that no longer exist are dropped; the rest keep the hits' order.
+        """
+        if not hits:
+            return []
+        ids = [chunk_id for chunk_id, _ in hits]
+        cursor_factory = None if self._is_sqlite(conn) else psycopg2.extras.RealDictCursor
+        with conn.cursor(cursor_factory=cursor_factory) as cur:
+            cur.execute(
+                "SELECT id, content, source, doc_type, project, document_name, web_url, document_id "
+                f"FROM documents WHERE id IN ({', '.join(['%s'] * len(ids))})",
+                ids,
+            )
+            found = {row['id']: dict(row) for row in cur.fetchall()}
+
+        rows = []
+        for chunk_id, score in hits:
+            row = found.get(chunk_id)
+            if row is None:
+                continue
+            row['score'] = score
+            rows.append(row)
+            if len(rows) == top_k:
+                break
+        return rows
+
+    # Rows per round trip in the exact scan. Only ids and vectors travel, so a
+    # batch is ~6 MB of binary embeddings at most.
+    SCAN_BATCH_SIZE = 1000
+
+    def _scan_search(self, conn, query_embedding, top_k, filter_clauses=(), filter_params=()):
+        """Top-k chunk rows by exact cosine similarity over every stored embedding
+        (or every one matching the retrieval filters).
+
+        Two phases, so chunk text never leaves the database for rows that lose:
+        a narrow scan of (id, embedding, embedding_model) streamed in batches
+        into a bounded top-k heap, then _fetch_ranked_rows for the winners only.
+        """
+        # App-side cosine similarity (SQLite or Postgres without pgvector).
+        # CF Hyperscaler Postgres typically has no pgvector, so this is the
+        # production path there — Document Hub can still list rows while
+        # Ask Yoda returned references: [] when row shaping was wrong.
+        query_vector = np.asarray(query_embedding, dtype=np.float32)
+        query_norm = float(np.linalg.norm(query_vector))
+        if not query_norm or top_k <= 0:
+            return []
+
+        where = f" WHERE {' AND '.join(filter_clauses)}" if filter_clauses else ""
+        sql = "SELECT id, embedding, embedding_model FROM documents" + where
+
+        heap = []           # (score, id) min-heap holding the best top_k so far
+        scanned = 0
+        skipped = 0
+        mismatched = 0
+        if self._is_sqlite(conn):
+            cur = conn.cursor()
+        else:
+            # Named cursor: Postgres keeps the result server-side and hands it
+            # over SCAN_BATCH_SIZE rows at a time, instead of psycopg2
+            # buffering the whole table client-side on execute().
+            cur = conn.cursor(name="yoda_vector_scan")
+            cur.itersize = self.SCAN_BATCH_SIZE
+        try:
+            cur.execute(sql, list(filter_params))
+            while True:
+                # Plain cursor: tuples on Postgres, sqlite3.Row on SQLite —
+                # both index by position.
+                batch = cur.fetchmany(self.SCAN_BATCH_SIZE)
+                if not batch:
+                    break
+                scanned += len(batch)
+                ids, vectors = [], []
+                for row in batch:
+                    # Only compare vectors from the same model. NULL means a
+                    # historical row, all of which used the current model, so
+                    # it is compatible; a different non-null model is not, and
+                    # scoring across it would return plausible-looking nonsense.
+                    stored_model = row[2]
+                    if stored_model and stored_model != self.EMBEDDING_MODEL:
+                        mismatched += 1
+                        continue
+                    # Must go through the shared helper: psycopg2 returns bytea
+                    # as a memoryview, which is neither bytes nor a list.
+                    vector = _deserialize_embedding(row[1], as_array=True)
+                    if vector is None or len(vector) != len(query_vector):
+                        skipped += 1
+                        continue
+                    ids.append(row[0])
+                    vectors.append(vector)
+                if not ids:
+                    continue
+
+                matrix = np.asarray(vectors, dtype=np.float32)
+                norms = np.linalg.norm(matrix, axis=1)
+                norms[norms == 0] = np.inf  # a zero vector scores 0
+                scores = (matrix @ query_vector) / (norms * query_norm)
+                for chunk_id, score in zip(ids, scores.tolist()):
+                    if len(heap) < top_k:
+                        heapq.heappush(heap, (score, chunk_id))
+                    elif score > heap[0][0]:
+                        heapq.heapreplace(heap, (score, chunk_id))
+        finally:
+            cur.close()
+
+        if mismatched:
+            print(
+                f"WARNING: {mismatched} row(s) skipped — embedded with a different "
+                f"model than '{self.EMBEDDING_MODEL}'. Re-embed them to make them "
+                "searchable again."
+            )
+
+        if not heap:
+            print(
+                f"WARNING: app-side vector search matched 0/{scanned} rows "
+                f"(skipped={skipped}). Check embeddings / OPENAI_API_KEY / BYTEA JSON."
+            )
+
+        hits = [(chunk_id, score) for score, chunk_id in sorted(heap, reverse=True)]
+        return self._fetch_ranked_rows(conn, hits, top_k)
+
+    # Filters query() accepts. Text filters take one value or a list of values;
+    # the flags take a bool.
+    RETRIEVAL_TEXT_FILTERS = ('project_id', 'sap_module', 'doc_type')
+    RETRIEVAL_FLAG_FILTERS = ('is_latest', 'is_placeholder')
+
+    def _retrieval_filter_sql(self, filters):
+        """WHERE clauses and params for query() filters. Empty when unfiltered.
+
+        Unknown keys are ignored and None means "don't filter". NULL flags are
+        read the way the rest of the code reads them: historical rows with no
+        is_latest are the latest version, and no is_placeholder means real content.
+        """
+        clauses, params = [], []
+        for column in self.RETRIEVAL_TEXT_FILTERS:
+            value = (filters or {}).get(column)
+            if value is None or value == '' or value == []:
+                continue
+            values = [str(v) for v in value] if isinstance(value, (list, tuple, set)) else [str(value)]
+            clauses.append(f"{column} IN ({', '.join(['%s'] * len(values))})")
+            params += values
+        for column, null_means in (('is_latest', True), ('is_placeholder', False)):
+            value = (filters or {}).get(column)
+            if value is None:
+                continue
+            value = bool(value)
+            if value == null_means:
+                clauses.append(f"({column} = %s OR {column} IS NULL)")
+            else:
+                clauses.append(f"{column} = %s")
+            params.append(value)
+        return clauses, params
+
+    def _index_filters(self, filters):
+        """query() filters as the vector index takes them: {column: accepted
+        values}, read the same way as _retrieval_filter_sql. None when unfiltered."""
+        index_filters = {}
+        for column in self.RETRIEVAL_TEXT_FILTERS:
+            value = (filters or {}).get(column)
+            if value is None or value == '' or value == []:
+                continue
+            values = value if isinstance(value, (list, tuple, set)) else [value]
+            index_filters[column] = {str(v) for v in values}
+        for column in self.RETRIEVAL_FLAG_FILTERS:
+            value = (filters or {}).get(column)
+            if value is not None:
+                index_filters[column] = {bool(value)}
+        return index_filters or None
+
+    def query(self, query_text, top_k=5, custom_prompt=None, llm_provider='openai', filters=None):
         """Query the RAG system using cosine similarity search.
+
+        Args:
+            filters: optional dict narrowing retrieval before ranking — any of
+                project_id, sap_module, doc_type (a value or list of values) and
+                is_latest, is_placeholder (bool). See _retrieval_filter_sql.
         
         Returns:
             dict with 'answer' (str) and 'references' (list of source doc dicts)
         """
         query_embedding = self._create_embedding(query_text)
+        filter_clauses, filter_params = self._retrieval_filter_sql(filters)
 
         conn = get_conn()
         app_side = self._use_app_side_vectors(conn)
         
         try:
             if app_side:
-                # Python-based cosine similarity (SQLite or Postgres without pgvector).
-                # CF Hyperscaler Postgres typically has no pgvector, so this is the
-                # production path there — Document Hub can still list rows while
-                # Ask Yoda returned references: [] when row shaping was wrong.
-                import math
-
-                def cosine_similarity(v1, v2):
-                    dot_product = sum(a * b for a, b in zip(v1, v2))
-                    magnitude1 = math.sqrt(sum(a * a for a in v1))
-                    magnitude2 = math.sqrt(sum(b * b for b in v2))
-                    if not magnitude1 or not magnitude2:
-                        return 0
-                    return dot_product / (magnitude1 * magnitude2)
-
-                # RealDictCursor is required on Postgres: a plain cursor yields
-                # tuples, and dict(tuple) raises for every row — which the except
-                # below used to swallow, leaving scored_rows empty and the LLM
-                # with no context. SQLite already returns sqlite3.Row via row_factory.
-                cursor_factory = (
-                    None if self._is_sqlite(conn) else psycopg2.extras.RealDictCursor
+                # The index filters from its own labels; no SELECT of the
+                # matching ids per question.
+                rows = self._index_search(
+                    conn, query_embedding, top_k, filters=self._index_filters(filters)
                 )
-                with conn.cursor(cursor_factory=cursor_factory) as cur:
-                    cur.execute(
-                        "SELECT content, source, doc_type, project, document_name, "
-                        "web_url, document_id, embedding, embedding_model FROM documents"
-                    )
-                    all_rows = cur.fetchall()
-
-                scored_rows = []
-                skipped = 0
-                mismatched = 0
-                for row in all_rows:
-                    try:
-                        row_dict = dict(row)
-                        # Only compare vectors from the same model. NULL means a
-                        # historical row, all of which used the current model, so
-                        # it is compatible; a different non-null model is not, and
-                        # scoring across it would return plausible-looking nonsense.
-                        stored_model = row_dict.get('embedding_model')
-                        if stored_model and stored_model != self.EMBEDDING_MODEL:
-                            mismatched += 1
-                            continue
-                        # Must go through the shared helper: psycopg2 returns bytea
-                        # as a memoryview, which is neither bytes nor a list, and
-                        # passing it straight to cosine_similarity() multiplies
-                        # floats by single characters. That raises, this except
-                        # swallows it, every row gets skipped, and retrieval
-                        # silently returns nothing at all.
-                        emb_list = _deserialize_embedding(row_dict.get('embedding'))
-                        if emb_list:
-                            score = cosine_similarity(query_embedding, emb_list)
-                            row_dict['score'] = score
-                            scored_rows.append(row_dict)
-                        else:
-                            skipped += 1
-                    except Exception as e:
-                        skipped += 1
-                        print(f"WARNING: skipping row in similarity search: {e}")
-
-                if mismatched:
-                    print(
-                        f"WARNING: {mismatched} row(s) skipped — embedded with a different "
-                        f"model than '{self.EMBEDDING_MODEL}'. Re-embed them to make them "
-                        "searchable again."
+                if rows is None:
+                    rows = self._scan_search(
+                        conn, query_embedding, top_k, filter_clauses, filter_params
                     )
-
-                if not scored_rows:
-                    print(
-                        f"WARNING: app-side vector search matched 0/{len(all_rows)} rows "
-                        f"(skipped={skipped}). Check embeddings / OPENAI_API_KEY / BYTEA JSON."
-                    )
-
-                # Sort by score descending
-                scored_rows.sort(key=lambda x: x.get('score', 0), reverse=True)
-                rows = scored_rows[:top_k]
             else:
+                # Same model guard as the app-side paths: a vector from another
+                # model is not comparable. NULL is a historical row from the
+                # current model. The filters narrow the scan through the btree
+                # indexes on these columns before the vector ordering applies.
+                where = ["(embedding_model = %s OR embedding_model IS NULL)"] + filter_clauses
                 with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
                     cur.execute(
-                        """
+                        f"""
                         SELECT content, source, doc_type, project, document_name, web_url, document_id
                         FROM documents
+                        WHERE {" AND ".join(where)}
                         ORDER BY embedding <=> %s::vector
                         LIMIT %s
                         """,
-                        (query_embedding, top_k)
+                        [self.EMBEDDING_MODEL] + filter_params + [query_embedding, top_k]
                     )
                     rows = cur.fetchall()
         finally:
@@ -969,185 +1810,183 @@ class RAGService:
         )
         return {"answer": answer, "references": references}
 
-    # Sort keys the API accepts, mapped to SQL. An allowlist, because these go
-    # into the query as text and can never be parameterized.
+    # Sort keys the API accepts, as (column, descending) pairs. An allowlist,
+    # because these go into the query as text and can never be parameterized.
+    # NULLs always sort last, and document_id breaks ties, so every ordering is
+    # total — which keyset pagination needs to resume exactly where it stopped.
     SORT_OPTIONS = {
         # Default: most recently synced first. Sorting on updated_on instead
         # means a project whose CALM documents were last touched years ago lands
         # pages deep the moment it is synced, which reads as "sync is broken".
-        'synced': 'synced_on DESC NULLS LAST, updated_on DESC NULLS LAST',
+        'synced': (('synced_on', True), ('updated_on', True)),
         # Last changed in the source system.
-        'updated': 'updated_on DESC NULLS LAST',
-        'name': 'document_name ASC',
+        'updated': (('updated_on', True),),
+        'name': (('document_name', False),),
     }
     DEFAULT_SORT = 'synced'
 
+    @staticmethod
+    def _sort_keys(sort: str) -> tuple:
+        keys = RAGService.SORT_OPTIONS.get(sort) or RAGService.SORT_OPTIONS[RAGService.DEFAULT_SORT]
+        return keys + (('document_id', False),)
+
+    @staticmethod
+    def _encode_cursor(sort: str, row: dict) -> str:
+        """Opaque continuation token: the sort and the last row's sort key."""
+        values = []
+        for column, _ in RAGService._sort_keys(sort):
+            value = row.get(column)
+            # Timestamps round-trip as text; both backends compare them to it.
+            values.append(str(value) if isinstance(value, datetime) else value)
+        payload = json.dumps({'sort': sort, 'after': values}, separators=(',', ':'))
+        return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii')
+
+    @staticmethod
+    def _decode_cursor(cursor: str, sort: str) -> list:
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+            values = payload['after']
+        except Exception:
+            raise ValueError("Invalid cursor")
+        if payload.get('sort') != sort or len(values) != len(RAGService._sort_keys(sort)):
+            raise ValueError("Cursor does not match the requested sort")
+        return values
+
+    @staticmethod
+    def _keyset_clause(sort: str, values: list):
+        """WHERE clause selecting the rows that sort after `values`.
+
+        Expanded by hand rather than written as a row comparison, because the
+        columns mix directions and may be NULL (NULLs sort last).
+        """
+        terms, params = [], []
+        equal_sql, equal_params = [], []
+        for (column, descending), value in zip(RAGService._sort_keys(sort), values):
+            if value is not None:
+                # Past a NULL there is nothing but more NULLs.
+                after = f"({column} {'<' if descending else '>'} %s OR {column} IS NULL)"
+                terms.append("(" + " AND ".join(equal_sql + [after]) + ")")
+                params += equal_params + [value]
+                equal_sql.append(f"{column} = %s")
+                equal_params.append(value)
+            else:
+                equal_sql.append(f"{column} IS NULL")
+        return "(" + (" OR ".join(terms) or "1 = 0") + ")", params
+
+    @corpus_cache.corpus_cached()
     def list_documents(self, page: int = 1, page_size: int = 10, search: str = '',
                        source: str = '', doc_type: str = '', project: str = '',
                        module: str = '', date_from: str = '', date_to: str = '',
-                       latest_only: bool = True, sort: str = DEFAULT_SORT):
+                       latest_only: bool = True, sort: str = DEFAULT_SORT,
+                       cursor: str = None):
         """List unique documents with optional filtering and pagination.
 
-        Returns a dict with keys: documents (list), total (int), page (int), page_size (int), total_pages (int).
+        Cached until the corpus next changes; that includes the first page
+        query() injects as its document index.
+
+        Pages by OFFSET from `page`, or — when `cursor` is a next_cursor from a
+        previous call with the same filters and sort — by keyset, which costs
+        the same however deep the page is. `page` is then only echoed back.
+
+        Returns a dict with keys: documents (list), total (int), page (int),
+        page_size (int), total_pages (int), next_cursor (str, None on the last page).
+
+        Raises ValueError for a cursor that is malformed or from another sort.
         """
         page = max(1, page)
         page_size = min(max(1, page_size), 100)
         offset = (page - 1) * page_size
-        order_sql = self.SORT_OPTIONS.get(sort, self.SORT_OPTIONS[self.DEFAULT_SORT])
+        if sort not in self.SORT_OPTIONS:
+            sort = self.DEFAULT_SORT
+        order_sql = ", ".join(
+            f"{column} {'DESC' if descending else 'ASC'} NULLS LAST"
+            for column, descending in self._sort_keys(sort)
+        )
+        after = self._decode_cursor(cursor, sort) if cursor else None
+        next_cursor = None
 
         conn = None
         try:
             conn = get_conn()
-            if self._is_sqlite(conn):
-                # ── SQLite path ──────────────────────────────────────────────
-                where_clauses = []
-                params: list = []
-
-                if search:
-                    where_clauses.append("(document_name LIKE ? OR document_id LIKE ?)")
-                    like = f"%{search}%"
-                    params += [like, like]
-                if source:
-                    where_clauses.append("source = ?")
-                    params.append(source)
-                if doc_type:
-                    where_clauses.append("doc_type = ?")
-                    params.append(doc_type)
-                if project:
-                    where_clauses.append("project = ?")
-                    params.append(project)
-                if module:
-                    where_clauses.append("sap_module = ?")
-                    params.append(module)
-                if date_from:
-                    where_clauses.append("updated_on >= ?")
-                    params.append(date_from)
-                if date_to:
-                    where_clauses.append("updated_on <= ?")
-                    params.append(date_to + "T23:59:59")
-                if latest_only:
+            is_sqlite = self._is_sqlite(conn)
+            where_clauses = []
+            params: list = []
+
+            if search:
+                search_sql, search_params = document_catalog.search_clause(conn, search)
+                where_clauses.append(search_sql)
+                params += search_params
+            if source:
+                where_clauses.append("source = %s")
+                params.append(source)
+            if doc_type:
+                where_clauses.append("doc_type = %s")
+                params.append(doc_type)
+            if project:
+                where_clauses.append("project = %s")
+                params.append(project)
+            if module:
+                where_clauses.append("sap_module = %s")
+                params.append(module)
+            if date_from:
+                where_clauses.append("updated_on >= %s")
+                params.append(date_from)
+            if date_to:
+                where_clauses.append("updated_on <= %s")
+                params.append(date_to + "T23:59:59")
+            if latest_only:
+                if is_sqlite:
                     where_clauses.append("(is_latest = 1 OR is_latest IS NULL)")
+                else:
+                    where_clauses.append("(is_latest = TRUE OR is_latest IS NULL)")
 
-                where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
-
-                with conn.cursor() as cur:
-                    cur.execute(
-                        f"""
-                        SELECT COUNT(DISTINCT document_id) AS total
-                        FROM documents
-                        {where_sql}
-                        """,
-                        params,
-                    )
-                    total = cur.fetchone()[0] or 0
+            where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
 
-                    cur.execute(
-                        f"""
-                        SELECT
-                            document_id, document_name, source, doc_type, project,
-                            updated_by, updated_on, web_url, uuid, display_id,
-                            version, is_latest, calm_display_id,
-                            sap_module, sap_module_confidence, sap_module_method,
-                            synced_on, summary,
-                            MAX(length(content)) AS content_len,
-                            COUNT(*) AS chunk_count
-                        FROM documents
-                        {where_sql}
-                        GROUP BY document_id
-                        ORDER BY {order_sql}
-                        LIMIT ? OFFSET ?
-                        """,
-                        params + [page_size, offset],
-                    )
-                    rows = [dict(row) for row in cur.fetchall()]
-            else:
-                # ── PostgreSQL path ──────────────────────────────────────────
-                where_clauses = []
-                params = []
-
-                if search:
-                    where_clauses.append("(d.document_name ILIKE %s OR d.document_id ILIKE %s)")
-                    like = f"%{search}%"
-                    params += [like, like]
-                if source:
-                    where_clauses.append("d.source = %s")
-                    params.append(source)
-                if doc_type:
-                    where_clauses.append("d.doc_type = %s")
-                    params.append(doc_type)
-                if project:
-                    where_clauses.append("d.project = %s")
-                    params.append(project)
-                if module:
-                    where_clauses.append("d.sap_module = %s")
-                    params.append(module)
-                if date_from:
-                    where_clauses.append("d.updated_on >= %s")
-                    params.append(date_from)
-                if date_to:
-                    where_clauses.append("d.updated_on <= %s")
-                    params.append(date_to + "T23:59:59")
-                if latest_only:
-                    where_clauses.append("(d.is_latest = TRUE OR d.is_latest IS NULL)")
-
-                where_sql = ("WHERE " + " AND ".join(where_clauses)) if where_clauses else ""
+            # One catalog row per document, so neither query has to collapse
+            # chunks: the count is a plain COUNT(*) and the page an indexed sort.
+            cursor_factory = None if is_sqlite else psycopg2.extras.RealDictCursor
+            with conn.cursor(cursor_factory=cursor_factory) as cur:
+                cur.execute(
+                    f"SELECT COUNT(*) AS total FROM document_catalog {where_sql}",
+                    params,
+                )
+                total_row = cur.fetchone()
+                total = (total_row[0] if is_sqlite else total_row.get('total')) or 0
 
-                with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
-                    # Total count of distinct documents matching the filter
-                    cur.execute(
-                        f"""
-                        SELECT COUNT(*) AS total FROM (
-                            SELECT 1 FROM documents d
-                            {where_sql}
-                            GROUP BY d.document_id
-                        ) sub
-                        """,
-                        params,
-                    )
-                    total = (cur.fetchone() or {}).get('total') or 0
+                page_clauses, page_params = list(where_clauses), list(params)
+                if after is not None:
+                    keyset_sql, keyset_params = self._keyset_clause(sort, after)
+                    page_clauses.append(keyset_sql)
+                    page_params += keyset_params
+                    offset = 0
+                page_where = ("WHERE " + " AND ".join(page_clauses)) if page_clauses else ""
 
-                    # Paginated page using a CTE so DISTINCT ON + ORDER/LIMIT work cleanly
-                    cur.execute(
-                        f"""
-                        WITH unique_docs AS (
-                            SELECT DISTINCT ON (d.document_id)
-                                d.document_id,
-                                d.document_name,
-                                d.source,
-                                d.doc_type,
-                                d.project,
-                                d.updated_by,
-                                d.updated_on,
-                                d.web_url,
-                                d.uuid,
-                                d.display_id,
-                                d.version,
-                                d.is_latest,
-                                d.calm_display_id,
-                                d.sap_module,
-                                d.sap_module_confidence,
-                                d.sap_module_method,
-                                d.synced_on,
-                                d.summary,
-                                length(d.content) AS content_len,
-                                (SELECT COUNT(*)::int FROM documents d2
-                                 WHERE d2.document_id IS NOT DISTINCT FROM d.document_id) AS chunk_count
-                            FROM documents d
-                            {where_sql}
-                            ORDER BY d.document_id, d.id
-                        )
-                        SELECT * FROM unique_docs
-                        ORDER BY {order_sql}
-                        LIMIT %s OFFSET %s
-                        """,
-                        params + [page_size, offset],
-                    )
-                    rows = cur.fetchall()
+                # One row more than the page, to know whether another follows.
+                cur.execute(
+                    f"""
+                    SELECT
+                        document_id, document_name, source, doc_type, project,
+                        updated_by, updated_on, web_url, uuid, display_id,
+                        version, is_latest, calm_display_id,
+                        sap_module, sap_module_confidence, sap_module_method,
+                        synced_on, summary, content_length, chunk_count
+                    FROM document_catalog
+                    {page_where}
+                    ORDER BY {order_sql}
+                    LIMIT %s OFFSET %s
+                    """,
+                    page_params + [page_size + 1, offset],
+                )
+                rows = [dict(row) for row in cur.fetchall()]
+                if len(rows) > page_size:
+                    rows = rows[:page_size]
+                    next_cursor = self._encode_cursor(sort, rows[-1])
 
         except Exception as e:
             print(f"Error listing documents: {e}")
             import traceback
             traceback.print_exc()
+            corpus_cache.uncacheable()
             rows = []
             total = 0
         finally:
@@ -1157,10 +1996,9 @@ class RAGService:
         doc_list = []
         try:
             for row in rows:
-                content_len = row.get('content_len') or 0
+                size = int(row.get('content_length') or 0)
                 chunk_count = int(row.get('chunk_count') or 1)
-                estimated_size = content_len * chunk_count
-                size_kb = estimated_size / 1024
+                size_kb = size / 1024
                 uid = row.get('uuid')
                 if uid is not None and hasattr(uid, 'hex'):
                     uid = str(uid)
@@ -1182,7 +2020,7 @@ class RAGService:
                     'version': row.get('version') or 1,
                     'isLatest': row.get('is_latest') if row.get('is_latest') is not None else True,
                     'displayId': row.get('calm_display_id') or row.get('display_id') or '',
-                    'size': f"{size_kb:.1f} KB" if size_kb >= 1 else f"{estimated_size} bytes",
+                    'size': f"{size_kb:.1f} KB" if size_kb >= 1 else f"{size} bytes",
                     'chunks': chunk_count,
                     'sapModule': module_code,
                     'sapModuleLabel': MODULE_LABELS.get(module_code, module_code),
@@ -1207,8 +2045,10 @@ class RAGService:
             'page': page,
             'page_size': page_size,
             'total_pages': max(1, total_pages),
+            'next_cursor': next_cursor,
         }
 
+    @corpus_cache.corpus_cached()
     def get_document_stats(self, project: str = '', module: str = '',
                            latest_only: bool = True) -> dict:
         """Aggregate document counts for the dashboard drill-down.
@@ -1217,6 +2057,9 @@ class RAGService:
         applies to documents_by_type only, so selecting a module narrows the type
         breakdown while the module chart it was clicked from stays put.
 
+        Cached per filter combination until the corpus next changes, so
+        drill-down clicks between syncs do not re-scan the catalog.
+
         Returns:
             documents_by_type: [{type, count}, ...]  — respects project + module
             documents_by_module: [{module, label, count}, ...] — respects project
@@ -1225,112 +2068,13 @@ class RAGService:
             total_documents: distinct documents matching project + module
             project / module: the active filters, echoed back
         """
-        conn = None
         try:
-            conn = get_conn()
-            is_sqlite = self._is_sqlite(conn)
-            placeholder = '?' if is_sqlite else '%s'
-
-            # Shared by every aggregate below.
-            base_clauses = []
-            base_params: list = []
-
-            if project:
-                base_clauses.append(f"project = {placeholder}")
-                base_params.append(project)
-            if latest_only:
-                if is_sqlite:
-                    base_clauses.append("(is_latest = 1 OR is_latest IS NULL)")
-                else:
-                    base_clauses.append("(is_latest = TRUE OR is_latest IS NULL)")
-
-            base_sql = ("WHERE " + " AND ".join(base_clauses)) if base_clauses else ""
-
-            # Type breakdown and totals additionally honour the module drill-down.
-            typed_clauses = list(base_clauses)
-            typed_params = list(base_params)
-            if module:
-                typed_clauses.append(f"sap_module = {placeholder}")
-                typed_params.append(module)
-            typed_sql = ("WHERE " + " AND ".join(typed_clauses)) if typed_clauses else ""
-
-            cursor_factory = None if is_sqlite else psycopg2.extras.RealDictCursor
-            with conn.cursor(cursor_factory=cursor_factory) as cur:
-                cur.execute(
-                    f"""
-                    SELECT doc_type, COUNT(DISTINCT document_id) AS count
-                    FROM documents
-                    {typed_sql}
-                    GROUP BY doc_type
-                    ORDER BY count DESC
-                    """,
-                    typed_params,
-                )
-                rows = cur.fetchall()
-
-                cur.execute(
-                    f"""
-                    SELECT sap_module, COUNT(DISTINCT document_id) AS count
-                    FROM documents
-                    {base_sql}
-                    GROUP BY sap_module
-                    ORDER BY count DESC
-                    """,
-                    base_params,
-                )
-                module_rows = cur.fetchall()
-
-                cur.execute(
-                    f"""
-                    SELECT COUNT(DISTINCT document_id) AS total
-                    FROM documents
-                    {typed_sql}
-                    """,
-                    typed_params,
-                )
-                total_row = cur.fetchone()
-                if is_sqlite:
-                    total_documents = (total_row[0] if total_row else 0) or 0
-                else:
-                    total_documents = (total_row or {}).get('total') or 0
-
-                # Low-confidence guesses a human should confirm.
-                review_clauses = list(typed_clauses) + [
-                    f"sap_module_method = {placeholder}",
-                    f"(sap_module_confidence IS NULL OR sap_module_confidence < {placeholder})",
-                ]
-                review_params = list(typed_params) + [METHOD_LLM, REVIEW_CONFIDENCE_THRESHOLD]
-                cur.execute(
-                    f"""
-                    SELECT COUNT(DISTINCT document_id) AS total
-                    FROM documents
-                    WHERE {" AND ".join(review_clauses)}
-                    """,
-                    review_params,
-                )
-                review_row = cur.fetchone()
-                if is_sqlite:
-                    needs_review = (review_row[0] if review_row else 0) or 0
-                else:
-                    needs_review = (review_row or {}).get('total') or 0
-
-                # Always return full project list for the filter dropdown
-                cur.execute(
-                    """
-                    SELECT DISTINCT project
-                    FROM documents
-                    WHERE project IS NOT NULL
-                      AND TRIM(project) <> ''
-                      AND project <> 'N/A'
-                    ORDER BY project
-                    """
-                )
-                project_rows = cur.fetchall()
-
+            return self._compute_document_stats(project, module, latest_only)
         except Exception as e:
             print(f"Error computing document stats: {e}")
             import traceback
             traceback.print_exc()
+            corpus_cache.uncacheable()
             return {
                 'documents_by_type': [],
                 'documents_by_module': [],
@@ -1340,54 +2084,144 @@ class RAGService:
                 'project': project or '',
                 'module': module or '',
             }
-        finally:
-            if conn:
-                conn.close()
 
-        documents_by_type = []
-        for row in rows:
-            if is_sqlite:
-                doc_type = row[0]
-                count = row[1]
-            else:
-                doc_type = row.get('doc_type')
-                count = row.get('count')
-            documents_by_type.append({
-                'type': doc_type or 'Unknown',
-                'count': int(count or 0),
-            })
+    def _compute_document_stats(self, project: str, module: str, latest_only: bool) -> dict:
+        """Every figure of get_document_stats from one pass over the catalog.
 
-        documents_by_module = []
-        for row in module_rows:
-            if is_sqlite:
-                code = row[0]
-                count = row[1]
+        Postgres groups by GROUPING SETS, one set per breakdown, with the
+        filters applied per aggregate rather than in WHERE — the project
+        dropdown lists every project, so the scan cannot be narrowed. SQLite
+        has no GROUPING SETS: it groups once by every dimension involved and
+        rolls up in Python. Either way the catalog is read once.
+        """
+        conn = get_conn()
+        try:
+            if self._is_sqlite(conn):
+                by_type, by_module, total, needs_review, projects = \
+                    self._stats_rollup_sqlite(conn, project, module, latest_only)
             else:
-                code = row.get('sap_module')
-                count = row.get('count')
-            code = code or UNCLASSIFIED
-            documents_by_module.append({
-                'module': code,
-                'label': MODULE_LABELS.get(code, code),
-                'count': int(count or 0),
-            })
+                by_type, by_module, total, needs_review, projects = \
+                    self._stats_grouping_sets(conn, project, module, latest_only)
+        finally:
+            conn.close()
 
-        projects = []
-        for row in project_rows:
-            name = row[0] if is_sqlite else row.get('project')
-            if name:
-                projects.append(name)
+        # NULL and the explicit default are the same bucket on the dashboard.
+        type_counts, module_counts = {}, {}
+        for doc_type, count in by_type.items():
+            type_counts[doc_type or 'Unknown'] = type_counts.get(doc_type or 'Unknown', 0) + count
+        for code, count in by_module.items():
+            module_counts[code or UNCLASSIFIED] = module_counts.get(code or UNCLASSIFIED, 0) + count
+
+        documents_by_type = [
+            {'type': doc_type, 'count': int(count)}
+            for doc_type, count in sorted(type_counts.items(), key=lambda kv: -kv[1])
+            if count
+        ]
+        documents_by_module = [
+            {'module': code, 'label': MODULE_LABELS.get(code, code), 'count': int(count)}
+            for code, count in sorted(module_counts.items(), key=lambda kv: -kv[1])
+            if count
+        ]
 
         return {
             'documents_by_type': documents_by_type,
             'documents_by_module': documents_by_module,
             'needs_review': int(needs_review),
-            'projects': projects,
-            'total_documents': int(total_documents),
+            'projects': sorted(projects),
+            'total_documents': int(total),
             'project': project or '',
             'module': module or '',
         }
 
+    @staticmethod
+    def _listed_project(name) -> bool:
+        """Whether a project name belongs in the dashboard's filter dropdown."""
+        return bool(name) and bool(name.strip()) and name != 'N/A'
+
+    def _stats_grouping_sets(self, conn, project, module, latest_only):
+        in_scope = ["TRUE"]
+        in_scope_params: list = []
+        if project:
+            in_scope.append("project = %s")
+            in_scope_params.append(project)
+        if latest_only:
+            in_scope.append("(is_latest = TRUE OR is_latest IS NULL)")
+        typed = list(in_scope)
+        typed_params = list(in_scope_params)
+        if module:
+            typed.append("sap_module = %s")
+            typed_params.append(module)
+        review = typed + [
+            "sap_module_method = %s",
+            "(sap_module_confidence IS NULL OR sap_module_confidence < %s)",
+        ]
+        review_params = typed_params + [METHOD_LLM, REVIEW_CONFIDENCE_THRESHOLD]
+
+        with conn.cursor() as cur:
+            cur.execute(
+                f"""
+                SELECT project, doc_type, sap_module,
+                       GROUPING(project), GROUPING(doc_type), GROUPING(sap_module),
+                       COUNT(*) FILTER (WHERE {" AND ".join(in_scope)}),
+                       COUNT(*) FILTER (WHERE {" AND ".join(typed)}),
+                       COUNT(*) FILTER (WHERE {" AND ".join(review)})
+                FROM document_catalog
+                GROUP BY GROUPING SETS ((project), (doc_type), (sap_module), ())
+                """,
+                in_scope_params + typed_params + review_params,
+            )
+            rows = cur.fetchall()
+
+        by_type, by_module, projects = {}, {}, set()
+        total = needs_review = 0
+        for (project_name, doc_type, code,
+             no_project, no_type, no_module, scoped, typed_count, review_count) in rows:
+            if not no_project:
+                if self._listed_project(project_name):
+                    projects.add(project_name)
+            elif not no_type:
+                by_type[doc_type] = typed_count
+            elif not no_module:
+                by_module[code] = scoped
+            else:
+                total, needs_review = typed_count, review_count
+        return by_type, by_module, total, needs_review, projects
+
+    def _stats_rollup_sqlite(self, conn, project, module, latest_only):
+        with conn.cursor() as cur:
+            cur.execute(
+                """
+                SELECT project, doc_type, sap_module,
+                       (is_latest = 1 OR is_latest IS NULL) AS latest,
+                       (sap_module_method = %s AND (sap_module_confidence IS NULL
+                                                    OR sap_module_confidence < %s)) AS review,
+                       COUNT(*)
+                FROM document_catalog
+                GROUP BY 1, 2, 3, 4, 5
+                """,
+                (METHOD_LLM, REVIEW_CONFIDENCE_THRESHOLD),
+            )
+            rows = cur.fetchall()
+
+        by_type, by_module, projects = {}, {}, set()
+        total = needs_review = 0
+        for project_name, doc_type, code, latest, review, count in rows:
+            if self._listed_project(project_name):
+                projects.add(project_name)
+            if project and project_name != project:
+                continue
+            if latest_only and not latest:
+                continue
+            by_module[code] = by_module.get(code, 0) + count
+            if module and code != module:
+                continue
+            by_type[doc_type] = by_type.get(doc_type, 0) + count
+            total += count
+            if review:
+                needs_review += count
+        return by_type, by_module, total, needs_review, projects
+
+    @corpus_cache.corpus_cached()
     def list_synced_projects(self) -> list:
         """Projects that have at least one document in the Yoda knowledge base.
 
@@ -1403,7 +2237,7 @@ class RAGService:
                 cur.execute(
                     """
                     SELECT project_id, MAX(project) AS project
-                    FROM documents
+                    FROM document_catalog
                     WHERE project_id IS NOT NULL
                       AND TRIM(project_id) <> ''
                     GROUP BY project_id
@@ -1415,6 +2249,7 @@ class RAGService:
             print(f"Error listing synced projects: {e}")
             import traceback
             traceback.print_exc()
+            corpus_cache.uncacheable()
             return []
         finally:
             if conn:
@@ -1525,26 +2360,14 @@ class RAGService:
         try:
             is_sqlite = self._is_sqlite(conn)
             with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor if not is_sqlite else None) as cur:
-                if is_sqlite:
-                    cur.execute(
-                        """
-                        SELECT calm_display_id, display_id, project_id, project
-                        FROM documents
-                        WHERE document_id = ?
-                        LIMIT 1
-                        """,
-                        (document_id,),
-                    )
-                else:
-                    cur.execute(
-                        """
-                        SELECT calm_display_id, display_id, project_id, project
-                        FROM documents
-                        WHERE document_id = %s
-                        LIMIT 1
-                        """,
-                        (document_id,),
-                    )
+                cur.execute(
+                    """
+                    SELECT calm_display_id, display_id, project_id, project
+                    FROM document_catalog
+                    WHERE document_id = %s
+                    """,
+                    (document_id,),
+                )
                 anchor = cur.fetchone()
                 if not anchor:
                     return []
@@ -1555,76 +2378,35 @@ class RAGService:
                 project_id = anchor.get('project_id')
                 project = anchor.get('project')
 
+                columns = """
+                    document_id, document_name, version, is_latest,
+                    updated_by, updated_on, uuid, calm_display_id, display_id
+                """
                 if display_id and project_id:
-                    if is_sqlite:
-                        cur.execute(
-                            """
-                            SELECT DISTINCT document_id, document_name, version, is_latest,
-                                   updated_by, updated_on, uuid, calm_display_id, display_id
-                            FROM documents
-                            WHERE calm_display_id = ? AND project_id = ?
-                            ORDER BY version ASC
-                            """,
-                            (display_id, project_id),
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            SELECT DISTINCT ON (document_id)
-                                document_id, document_name, version, is_latest,
-                                updated_by, updated_on, uuid, calm_display_id, display_id
-                            FROM documents
-                            WHERE calm_display_id = %s AND project_id = %s
-                            ORDER BY document_id, version ASC
-                            """,
-                            (display_id, project_id),
-                        )
+                    cur.execute(
+                        f"""
+                        SELECT {columns}
+                        FROM document_catalog
+                        WHERE calm_display_id = %s AND project_id = %s
+                        ORDER BY version ASC
+                        """,
+                        (display_id, project_id),
+                    )
                 elif display_id and project:
-                    if is_sqlite:
-                        cur.execute(
-                            """
-                            SELECT DISTINCT document_id, document_name, version, is_latest,
-                                   updated_by, updated_on, uuid, calm_display_id, display_id
-                            FROM documents
-                            WHERE calm_display_id = ? AND project = ?
-                            ORDER BY version ASC
-                            """,
-                            (display_id, project),
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            SELECT DISTINCT ON (document_id)
-                                document_id, document_name, version, is_latest,
-                                updated_by, updated_on, uuid, calm_display_id, display_id
-                            FROM documents
-                            WHERE calm_display_id = %s AND project = %s
-                            ORDER BY document_id, version ASC
-                            """,
-                            (display_id, project),
-                        )
+                    cur.execute(
+                        f"""
+                        SELECT {columns}
+                        FROM document_catalog
+                        WHERE calm_display_id = %s AND project = %s
+                        ORDER BY version ASC
+                        """,
+                        (display_id, project),
+                    )
                 else:
-                    if is_sqlite:
-                        cur.execute(
-                            """
-                            SELECT DISTINCT document_id, document_name, version, is_latest,
-                                   updated_by, updated_on, uuid, calm_display_id, display_id
-                            FROM documents
-                            WHERE document_id = ?
-                            """,
-                            (document_id,),
-                        )
-                    else:
-                        cur.execute(
-                            """
-                            SELECT document_id, document_name, version, is_latest,
-                                   updated_by, updated_on, uuid, calm_display_id, display_id
-                            FROM documents
-                            WHERE document_id = %s
-                            LIMIT 1
-                            """,
-                            (document_id,),
-                        )
+                    cur.execute(
+                        f"SELECT {columns} FROM document_catalog WHERE document_id = %s",
+                        (document_id,),
+                    )
 
                 rows = cur.fetchall()
                 if is_sqlite:
@@ -1658,20 +2440,20 @@ class RAGService:
         if not identifier or not str(identifier).strip():
             return False
         ident = str(identifier).strip()
+        match = "document_id = %s OR id LIKE %s OR CAST(uuid AS TEXT) = %s"
+        params = (ident, f"{ident}_%", ident)
         conn = get_conn()
         try:
             with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    DELETE FROM documents
-                    WHERE document_id = %s
-                       OR id LIKE %s
-                       OR uuid::text = %s
-                    """,
-                    (ident, f"{ident}_%", ident),
-                )
+                # The documents whose catalog rows this delete affects.
+                cur.execute(f"SELECT id, document_id FROM documents WHERE {match}", params)
+                matched = cur.fetchall()
+                chunk_ids = [row[0] for row in matched] if self.vector_index.tracking else []
+                cur.execute(f"DELETE FROM documents WHERE {match}", params)
                 deleted = cur.rowcount > 0
-            conn.commit()
+            document_catalog.refresh(conn, [row[1] for row in matched])
+            corpus_cache.commit(conn)
+            self.vector_index.remove(chunk_ids)
             return deleted
         except Exception as e:
             conn.rollback()
@@ -1708,23 +2490,28 @@ class RAGService:
                         base_name = os.path.basename(inner_filename)
                         is_duplicate = self.check_duplicate(base_name)
                         chunks = self._chunk_text(text_content, chunk_size=500, overlap=50)
+                        embeddings = self._create_embeddings(chunks)
 
                         conn = get_conn()
+                        index_changes = self.vector_index.changes()
                         try:
-                            for i, chunk in enumerate(chunks):
-                                embedding = self._create_embedding(chunk)
-                                metadata = {
-                                    'source': 'File Upload',
-                                    'type': self._get_file_type(base_name),
-                                    'project': 'N/A',
-                                    'updatedBy': 'System',
-                                    'updatedOn': 'N/A',
-                                    'document_name': base_name,
-                                    'is_placeholder': False,
-                                    'html_content': '',
-                                }
-                                self._insert_chunk(conn, f"{base_name}_{i}", base_name, chunk, embedding, metadata)
-                            conn.commit()
+                            metadata = {
+                                'source': 'File Upload',
+                                'type': self._get_file_type(base_name),
+                                'project': 'N/A',
+                                'updatedBy': 'System',
+                                'updatedOn': 'N/A',
+                                'document_name': base_name,
+                                'is_placeholder': False,
+                                'html_content': '',
+                            }
+                            self._write_chunks(conn, [
+                                self._chunk_row(conn, f"{base_name}_{i}", base_name, chunk, embedding, metadata)
+                                for i, (chunk, embedding) in enumerate(zip(chunks, embeddings))
+                            ], index_changes)
+                            document_catalog.refresh(conn, [base_name])
+                            corpus_cache.commit(conn)
+                            index_changes.apply()
                         except Exception:
                             conn.rollback()
                             raise
@@ -0,0 +1,88 @@
+"""
+In-process copy of the calm_scopes scope → module mapping.
+
+ModuleClassifier.classify_by_scope runs for every document a sync ingests, and
+used to query calm_scopes for each one: thousands of point lookups against a
+table of a few hundred rows that only changes when scopes are synced or an
+admin curates one. The whole mapping is held here instead, already resolved —
+the stored module where there is one, else what the scope's name maps to.
+
+Freshness:
+
+  - ScopeService calls refresh() after each of its commits, so the process
+    that changed a scope sees it at once.
+  - Other workers reload when the corpus generation (services/corpus_cache.py)
+    has moved since their copy was loaded, which every scope write does. But
+    at most every RELOAD_SECONDS: document writes move it too, and a sync
+    makes a lot of those.
+
+The map is replaced whole, never mutated, so readers take no lock.
+"""
+
+import os
+import threading
+import time
+
+from db import get_conn
+from services import corpus_cache
+from config.sap_modules import module_from_scope_name, normalize_module
+
+RELOAD_SECONDS = float(os.getenv("SCOPE_MAP_RELOAD_SECONDS", "5"))
+
+_lock = threading.Lock()
+_map = None            # scope id -> module code, or None when unmapped
+_generation = None
+_loaded_at = 0.0
+
+
+def _load() -> dict:
+    conn = get_conn()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT id, sap_module, name FROM calm_scopes")
+            rows = cur.fetchall()
+    finally:
+        conn.close()
+    # Plain cursor: tuples on Postgres, sqlite3.Row on SQLite — both index by
+    # position.
+    return {
+        str(row[0]): normalize_module(row[1]) or module_from_scope_name(row[2])
+        for row in rows
+    }
+
+
+def refresh() -> bool:
+    """Reload the map now. False if calm_scopes could not be read."""
+    global _map, _generation, _loaded_at
+    # Read before loading: a change landing mid-load then leaves the map
+    # tagged with the older generation, and the next read reloads it.
+    generation = corpus_cache.current_generation()
+    try:
+        mapping = _load()
+    except Exception as e:
+        print(f"WARNING: could not load the scope map: {e}")
+        return False
+    with _lock:
+        _map, _generation, _loaded_at = mapping, generation, time.monotonic()
+    return True
+
+
+def current():
+    """The map, reloaded first if it may be stale; None if it cannot be loaded."""
+    generation = corpus_cache.current_generation()
+    with _lock:
+        stale = _map is None or (
+            _generation != generation and time.monotonic() - _loaded_at >= RELOAD_SECONDS
+        )
+    if stale:
+        refresh()
+    return _map
+
+
+def resolve_many(scope_ids):
+    """{scope_id: module} for the given ids, from memory. Unknown or unmapped
+    scopes map to None. Returns None if the map cannot be loaded."""
+    mapping = current()
+    if mapping is None:
+        return None
+    return {scope_id: mapping.get(str(scope_id)) for scope_id in scope_ids if scope_id}
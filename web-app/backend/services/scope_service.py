@@ -6,77 +6,153 @@ scope's name — so without this cache there is nothing for the classifier's
 deterministic layer to map against.
 
 Each scope's module is resolved from its name once on first sync. Admins can
-correct it afterwards, and a correction survives later syncs.
+correct it afterwards; a correction survives later syncs and reaches the
+documents under the scope straight away.
 """
 
 from datetime import datetime
 
-from db import get_conn
-from config.sap_modules import MODULE_LABELS, module_from_scope_name, normalize_module
+import psycopg2.extras
+
+from db import SQLiteConnectionProxy, get_conn
+from services import corpus_cache, document_catalog, scope_map_cache
+from config.sap_modules import (
+    METHOD_MANUAL,
+    METHOD_SCOPE_MAP,
+    MODULE_LABELS,
+    module_from_scope_name,
+    normalize_module,
+)
+
+# Only fill gaps; never clobber a curated mapping.
+_UPSERT_TEMPLATE = """
+    INSERT INTO calm_scopes (id, name, project_id, sap_module, synced_at)
+    VALUES {values}
+    ON CONFLICT (id) DO UPDATE SET
+        name = EXCLUDED.name,
+        project_id = EXCLUDED.project_id,
+        sap_module = COALESCE(NULLIF(calm_scopes.sap_module, ''), EXCLUDED.sap_module),
+        synced_at = EXCLUDED.synced_at
+"""
+_UPSERT_ROW_SQL = _UPSERT_TEMPLATE.format(values="(%s, %s, %s, %s, %s)")
+_UPSERT_VALUES_SQL = _UPSERT_TEMPLATE.format(values="%s")
+
+# Documents under a mapped scope whose module should follow it: not set by
+# hand, and not already the scope's module by way of the scope map.
+_PROPAGATE_WHERE = """
+    d.scope_id = s.id AND {scopes}
+    AND s.sap_module IS NOT NULL AND s.sap_module != ''
+    AND (d.sap_module_method IS NULL OR d.sap_module_method != %s)
+    AND (d.sap_module IS DISTINCT FROM s.sap_module
+         OR d.sap_module_method IS DISTINCT FROM %s)
+"""
 
 
 class ScopeService:
     """CRUD over the calm_scopes cache."""
 
+    # Scopes per statement: rows per INSERT page, and ids per IN list on
+    # SQLite, which has no array parameters.
+    WRITE_BATCH = 500
+
+    @classmethod
+    def _in_clauses(cls, conn, column: str, ids: list):
+        """(sql, params) pairs that together match `column` against ids."""
+        if not isinstance(conn, SQLiteConnectionProxy):
+            return [(f"{column} = ANY(%s)", [ids])] if ids else []
+        return [
+            (f"{column} IN ({', '.join(['%s'] * len(batch))})", batch)
+            for batch in (ids[i:i + cls.WRITE_BATCH] for i in range(0, len(ids), cls.WRITE_BATCH))
+        ]
+
+    def _propagate_scope_modules(self, conn, scope_ids: list) -> int:
+        """Give the documents under these scopes their scope's module.
+
+        The outcome the classifier's scope layer would reach on a re-ingest —
+        the scope map wins over vector and LLM verdicts, never over a manual
+        override — in one set-based UPDATE instead of a pass over documents.
+        Documents already in line are left alone. Refreshes the catalog rows of
+        those it changes; does not commit. Returns how many it changed.
+        """
+        where = _PROPAGATE_WHERE
+        if isinstance(conn, SQLiteConnectionProxy):
+            # SQLite spells the null-safe comparison IS NOT.
+            where = where.replace("IS DISTINCT FROM", "IS NOT")
+
+        document_ids = []
+        with conn.cursor() as cur:
+            for clause, params in self._in_clauses(conn, 's.id', scope_ids):
+                params = params + [METHOD_MANUAL, METHOD_SCOPE_MAP]
+                scoped_where = where.format(scopes=clause)
+                cur.execute(
+                    "SELECT DISTINCT d.document_id FROM documents AS d, calm_scopes AS s "
+                    f"WHERE {scoped_where}",
+                    params,
+                )
+                document_ids += [row[0] for row in cur.fetchall()]
+                cur.execute(
+                    f"""
+                    UPDATE documents AS d
+                    SET sap_module = s.sap_module,
+                        sap_module_confidence = 1.0,
+                        sap_module_method = %s
+                    FROM calm_scopes AS s
+                    WHERE {scoped_where}
+                    """,
+                    [METHOD_SCOPE_MAP] + params,
+                )
+        document_catalog.refresh(conn, document_ids)
+        return len(document_ids)
+
     def sync_scopes(self, project_id: str, scopes: list) -> dict:
         """Upsert scopes for a project.
 
         An admin-set module is never overwritten — we only fill in scopes whose
-        module is still unresolved.
+        module is still unresolved. Documents under the synced scopes are then
+        brought in line with them (see _propagate_scope_modules), so a scope
+        that just got a module passes it on without a backfill.
         """
         if not scopes:
-            return {'synced': 0, 'mapped': 0, 'unmapped': []}
+            return {'synced': 0, 'mapped': 0, 'unmapped': [], 'documentsUpdated': 0}
 
         now = datetime.now().isoformat()
-        synced = 0
-        mapped = 0
-        unmapped = []
+        # Keyed by id: one INSERT cannot touch the same row twice on Postgres.
+        rows = {}
+        for scope in scopes:
+            scope_id = scope.get('id')
+            if not scope_id:
+                continue
+            name = scope.get('name') or ''
+            rows[str(scope_id)] = (
+                str(scope_id), name, str(project_id), module_from_scope_name(name), now,
+            )
+        rows = list(rows.values())
+        scope_ids = [row[0] for row in rows]
 
         conn = get_conn()
         try:
-            for scope in scopes:
-                scope_id = scope.get('id')
-                if not scope_id:
-                    continue
-                name = scope.get('name') or ''
-                resolved = module_from_scope_name(name)
-
-                with conn.cursor() as cur:
-                    cur.execute(
-                        "SELECT sap_module FROM calm_scopes WHERE id = %s",
-                        (str(scope_id),),
-                    )
-                    existing = cur.fetchone()
-
-                    if existing:
-                        current = existing[0] if isinstance(existing, tuple) else existing['sap_module']
-                        # Only fill gaps; never clobber a curated mapping.
-                        module = current or resolved
-                        cur.execute(
-                            """
-                            UPDATE calm_scopes
-                            SET name = %s, project_id = %s, sap_module = %s, synced_at = %s
-                            WHERE id = %s
-                            """,
-                            (name, str(project_id), module, now, str(scope_id)),
-                        )
-                    else:
-                        module = resolved
-                        cur.execute(
-                            """
-                            INSERT INTO calm_scopes (id, name, project_id, sap_module, synced_at)
-                            VALUES (%s, %s, %s, %s, %s)
-                            """,
-                            (str(scope_id), name, str(project_id), module, now),
-                        )
-
-                synced += 1
-                if module:
-                    mapped += 1
+            before, stored = self._stored_scopes(conn, scope_ids), {}
+            with conn.cursor() as cur:
+                if isinstance(conn, SQLiteConnectionProxy):
+                    cur.executemany(_UPSERT_ROW_SQL, rows)
                 else:
-                    unmapped.append({'id': str(scope_id), 'name': name})
+                    psycopg2.extras.execute_values(
+                        cur, _UPSERT_VALUES_SQL, rows, page_size=self.WRITE_BATCH
+                    )
+            # The module each scope ended up with, curated or resolved.
+            after = self._stored_scopes(conn, scope_ids)
+            stored = {scope_id: scope[2] for scope_id, scope in after.items()}
+            propagated = self._propagate_scope_modules(conn, scope_ids)
 
-            conn.commit()
+            # The scope mirror re-syncs every couple of minutes while scopes
+            # are browsed. Moving the corpus generation drops every cached
+            # listing and has each worker reload its scope map and index
+            # labels, so only do it when something a reader sees changed.
+            if propagated or after != before:
+                corpus_cache.commit(conn)
+                scope_map_cache.refresh()
+            else:
+                conn.commit()
         except Exception as e:
             conn.rollback()
             print(f"Error syncing scopes for project {project_id}: {e}")
@@ -84,8 +160,27 @@ class ScopeService:
         finally:
             conn.close()
 
-        return {'synced': synced, 'mapped': mapped, 'unmapped': unmapped}
+        unmapped = [{'id': row[0], 'name': row[1]} for row in rows if not stored.get(row[0])]
+        return {
+            'synced': len(rows),
+            'mapped': len(rows) - len(unmapped),
+            'unmapped': unmapped,
+            'documentsUpdated': propagated,
+        }
+
+    def _stored_scopes(self, conn, scope_ids: list) -> dict:
+        """scope id -> (name, project id, module) as stored, for these ids."""
+        stored = {}
+        with conn.cursor() as cur:
+            for clause, params in self._in_clauses(conn, 'id', scope_ids):
+                cur.execute(
+                    f"SELECT id, name, project_id, sap_module FROM calm_scopes WHERE {clause}",
+                    params,
+                )
+                stored.update((row[0], (row[1], row[2], row[3])) for row in cur.fetchall())
+        return stored
 
+    @corpus_cache.corpus_cached()
     def list_scopes(self, project_id: str = '') -> list:
         """All cached scopes, newest sync first. Unmapped ones surface for triage."""
         conn = get_conn()
@@ -109,6 +204,7 @@ class ScopeService:
                 rows = cur.fetchall()
         except Exception as e:
             print(f"Error listing cached scopes: {e}")
+            corpus_cache.uncacheable()
             return []
         finally:
             conn.close()
@@ -134,7 +230,8 @@ class ScopeService:
         return result
 
     def set_scope_module(self, scope_id: str, module: str) -> bool:
-        """Curate a scope's module by hand. Survives subsequent syncs."""
+        """Curate a scope's module by hand. Survives subsequent syncs, and
+        carries over to the documents under the scope."""
         normalized = normalize_module(module)
         if not normalized:
             raise ValueError(f"'{module}' is not a valid SAP module code")
@@ -147,7 +244,12 @@ class ScopeService:
                     (normalized, str(scope_id)),
                 )
                 updated = cur.rowcount
-            conn.commit()
+            if updated:
+                # In the same transaction: the documents follow the correction
+                # exactly when it lands.
+                self._propagate_scope_modules(conn, [str(scope_id)])
+            corpus_cache.commit(conn)
+            scope_map_cache.refresh()
             return updated > 0
         except Exception as e:
             conn.rollback()
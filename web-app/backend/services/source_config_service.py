@@ -12,6 +12,9 @@ from datetime import datetime
 # Storage file path
 SOURCES_FILE = os.path.join(os.path.dirname(__file__), '..', 'config', 'sources.json')
 
+# Config keys that identify a CALM service instance (see calm_service.get_calm_service)
+CREDENTIAL_KEYS = ('apiEndpoint', 'tokenUrl', 'clientId', 'clientSecret')
+
 
 def _load_sources() -> List[Dict]:
     """Load sources from JSON file"""
@@ -166,6 +169,7 @@ def update_source(source_id: str, data: Dict) -> Optional[Dict]:
             
             if 'config' not in source:
                 source['config'] = {}
+            previous_config = dict(source['config'])
             
             source['config']['apiEndpoint'] = data.get('apiEndpoint', source['config'].get('apiEndpoint', ''))
             source['config']['tokenUrl'] = data.get('tokenUrl', source['config'].get('tokenUrl', ''))
@@ -179,6 +183,14 @@ def update_source(source_id: str, data: Dict) -> Optional[Dict]:
             sources[i] = source
             _save_sources(sources)
             
+            if source['type'] == 'CALM' and any(
+                previous_config.get(k) != source['config'].get(k) for k in CREDENTIAL_KEYS
+            ):
+                # The shared service for the old credentials holds a token and
+                # connections for them; drop it rather than let it linger
+                from services.calm_service import invalidate_calm_service
+                invalidate_calm_service(previous_config)
+            
             # Remove sensitive data from response
             response = source.copy()
             response['config'] = {k: v for k, v in source['config'].items() if k != 'clientSecret'}
@@ -200,10 +212,15 @@ def delete_source(source_id: str) -> bool:
     sources = _load_sources()
     original_length = len(sources)
     
+    removed = [s for s in sources if s.get('id') == source_id]
     sources = [s for s in sources if s.get('id') != source_id]
     
     if len(sources) < original_length:
         _save_sources(sources)
+        for source in removed:
+            if source.get('type') == 'CALM':
+                from services.calm_service import invalidate_calm_service
+                invalidate_calm_service(source.get('config'))
         return True
     
     return False
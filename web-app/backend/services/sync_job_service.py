@@ -0,0 +1,692 @@
+"""
+Background execution of /api/sync.
+
+Syncing used to run inline in the request: fetch, classify, embed and write
+every selected item before answering. A few hundred CALM documents outlast the
+proxy timeout and hold a Flask thread the whole time. Now the route only
+records a job (sync_jobs + one sync_job_items row per document) and a small
+worker pool works through it; the client polls GET /api/sync/jobs/<id>.
+
+A job whose documents come from a listing the server pages through itself
+(a whole CALM project) is committed as 'enumerating' straight away and the
+listing is read on the worker pool, a batch of items at a time, before the job
+is queued. The route answers at once, and no transaction stays open while the
+source is paged.
+
+Jobs live in the database, not in memory, so a restart picks a half-finished
+job back up. A running job stamps heartbeat_at after every item; a job whose
+heartbeat has gone stale belonged to a process that died, and any process may
+claim it. Claims are a conditional UPDATE, so two processes (the debug
+reloader's parent and child, say) never run the same job.
+
+What a "document sync" actually does stays in app.py — this module is handed a
+factory that builds a per-job processor, and only schedules and records.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from db import get_conn
+
+ACTIVE_STATUSES = ('enumerating', 'queued', 'running')
+
+
+class JobCancelled(Exception):
+    """Raised inside a running job once cancellation has been requested."""
+
+
+class SyncJobService:
+    """Queues sync jobs in the database and runs them on a worker pool."""
+
+    # Jobs run concurrently. Within a job, items are fetched in parallel but
+    # ingested in order.
+    WORKERS = int(os.getenv("SYNC_JOB_WORKERS", "2"))
+    # A running job with no heartbeat for this long is presumed orphaned.
+    STALE_SECONDS = int(os.getenv("SYNC_JOB_STALE_SECONDS", "300"))
+    # How often the reaper looks for queued or orphaned jobs to pick up.
+    REAP_INTERVAL_SECONDS = 60
+    # Concurrent content fetches per source, across all of that source's jobs.
+    # CALM throttles per tenant, so this caps the source, not each job.
+    FETCH_CONCURRENCY = int(os.getenv("SYNC_FETCH_CONCURRENCY", "4"))
+    # Item rows per INSERT round trip while a job is being recorded.
+    ITEM_INSERT_BATCH = 500
+
+    _source_slot_registry = {}
+    _source_slots_lock = threading.Lock()
+
+    def __init__(self, make_processor, on_job_finished=None, workers=None):
+        """
+        Args:
+            make_processor: called once per job run with the job dict; returns a
+                (fetch, ingest) pair, or (fetch, ingest, flush). fetch(payload)
+                does the network I/O for one document and runs on the fetch
+                pool; ingest(fetched) writes it and returns the result dict
+                ({"status": ..., ...}). flush(), if given, runs once the run
+                stops taking items — completed, cancelled or failed — for work
+                ingest batches up. Raising from make_processor fails the whole
+                job.
+            on_job_finished: optional callback with the job dict once a job
+                reaches a terminal status.
+        """
+        self.make_processor = make_processor
+        self.on_job_finished = on_job_finished
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers or self.WORKERS, thread_name_prefix="sync-job"
+        )
+        self._lock = threading.Lock()
+        self._scheduled = set()
+        self._reaper = None
+
+    # ── Public API ────────────────────────────────────────────────────────────
+
+    def start(self):
+        """Resume unfinished jobs and keep watching for orphaned ones."""
+        with self._lock:
+            if self._reaper is not None:
+                return
+            self._reaper = threading.Thread(
+                target=self._reap_forever, name="sync-job-reaper", daemon=True
+            )
+        self._reaper.start()
+
+    def create_job(self, source_id: str, documents, synced_by=None) -> dict:
+        """Record a job with one pending item per document and schedule it.
+
+        documents is a list, recorded before this returns, or a lazy iterable
+        such as a generator paging through the source. A lazy one is read on
+        the worker pool (see _enumerate): the job is returned as 'enumerating'
+        and its total grows until the listing ends.
+        """
+        job_id = str(uuid.uuid4())
+        now = datetime.now().isoformat()
+        lazy = not isinstance(documents, (list, tuple))
+
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    INSERT INTO sync_jobs
+                        (id, source_id, status, synced_by, total, owner, created_at, heartbeat_at)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (
+                        job_id, str(source_id), 'enumerating' if lazy else 'queued',
+                        synced_by, 0 if lazy else len(documents),
+                        self.owner if lazy else None, now, now if lazy else None,
+                    ),
+                )
+                if not lazy:
+                    rows = [self._item_row(job_id, i, doc) for i, doc in enumerate(documents)]
+                    for start in range(0, len(rows), self.ITEM_INSERT_BATCH):
+                        self._insert_items(cur, rows[start:start + self.ITEM_INSERT_BATCH])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        if lazy:
+            self._executor.submit(self._enumerate, job_id, documents)
+        else:
+            self._schedule(job_id)
+        return self.get_job(job_id, include_items=False)
+
+    def _enumerate(self, job_id: str, documents):
+        """Read an 'enumerating' job's documents into item rows, then queue it.
+
+        Each batch is gathered before a connection is taken, and committed on
+        its own. The listing cannot be resumed, so a process dying here leaves
+        the job to resume_pending(), which fails it once its heartbeat is stale.
+        """
+        try:
+            total = 0
+            rows = []
+            for doc in documents:
+                rows.append(self._item_row(job_id, total, doc))
+                total += 1
+                if len(rows) >= self.ITEM_INSERT_BATCH:
+                    if not self._add_items(job_id, rows, total):
+                        return
+                    rows = []
+            if not self._add_items(job_id, rows, total, last=True):
+                return
+        except Exception as e:
+            import traceback
+            traceback.print_exc()
+            try:
+                self._finish(job_id, 'failed', error=f"Listing documents failed: {e}")
+            except Exception as finish_error:
+                print(f"SYNC_JOBS: job {job_id} aborted while listing: {finish_error}")
+            return
+        print(f"SYNC_JOBS: job {job_id} listed {total} document(s)")
+        self._schedule(job_id)
+
+    def _add_items(self, job_id: str, rows, total: int, last: bool = False) -> bool:
+        """Record one batch of an enumerating job's items; queue the job after
+        the last. False if the job stopped enumerating meanwhile (cancelled)."""
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sync_jobs SET status = %s, total = %s, heartbeat_at = %s
+                    WHERE id = %s AND status = 'enumerating'
+                    """,
+                    ('queued' if last else 'enumerating', total,
+                     datetime.now().isoformat(), job_id),
+                )
+                if cur.rowcount != 1:
+                    conn.rollback()
+                    return False
+                if rows:
+                    self._insert_items(cur, rows)
+            conn.commit()
+            return True
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _item_row(job_id: str, position: int, doc) -> tuple:
+        doc = doc or {}
+        return (
+            job_id,
+            position,
+            str(doc.get('uuid') or doc.get('id') or ''),
+            doc.get('title') or doc.get('name'),
+            json.dumps(doc),
+            'pending',
+        )
+
+    @staticmethod
+    def _insert_items(cur, rows):
+        cur.executemany(
+            """
+            INSERT INTO sync_job_items
+                (job_id, position, document_id, document_name, payload, status)
+            VALUES (%s, %s, %s, %s, %s, %s)
+            """,
+            rows,
+        )
+
+    def get_job(self, job_id: str, include_items: bool = True):
+        """Job status with throughput and ETA, or None if the id is unknown."""
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT id, source_id, status, synced_by, total, processed,
+                           succeeded, failed, cancel_requested, error,
+                           created_at, started_at, heartbeat_at, finished_at
+                    FROM sync_jobs WHERE id = %s
+                    """,
+                    (job_id,),
+                )
+                row = cur.fetchone()
+                if not row:
+                    return None
+                job = self._job_from_row(row)
+
+                if include_items:
+                    cur.execute(
+                        """
+                        SELECT position, document_id, document_name, status,
+                               result, started_at, finished_at
+                        FROM sync_job_items WHERE job_id = %s
+                        ORDER BY position
+                        """,
+                        (job_id,),
+                    )
+                    job['items'] = [self._item_from_row(r) for r in cur.fetchall()]
+        finally:
+            conn.close()
+
+        job.update(self._progress(job))
+        return job
+
+    def cancel_job(self, job_id: str):
+        """Request cancellation. Returns the job, or None if the id is unknown.
+
+        A queued or enumerating job is cancelled on the spot. A running one
+        stops before it ingests its next item; the item being ingested
+        finishes normally.
+        """
+        now = datetime.now().isoformat()
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sync_jobs SET cancel_requested = %s
+                    WHERE id = %s AND status IN ('enumerating', 'queued', 'running')
+                    """,
+                    (True, job_id),
+                )
+                cur.execute(
+                    """
+                    UPDATE sync_jobs SET status = 'cancelled', finished_at = %s
+                    WHERE id = %s AND status IN ('enumerating', 'queued')
+                    """,
+                    (now, job_id),
+                )
+                if cur.rowcount:
+                    self._cancel_pending_items(cur, job_id, now)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        return self.get_job(job_id, include_items=False)
+
+    def resume_pending(self) -> int:
+        """Schedule queued jobs and reclaim running jobs whose owner went quiet.
+
+        An enumerating job whose owner went quiet is failed instead: the
+        listing it was reading is gone with that process.
+        """
+        now = datetime.now().isoformat()
+        stale_before = (datetime.now() - timedelta(seconds=self.STALE_SECONDS)).isoformat()
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT id FROM sync_jobs
+                    WHERE status = 'enumerating' AND (heartbeat_at IS NULL OR heartbeat_at < %s)
+                    """,
+                    (stale_before,),
+                )
+                for abandoned in [r[0] for r in cur.fetchall()]:
+                    cur.execute(
+                        """
+                        UPDATE sync_jobs SET status = 'failed', error = %s, finished_at = %s
+                        WHERE id = %s AND status = 'enumerating'
+                        """,
+                        ("Listing documents was interrupted; start the sync again.", now, abandoned),
+                    )
+                    self._cancel_pending_items(cur, abandoned, now)
+                conn.commit()
+                cur.execute(
+                    """
+                    SELECT id FROM sync_jobs
+                    WHERE status = 'queued'
+                       OR (status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < %s))
+                    ORDER BY created_at
+                    """,
+                    (stale_before,),
+                )
+                job_ids = [r[0] for r in cur.fetchall()]
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        resumed = 0
+        for job_id in job_ids:
+            if self._schedule(job_id):
+                resumed += 1
+        if resumed:
+            print(f"SYNC_JOBS: resumed {resumed} job(s)")
+        return resumed
+
+    # ── Worker side ───────────────────────────────────────────────────────────
+
+    def _reap_forever(self):
+        while True:
+            try:
+                self._touch_owned_jobs()
+                self.resume_pending()
+            except Exception as e:
+                print(f"SYNC_JOBS: resume check failed: {e}")
+            time.sleep(self.REAP_INTERVAL_SECONDS)
+
+    def _touch_owned_jobs(self):
+        """Keep our jobs' heartbeats fresh while a single slow item is in flight."""
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sync_jobs SET heartbeat_at = %s
+                    WHERE owner = %s AND status IN ('enumerating', 'running')
+                    """,
+                    (datetime.now().isoformat(), self.owner),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _schedule(self, job_id: str) -> bool:
+        with self._lock:
+            if job_id in self._scheduled:
+                return False
+            self._scheduled.add(job_id)
+        self._executor.submit(self._run_job, job_id)
+        return True
+
+    def _run_job(self, job_id: str):
+        try:
+            if not self._claim(job_id):
+                return
+            job = self.get_job(job_id, include_items=False)
+            print(f"SYNC_JOBS: job {job_id} started ({job['processed']}/{job['total']} done)")
+            try:
+                stages = self.make_processor(job)
+                fetch, ingest = stages[0], stages[1]
+                flush = stages[2] if len(stages) > 2 else None
+                try:
+                    self._process_items(job_id, job['sourceId'], fetch, ingest)
+                finally:
+                    if flush:
+                        flush()
+                self._finish(job_id, 'completed')
+            except JobCancelled:
+                self._finish(job_id, 'cancelled')
+            except Exception as e:
+                import traceback
+                traceback.print_exc()
+                self._finish(job_id, 'failed', error=str(e))
+        except Exception as e:
+            # Bookkeeping failed (database down). Leave the job as it is; its
+            # heartbeat will go stale and the reaper retries it later.
+            print(f"SYNC_JOBS: job {job_id} aborted: {e}")
+        finally:
+            with self._lock:
+                self._scheduled.discard(job_id)
+
+    def _claim(self, job_id: str) -> bool:
+        """Take ownership of a queued or orphaned job. False if someone else has it."""
+        now = datetime.now().isoformat()
+        stale_before = (datetime.now() - timedelta(seconds=self.STALE_SECONDS)).isoformat()
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sync_jobs
+                    SET status = 'running', owner = %s, heartbeat_at = %s,
+                        started_at = COALESCE(started_at, %s)
+                    WHERE id = %s
+                      AND (status = 'queued'
+                           OR (status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < %s)))
+                    """,
+                    (self.owner, now, now, job_id, stale_before),
+                )
+                claimed = cur.rowcount == 1
+                if claimed:
+                    # Items a dead owner left mid-flight start over.
+                    cur.execute(
+                        """
+                        UPDATE sync_job_items SET status = 'pending', started_at = NULL
+                        WHERE job_id = %s AND status = 'running'
+                        """,
+                        (job_id,),
+                    )
+            conn.commit()
+            return claimed
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _process_items(self, job_id: str, source_id: str, fetch, ingest):
+        """Fetch documents concurrently and ingest them in order as they arrive.
+
+        CALM latency (300-800 ms a document) used to be paid serially before
+        each ingest. Fetches now run on a small pool, capped per source, while
+        this thread embeds and writes whatever has already arrived. `in_flight`
+        is the queue between the stages; bounding it keeps fetched-but-not-yet-
+        ingested content from piling up in memory when ingest is the slow side.
+        """
+        pending = self._pending_items(job_id)
+        if not pending:
+            return
+        limit = self.FETCH_CONCURRENCY
+        slots = self._source_slots(source_id)
+
+        def fetch_one(payload):
+            with slots:
+                return fetch(payload)
+
+        in_flight = deque()
+        cursor = 0
+        with ThreadPoolExecutor(max_workers=limit, thread_name_prefix="sync-fetch") as pool:
+            try:
+                while cursor < len(pending) or in_flight:
+                    if self._cancel_requested(job_id):
+                        raise JobCancelled()
+
+                    # Keep the fetch stage `limit` items ahead of ingest.
+                    while cursor < len(pending) and len(in_flight) < limit * 2:
+                        position, payload = pending[cursor]
+                        cursor += 1
+                        self._mark_item_running(job_id, position)
+                        in_flight.append((position, payload, pool.submit(fetch_one, payload)))
+
+                    position, payload, future = in_flight.popleft()
+                    try:
+                        result = ingest(future.result()) or {}
+                    except Exception as e:
+                        result = {
+                            "documentId": payload.get('uuid') or payload.get('id'),
+                            "status": "error",
+                            "error": str(e),
+                        }
+                    self._record_item(job_id, position, result)
+            finally:
+                # Cancelled or failed: drop fetches that have not started yet.
+                for _, _, future in in_flight:
+                    future.cancel()
+
+    def _pending_items(self, job_id: str) -> list:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    SELECT position, payload FROM sync_job_items
+                    WHERE job_id = %s AND status = 'pending'
+                    ORDER BY position
+                    """,
+                    (job_id,),
+                )
+                return [(r[0], json.loads(r[1] or '{}')) for r in cur.fetchall()]
+        finally:
+            conn.close()
+
+    def _cancel_requested(self, job_id: str) -> bool:
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    "SELECT cancel_requested FROM sync_jobs WHERE id = %s",
+                    (job_id,),
+                )
+                row = cur.fetchone()
+                # A job deleted out from under us is as good as cancelled.
+                return row is None or bool(row[0])
+        finally:
+            conn.close()
+
+    def _mark_item_running(self, job_id: str, position: int):
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sync_job_items SET status = 'running', started_at = %s
+                    WHERE job_id = %s AND position = %s
+                    """,
+                    (datetime.now().isoformat(), job_id, position),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    @classmethod
+    def _source_slots(cls, source_id: str) -> threading.BoundedSemaphore:
+        """One semaphore per source, shared by every job syncing from it."""
+        with cls._source_slots_lock:
+            slots = cls._source_slot_registry.get(source_id)
+            if slots is None:
+                slots = threading.BoundedSemaphore(cls.FETCH_CONCURRENCY)
+                cls._source_slot_registry[source_id] = slots
+            return slots
+
+    def _record_item(self, job_id: str, position: int, result: dict):
+        now = datetime.now().isoformat()
+        status = result.get('status') or 'error'
+        failed = 1 if status == 'error' else 0
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                cur.execute(
+                    """
+                    UPDATE sync_job_items SET status = %s, result = %s, finished_at = %s
+                    WHERE job_id = %s AND position = %s
+                    """,
+                    (status, json.dumps(result, default=str), now, job_id, position),
+                )
+                cur.execute(
+                    """
+                    UPDATE sync_jobs
+                    SET processed = processed + 1,
+                        succeeded = succeeded + %s,
+                        failed = failed + %s,
+                        heartbeat_at = %s
+                    WHERE id = %s
+                    """,
+                    (1 - failed, failed, now, job_id),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+    def _finish(self, job_id: str, status: str, error=None):
+        now = datetime.now().isoformat()
+        conn = get_conn()
+        try:
+            with conn.cursor() as cur:
+                if status != 'completed':
+                    self._cancel_pending_items(cur, job_id, now)
+                cur.execute(
+                    """
+                    UPDATE sync_jobs SET status = %s, error = %s, finished_at = %s, heartbeat_at = %s
+                    WHERE id = %s AND owner = %s
+                    """,
+                    (status, error, now, now, job_id, self.owner),
+                )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+
+        job = self.get_job(job_id, include_items=False)
+        print(
+            f"SYNC_JOBS: job {job_id} {status} "
+            f"({job['succeeded']} ok, {job['failed']} failed, {job['total']} total)"
+        )
+        if self.on_job_finished:
+            try:
+                self.on_job_finished(job)
+            except Exception as e:
+                print(f"SYNC_JOBS: finish callback failed for {job_id}: {e}")
+
+    @staticmethod
+    def _cancel_pending_items(cur, job_id: str, now: str):
+        # 'running' covers items whose fetch was under way when the job stopped.
+        cur.execute(
+            """
+            UPDATE sync_job_items SET status = 'cancelled', finished_at = %s
+            WHERE job_id = %s AND status IN ('pending', 'running')
+            """,
+            (now, job_id),
+        )
+
+    # ── Row shaping ───────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _job_from_row(row) -> dict:
+        # Plain cursor: tuples on Postgres, sqlite3.Row on SQLite — both index
+        # by position.
+        return {
+            'id': row[0],
+            'sourceId': row[1],
+            'status': row[2],
+            'syncedBy': row[3],
+            'total': row[4] or 0,
+            'processed': row[5] or 0,
+            'succeeded': row[6] or 0,
+            'failed': row[7] or 0,
+            'cancelRequested': bool(row[8]),
+            'error': row[9],
+            'createdAt': row[10],
+            'startedAt': row[11],
+            'heartbeatAt': row[12],
+            'finishedAt': row[13],
+        }
+
+    @staticmethod
+    def _item_from_row(row) -> dict:
+        result = None
+        if row[4]:
+            try:
+                result = json.loads(row[4])
+            except (TypeError, ValueError):
+                result = None
+        return {
+            'position': row[0],
+            'documentId': row[1],
+            'documentName': row[2],
+            'status': row[3],
+            'result': result,
+            'startedAt': row[5],
+            'finishedAt': row[6],
+        }
+
+    @staticmethod
+    def _progress(job: dict) -> dict:
+        """Throughput over the job's wall-clock time so far, and the ETA it implies."""
+        started = job.get('startedAt')
+        if not started or not job['processed']:
+            return {'docsPerMinute': None, 'etaSeconds': None}
+        try:
+            end = job.get('finishedAt') or datetime.now().isoformat()
+            elapsed = (datetime.fromisoformat(end) - datetime.fromisoformat(started)).total_seconds()
+        except (TypeError, ValueError):
+            return {'docsPerMinute': None, 'etaSeconds': None}
+        if elapsed <= 0:
+            return {'docsPerMinute': None, 'etaSeconds': None}
+
+        rate = job['processed'] / elapsed
+        remaining = max(job['total'] - job['processed'], 0)
+        eta = None
+        if job['status'] in ACTIVE_STATUSES:
+            eta = round(remaining / rate) if rate > 0 else None
+        return {'docsPerMinute': round(rate * 60, 2), 'etaSeconds': eta}
@@ -0,0 +1,553 @@
+"""
+Process-resident vector index for the app-side search path.
+
+Without pgvector (SQLite, and CF hyperscaler Postgres in production) every
+Ask Yoda question used to read every embedding in the table, JSON-decode it and
+score it in pure Python — seconds of CPU on a 60k-chunk corpus. This keeps the
+corpus in memory instead: one contiguous float32 matrix of L2-normalized
+vectors plus a chunk-id map, so a query is a single matrix-vector product and
+an argpartition.
+
+Lifecycle:
+  - warm_up() loads the table on a background thread. Until it finishes,
+    search() returns None and callers fall back to the exact scan.
+  - RAGService feeds every chunk write and delete through upsert()/remove(),
+    so the index tracks this process's own changes without reloading. It
+    collects them in an IndexChanges and applies them once the transaction
+    has committed: a rollback puts the rows back in the table, and nothing
+    would put them back in the index. Changes that arrive while warm-up is
+    still reading are replayed once it is done.
+  - Writes from other processes (a sync job another worker ran) are picked up
+    once the corpus generation (services/corpus_cache.py) has moved, at most
+    every REFRESH_SECONDS: the table's ids and content hashes are compared with
+    the index, new or changed rows are loaded and vanished ones dropped. The
+    generation moves with each commit. A synced_on watermark does not work:
+    the writer stamps it from its own clock before committing, so a
+    transaction that stamped earlier but committed later was skipped.
+
+Filtered searches (project, module, doc type, latest version, placeholder,
+and for the module classifier the module's method) are answered in memory too, from a small per-chunk label table: a code per
+FILTER_COLUMNS value. Labels change without the vector changing (a module
+reclassified, an older version retired), so they are not fed through
+upsert(); the table is reloaded when the corpus generation
+(services/corpus_cache.py) has moved, at most every LABEL_RELOAD_SECONDS.
+Chunks written since the last reload have no labels yet and match no filter
+until the next one.
+
+Memory is ~6 KB per chunk at 1536 dims (about 370 MB for 60k chunks).
+Only vectors from the corpus embedding model are held; a row from any other
+model is as unsearchable here as it is in the exact scan.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from db import get_conn
+from services import corpus_cache
+
+STATE_IDLE = 'idle'
+STATE_LOADING = 'loading'
+STATE_READY = 'ready'
+STATE_DISABLED = 'disabled'
+
+
+class VectorIndex:
+    """In-memory cosine-similarity index over documents.embedding."""
+
+    # Rows read per round trip while loading.
+    LOAD_BATCH = 1000
+    # Rows per id-list query when loading specific rows.
+    ID_BATCH = 500
+    # How often a search may reconcile with writes by other processes. 0 disables.
+    REFRESH_SECONDS = int(os.getenv("VECTOR_INDEX_REFRESH_SECONDS", "60"))
+    # The filterable columns, and how often a moved corpus generation may
+    # trigger a label reload — a sync moves it with every document.
+    FILTER_COLUMNS = (
+        'project_id', 'sap_module', 'doc_type', 'is_latest', 'is_placeholder',
+        'sap_module_method',
+    )
+    # What a NULL flag reads as, matching the SQL filters.
+    _NULL_FLAGS = {'is_latest': True, 'is_placeholder': False}
+    LABEL_RELOAD_SECONDS = float(os.getenv("VECTOR_INDEX_LABEL_RELOAD_SECONDS", "5"))
+
+    def __init__(self, model: str, dim: int):
+        self.model = model
+        self.dim = dim
+        self.state = STATE_IDLE
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._ids = []            # row -> chunk id
+        self._rows = {}           # chunk id -> row
+        self._replay = []         # changes made while warm-up was reading
+        self._hashes = {}         # chunk id -> content_hash of the vector held
+        self._generation = None   # corpus generation the last load or refresh read
+        self._touched = None      # ids changed here while a refresh is reading
+        self._last_refresh = 0.0
+        self._refreshing = False
+        self.loaded_at = None
+        self._labels = None       # chunk id -> tuple of FILTER_COLUMNS codes
+        self._vocab = None        # per column: value -> code
+        self._label_generation = None
+        self._labels_loaded_at = 0.0
+        self._label_rows = None   # self._labels laid out by row; rebuilt after rows move
+
+    # ── Lifecycle ─────────────────────────────────────────────────────────────
+
+    @property
+    def ready(self) -> bool:
+        return self.state == STATE_READY
+
+    @property
+    def tracking(self) -> bool:
+        """Whether writes should be mirrored into the index."""
+        return self.state in (STATE_LOADING, STATE_READY)
+
+    def warm_up(self, background: bool = True):
+        """Load the corpus. Safe to call repeatedly; only the first call loads."""
+        with self._lock:
+            if self.state != STATE_IDLE:
+                return
+            self.state = STATE_LOADING
+        if background:
+            threading.Thread(target=self._load, name="vector-index-warmup", daemon=True).start()
+        else:
+            self._load()
+
+    def disable(self):
+        """Stop using the index, e.g. when pgvector does the searching."""
+        with self._lock:
+            self.state = STATE_DISABLED
+            self._matrix = np.empty((0, self.dim), dtype=np.float32)
+            self._ids, self._rows, self._replay, self._hashes = [], {}, [], {}
+            self._labels = self._vocab = self._label_rows = None
+
+    def _load(self):
+        started = time.monotonic()
+        # Read before loading: a write landing mid-load leaves the index tagged
+        # with the older generation, and the next refresh reconciles it.
+        generation = corpus_cache.current_generation()
+        try:
+            matrix, ids, hashes = self._read_rows()
+        except Exception as e:
+            print(f"VECTOR_INDEX: warm-up failed, staying on exact scan: {e}")
+            with self._lock:
+                if self.state == STATE_LOADING:
+                    self.state = STATE_IDLE
+                self._replay = []
+            return
+
+        with self._lock:
+            if self.state != STATE_LOADING:
+                return
+            self._matrix = matrix
+            self._ids = ids
+            self._rows = {chunk_id: i for i, chunk_id in enumerate(ids)}
+            self._hashes = dict(zip(ids, hashes))
+            self._generation = generation
+            self._label_rows = None
+            # Anything written or deleted while we were reading wins over what
+            # the read saw.
+            for op, chunk_ids, vectors, chunk_hashes in self._replay:
+                if op == 'upsert':
+                    self._upsert_locked(chunk_ids, vectors, hashes=chunk_hashes)
+                else:
+                    self._remove_locked(chunk_ids)
+            self._replay = []
+            self._last_refresh = time.monotonic()
+            self.loaded_at = time.time()
+            self.state = STATE_READY
+        print(
+            f"VECTOR_INDEX: loaded {len(ids)} vectors in "
+            f"{time.monotonic() - started:.1f}s"
+        )
+
+    def _read_rows(self, ids=None):
+        """Read (normalized matrix, ids, content hashes) for every row, or for the given ids."""
+        from services.rag_service import _deserialize_embedding
+
+        select = "SELECT id, embedding, embedding_model, content_hash FROM documents"
+        if ids is None:
+            queries = [(select, ())]
+        else:
+            ids = list(ids)
+            queries = [
+                (f"{select} WHERE id IN ({', '.join(['%s'] * len(batch))})", batch)
+                for batch in (ids[i:i + self.ID_BATCH] for i in range(0, len(ids), self.ID_BATCH))
+            ]
+
+        loaded, hashes = [], []
+        conn = get_conn()
+        try:
+            # Sized up front and filled in place: a list of vectors turned into
+            # an array and then a normalized copy held the corpus three times over.
+            if ids is None:
+                with conn.cursor() as cur:
+                    cur.execute("SELECT COUNT(*) FROM documents")
+                    count = int(cur.fetchone()[0])
+            else:
+                count = len(ids)
+            matrix = np.empty((max(count, 1), self.dim), dtype=np.float32)
+
+            for sql, params in queries:
+                for row in _stream_rows(conn, "yoda_vector_index_load", self.LOAD_BATCH, sql, params):
+                    stored_model = row[2]
+                    if stored_model and stored_model != self.model:
+                        continue
+                    vector = _deserialize_embedding(row[1], as_array=True)
+                    if vector is None or len(vector) != self.dim:
+                        continue
+                    if len(loaded) == matrix.shape[0]:
+                        # Rows written since the count.
+                        matrix = np.resize(matrix, (matrix.shape[0] * 2, self.dim))
+                    matrix[len(loaded)] = vector
+                    loaded.append(row[0])
+                    hashes.append(row[3])
+        finally:
+            conn.close()
+
+        matrix = matrix[:len(loaded)]
+        self._normalize(matrix, out=matrix)
+        return matrix, loaded, hashes
+
+    def _read_hashes(self) -> dict:
+        """chunk id -> content_hash for every row of the corpus model."""
+        stored = {}
+        conn = get_conn()
+        try:
+            for row in _stream_rows(
+                conn, "yoda_vector_index_hashes", self.LOAD_BATCH,
+                "SELECT id, content_hash, embedding_model FROM documents", (),
+            ):
+                if not row[2] or row[2] == self.model:
+                    stored[row[0]] = row[1]
+        finally:
+            conn.close()
+        return stored
+
+    def _maybe_refresh(self):
+        """Reconcile with writes from other processes, once the corpus
+        generation has moved and at most every REFRESH_SECONDS."""
+        if not self.REFRESH_SECONDS:
+            return
+        generation = corpus_cache.current_generation()
+        with self._lock:
+            if (self._refreshing or generation == self._generation
+                    or time.monotonic() - self._last_refresh < self.REFRESH_SECONDS):
+                return
+            self._refreshing = True
+            # Changes this process applies meanwhile are newer than the read.
+            self._touched = set()
+        try:
+            stored = self._read_hashes()
+            with self._lock:
+                gone = [c for c in self._rows if c not in stored and c not in self._touched]
+                stale = [
+                    c for c, content_hash in stored.items()
+                    if c not in self._touched
+                    and (c not in self._rows or self._hashes.get(c) != content_hash)
+                ]
+            matrix, ids, hashes = self._read_rows(ids=stale) if stale else (None, [], [])
+            with self._lock:
+                keep = [i for i, chunk_id in enumerate(ids) if chunk_id not in self._touched]
+                self._remove_locked(gone)
+                if keep:
+                    self._upsert_locked(
+                        [ids[i] for i in keep], matrix[keep], normalized=True,
+                        hashes=[hashes[i] for i in keep],
+                    )
+                self._generation = generation
+            if gone or keep:
+                print(f"VECTOR_INDEX: refreshed {len(keep)} vector(s), dropped {len(gone)}")
+        except Exception as e:
+            print(f"VECTOR_INDEX: refresh failed: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+                self._touched = None
+                self._last_refresh = time.monotonic()
+
+    def _current_labels(self) -> bool:
+        """Load the label table if missing or stale. False if it cannot be read."""
+        generation = corpus_cache.current_generation()
+        with self._lock:
+            if self._labels is not None and (
+                self._label_generation == generation
+                or time.monotonic() - self._labels_loaded_at < self.LABEL_RELOAD_SECONDS
+            ):
+                return True
+        try:
+            labels, vocab = self._read_labels()
+        except Exception as e:
+            print(f"VECTOR_INDEX: could not load filter labels: {e}")
+            return False
+        with self._lock:
+            # Tagged with the generation read before loading, so a change
+            # landing mid-load triggers another reload.
+            self._labels, self._vocab = labels, vocab
+            self._label_generation = generation
+            self._labels_loaded_at = time.monotonic()
+            self._label_rows = None
+        return True
+
+    def _read_labels(self):
+        """(chunk id -> codes, per-column vocabularies) for every chunk.
+
+        NULL flags are read as the SQL filters read them: no is_latest is the
+        latest version, no is_placeholder is real content.
+        """
+        vocab = tuple({} for _ in self.FILTER_COLUMNS)
+        labels = {}
+        conn = get_conn()
+        try:
+            for row in _stream_rows(
+                conn, "yoda_vector_index_labels", self.LOAD_BATCH,
+                f"SELECT id, {', '.join(self.FILTER_COLUMNS)} FROM documents", (),
+            ):
+                values = []
+                for column, value in zip(self.FILTER_COLUMNS, tuple(row)[1:]):
+                    if column in self._NULL_FLAGS:
+                        values.append(self._NULL_FLAGS[column] if value is None else bool(value))
+                    else:
+                        values.append(None if value is None else str(value))
+                labels[row[0]] = tuple(
+                    codes.setdefault(value, len(codes)) for codes, value in zip(vocab, values)
+                )
+        finally:
+            conn.close()
+        return labels, vocab
+
+    def _filter_rows_locked(self, filters):
+        """Rows whose labels satisfy filters ({column: accepted values})."""
+        if self._label_rows is None:
+            missing = (-1,) * len(self.FILTER_COLUMNS)
+            self._label_rows = np.array(
+                [self._labels.get(chunk_id, missing) for chunk_id in self._ids], dtype=np.int32
+            ).reshape(-1, len(self.FILTER_COLUMNS))
+        mask = np.ones(len(self._ids), dtype=bool)
+        for j, column in enumerate(self.FILTER_COLUMNS):
+            accepted = filters.get(column)
+            if accepted is None:
+                continue
+            codes = [self._vocab[j][value] for value in accepted if value in self._vocab[j]]
+            mask &= np.isin(self._label_rows[:, j], codes)
+        return np.flatnonzero(mask)
+
+    # ── Updates ───────────────────────────────────────────────────────────────
+
+    def upsert(self, chunk_ids, vectors, hashes=None):
+        """Add or replace vectors for chunk ids. Vectors of the wrong size are skipped.
+
+        hashes are the rows' content_hash; without them the next refresh
+        reloads these rows once to learn them.
+        """
+        hashes = list(hashes) if hashes is not None else [None] * len(chunk_ids)
+        keep_ids, keep_vectors, keep_hashes = [], [], []
+        for chunk_id, vector, content_hash in zip(chunk_ids, vectors, hashes):
+            if vector is not None and len(vector) == self.dim:
+                keep_ids.append(chunk_id)
+                keep_vectors.append(vector)
+                keep_hashes.append(content_hash)
+        if not keep_ids:
+            return
+        with self._lock:
+            if self.state == STATE_LOADING:
+                self._replay.append(('upsert', keep_ids, keep_vectors, keep_hashes))
+            elif self.state == STATE_READY:
+                self._upsert_locked(keep_ids, keep_vectors, hashes=keep_hashes)
+
+    def changes(self) -> 'IndexChanges':
+        """A batch of upserts/removes to apply after the writing transaction commits."""
+        return IndexChanges(self)
+
+    def remove(self, chunk_ids):
+        chunk_ids = list(chunk_ids)
+        if not chunk_ids:
+            return
+        with self._lock:
+            if self.state == STATE_LOADING:
+                self._replay.append(('remove', chunk_ids, None, None))
+            elif self.state == STATE_READY:
+                self._remove_locked(chunk_ids)
+
+    def _upsert_locked(self, chunk_ids, vectors, normalized=False, hashes=None):
+        block = np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim)
+        if not normalized:
+            block = self._normalize(block)
+        for i, chunk_id in enumerate(chunk_ids):
+            self._hashes[chunk_id] = hashes[i] if hashes is not None else None
+        if self._touched is not None:
+            self._touched.update(chunk_ids)
+
+        new_rows = []
+        for i, chunk_id in enumerate(chunk_ids):
+            row = self._rows.get(chunk_id)
+            if row is None:
+                new_rows.append(i)
+            else:
+                self._matrix[row] = block[i]
+        if not new_rows:
+            return
+
+        count = len(self._ids)
+        needed = count + len(new_rows)
+        if needed > self._matrix.shape[0]:
+            # Grow geometrically so a sync of many small documents does not
+            # copy the whole matrix once per document.
+            capacity = max(needed, self._matrix.shape[0] * 2, 1024)
+            grown = np.empty((capacity, self.dim), dtype=np.float32)
+            grown[:count] = self._matrix[:count]
+            self._matrix = grown
+        self._matrix[count:needed] = block[new_rows]
+        for offset, i in enumerate(new_rows):
+            self._rows[chunk_ids[i]] = count + offset
+            self._ids.append(chunk_ids[i])
+        self._label_rows = None
+
+    def _remove_locked(self, chunk_ids):
+        for chunk_id in chunk_ids:
+            if self._touched is not None:
+                self._touched.add(chunk_id)
+            self._hashes.pop(chunk_id, None)
+            row = self._rows.pop(chunk_id, None)
+            if row is None:
+                continue
+            # Move the last row into the hole so live rows stay contiguous.
+            last = len(self._ids) - 1
+            if row != last:
+                moved = self._ids[last]
+                self._matrix[row] = self._matrix[last]
+                self._ids[row] = moved
+                self._rows[moved] = row
+            self._ids.pop()
+            self._label_rows = None
+
+    # ── Search ────────────────────────────────────────────────────────────────
+
+    def search(self, query_vector, k: int, filters=None, exclude=None):
+        """Top-k (chunk_id, cosine score) pairs, best first.
+
+        filters, when given, maps FILTER_COLUMNS to the values accepted for
+        each (flags as bools) and restricts the ranking to matching rows;
+        exclude is a collection of chunk ids left out of it.
+        None when the index is not ready — the caller should do the exact scan.
+        """
+        if not self.ready:
+            return None
+        self._maybe_refresh()
+        if filters and not self._current_labels():
+            return None
+        query = self._normalize(np.asarray(query_vector, dtype=np.float32).reshape(1, -1))[0]
+        if query.shape[0] != self.dim:
+            return None
+
+        with self._lock:
+            rows = self._filter_rows_locked(filters) if filters else None
+            if exclude:
+                dropped = [self._rows[c] for c in exclude if c in self._rows]
+                if dropped:
+                    if rows is None:
+                        rows = np.arange(len(self._ids))
+                    rows = rows[~np.isin(rows, dropped)]
+            count = len(self._ids) if rows is None else len(rows)
+            if count == 0 or k <= 0:
+                return []
+            # Score every row and pick the subset from the scores: indexing the
+            # matrix by rows first would copy those vectors, most of the corpus
+            # for a typical filter.
+            scores = self._matrix[:len(self._ids)] @ query
+            if rows is not None:
+                scores = scores[rows]
+            k = min(k, count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            if rows is not None:
+                return [(self._ids[rows[i]], float(scores[i])) for i in top]
+            return [(self._ids[i], float(scores[i])) for i in top]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'state': self.state,
+                'vectors': len(self._ids),
+                'memory_mb': round(len(self._ids) * self.dim * 4 / (1024 * 1024), 1),
+                'labelled': len(self._labels) if self._labels is not None else None,
+                'loaded_at': self.loaded_at,
+            }
+
+    @staticmethod
+    def _normalize(matrix, out=None):
+        # einsum, unlike linalg.norm, builds no matrix-sized temporary.
+        norms = np.sqrt(np.einsum('ij,ij->i', matrix, matrix))[:, None]
+        # A zero vector scores 0 against everything, as the exact scan does.
+        norms[norms == 0] = 1.0
+        return np.divide(matrix, norms, out=out)
+
+
+class IndexChanges:
+    """Index updates made by one transaction, held until it commits.
+
+    Call apply() after the commit; on a rollback just drop the object.
+    """
+
+    def __init__(self, index: VectorIndex):
+        self.index = index
+        self._ops = []
+
+    def upsert(self, chunk_ids, vectors, hashes=None):
+        self._ops.append(('upsert', list(chunk_ids), list(vectors), hashes))
+
+    def remove(self, chunk_ids):
+        self._ops.append(('remove', list(chunk_ids), None, None))
+
+    def apply(self):
+        # In order: a re-ingest removes a document's chunks, then writes them again.
+        ops, self._ops = self._ops, []
+        for op, chunk_ids, vectors, hashes in ops:
+            if op == 'upsert':
+                self.index.upsert(chunk_ids, vectors, hashes)
+            else:
+                self.index.remove(chunk_ids)
+
+
+def _stream_rows(conn, name, batch_size, sql, params):
+    """Yield rows of a large SELECT a batch at a time.
+
+    On Postgres through a named cursor, as in RAGService._scan_search: the
+    result stays server-side, where a plain cursor buffers all of it on
+    execute(). Plain cursor: tuples on Postgres, sqlite3.Row on SQLite — both
+    index by position.
+    """
+    from db import SQLiteConnectionProxy
+
+    if isinstance(conn, SQLiteConnectionProxy):
+        cur = conn.cursor()
+    else:
+        cur = conn.cursor(name=name)
+        cur.itersize = batch_size
+    try:
+        cur.execute(sql, params)
+        while True:
+            batch = cur.fetchmany(batch_size)
+            if not batch:
+                break
+            yield from batch
+    finally:
+        cur.close()
+
+
+# One index per process: RAGService is constructed in several places (the app,
+# the Ask Yoda MCP tool per call), and each holding its own copy of the corpus
+# would multiply the memory and the warm-up.
+_shared_index = None
+_shared_lock = threading.Lock()
+
+
+def get_vector_index(model: str, dim: int) -> VectorIndex:
+    global _shared_index
+    with _shared_lock:
+        if _shared_index is None:
+            _shared_index = VectorIndex(model, dim)
+        return _shared_index
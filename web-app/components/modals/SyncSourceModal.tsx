@@ -197,13 +197,28 @@ export default function SyncSourceModal({ isOpen, onClose, onSyncComplete, preSe
                     }))
                 })
 
+                // The sync runs as a background job; poll its counters until it
+                // finishes, then read the per-document results once
+                let job = res.data.job
+                while (job && ['enumerating', 'queued', 'running'].includes(job.status)) {
+                    await new Promise(resolve => setTimeout(resolve, 2000))
+                    job = (await axios.get(`/api/sync/jobs/${res.data.jobId}?items=false`)).data
+                }
+                if (job) {
+                    job = (await axios.get(`/api/sync/jobs/${res.data.jobId}`)).data
+                }
+
                 // Count updated vs newly added
-                const results = res.data.results || []
+                const results = job
+                    ? (job.items || []).map((item: any) => item.result).filter(Boolean)
+                    : res.data.results || []
                 const updated = results.filter((r: any) => r.wasExisting).length
                 const added = results.filter((r: any) => !r.wasExisting && r.status === 'success').length
 
                 setSyncResult({
-                    message: res.data.message,
+                    message: job
+                        ? `Sync ${job.status}: ${job.succeeded} of ${job.total} documents synced${job.failed ? `, ${job.failed} failed` : ''}`
+                        : res.data.message,
                     count: results.length,
                     updated: updated,
                     added: added
@@ -46,6 +46,8 @@ interface PaginationMeta {
     page: number
     page_size: number
     total_pages: number
+    // Keyset token for the page after this one; null on the last page.
+    next_cursor: string | null
 }
 
 const PAGE_SIZE = 10
@@ -89,7 +91,7 @@ const isViewableDocument = (doc: Document) => {
 export default function DocumentHubPage() {
     const [documents, setDocuments] = useState<Document[]>([])
     const [isLoading, setIsLoading] = useState(true)
-    const [pagination, setPagination] = useState<PaginationMeta>({ total: 0, page: 1, page_size: PAGE_SIZE, total_pages: 1 })
+    const [pagination, setPagination] = useState<PaginationMeta>({ total: 0, page: 1, page_size: PAGE_SIZE, total_pages: 1, next_cursor: null })
 
     // Server-side filters
     const [search, setSearch] = useState('')
@@ -127,11 +129,12 @@ export default function DocumentHubPage() {
     // Debounce search input
     const searchDebounceRef = useRef<ReturnType<typeof setTimeout> | null>(null)
 
-    const fetchDocuments = useCallback(async (page: number = 1) => {
+    const fetchDocuments = useCallback(async (page: number = 1, cursor: string | null = null) => {
         setIsLoading(true)
         try {
             const params = new URLSearchParams()
             params.set('page', String(page))
+            if (cursor) params.set('cursor', cursor)
             params.set('page_size', String(PAGE_SIZE))
             if (search) params.set('search', search)
             if (sourceFilter) params.set('source', sourceFilter)
@@ -143,7 +146,7 @@ export default function DocumentHubPage() {
             if (!latestOnly) params.set('latest_only', 'false')
 
             const res = await axios.get(`/api/documents?${params.toString()}`)
-            const { documents: rawDocs, total, total_pages, page: pg, page_size } = res.data
+            const { documents: rawDocs, total, total_pages, page: pg, page_size, next_cursor } = res.data
 
             const mappedDocs: Document[] = (rawDocs ?? []).map((doc: any) => {
                 const docId = doc.documentId || doc.document_id || doc.uuid || doc.id || doc.name || doc.filename
@@ -175,7 +178,7 @@ export default function DocumentHubPage() {
             })
 
             setDocuments(mappedDocs)
-            setPagination({ total: total ?? 0, page: pg ?? page, page_size: page_size ?? PAGE_SIZE, total_pages: total_pages ?? 1 })
+            setPagination({ total: total ?? 0, page: pg ?? page, page_size: page_size ?? PAGE_SIZE, total_pages: total_pages ?? 1, next_cursor: next_cursor ?? null })
             setCurrentPage(pg ?? page)
         } catch (err) {
             console.error('Failed to fetch documents:', err)
@@ -287,7 +290,9 @@ export default function DocumentHubPage() {
 
     const goToPage = (page: number) => {
         if (page < 1 || page > pagination.total_pages) return
-        fetchDocuments(page)
+        // Stepping forward resumes from the last row (keyset); jumps use the page number.
+        const cursor = page === pagination.page + 1 ? pagination.next_cursor : null
+        fetchDocuments(page, cursor)
     }
 
     const loadDocumentContent = async (docId: string, docName: string, version?: number) => {
@@ -796,9 +801,11 @@ export default function DocumentHubPage() {
                                                         ? 'Set manually'
                                                         : doc.sapModuleMethod === 'scope_map'
                                                             ? 'Derived from the CALM scope'
-                                                            : doc.sapModuleMethod === 'llm'
-                                                                ? 'Suggested by AI — confirm to lock it in'
-                                                                : 'Not classified yet'
+                                                            : doc.sapModuleMethod === 'vector'
+                                                                ? 'Matched to similar classified documents — confirm to lock it in'
+                                                                : doc.sapModuleMethod === 'llm'
+                                                                    ? 'Suggested by AI — confirm to lock it in'
+                                                                    : 'Not classified yet'
                                                 }
                                             >
                                                 {moduleOptions.map(m => (